@@ -1,36 +1,40 @@
 import os
+import hmac
+import time
+import uuid
+import asyncio
 import logging
+import tempfile
 
-from sqlalchemy import create_engine, text
+from aiohttp import web
 from aiogram import Bot, Dispatcher, executor, types
-import re
-from datetime import datetime
+from aiogram.bot.api import TELEGRAM_PRODUCTION, TelegramAPIServer
+from aiogram.dispatcher.handler import CancelHandler, current_handler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+from aiogram.dispatcher.webhook import WebhookRequestHandler
+from aiogram.utils.exceptions import MessageNotModified
+
+import cases_io
+import metrics
+from callbacks import CallbackRouter
+from i18n import DEFAULT_LANG, LocaleBundle, language_keyboard, load_bundles, text_variants
+from log_setup import setup_logging
+from outbox import Outbox
+from pedigree import KinshipTimeout
+from scheduler import UpdateScheduler, update_user_id
+from state_store import create_session_store
+from storage import CaseRepository, create_engine_for
+from validation import CASE_FIELDS, is_case_minimal_ok, is_valid_birth_date, is_valid_pedigree_url
+from wizard import ASK_EMPTY, ERROR, EXIT, MOVE, PROMPT, Step, Transition, Wizard
 
 
 # --- Admin users ---
 ADMINS = {5059876030}
 
 # --- Database init ---
-engine = create_engine("sqlite:///epibot.db", echo=False)
-
-# --- Ensure table exists ---
-with engine.connect() as connection:
-    connection.execute(text("""
-    CREATE TABLE IF NOT EXISTS cases (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id INTEGER,
-        dog_name TEXT,
-        dog_pedigree_url TEXT,
-        dam_name TEXT,
-        dam_pedigree_url TEXT,
-        sire_name TEXT,
-        sire_pedigree_url TEXT,
-        sex TEXT,
-        birth_date TEXT,
-        timestamp TEXT
-    );
-    """))
-    connection.commit()
+# Таблица создаётся в on_startup, все запросы идут через асинхронный репозиторий
+case_repo = CaseRepository(create_engine_for())
+metrics.instrument_engine(case_repo.engine)
 
 
 # --- Token ---
@@ -44,15 +48,60 @@ if not API_TOKEN:
 
 LOCKFILE = "/tmp/epibot.lock"
 
-# --- In-memory language storage (per process only) ---
-
-user_lang = {}             # язык пользователя
-user_add_case_state = {}   # состояние анкеты по собаке
-user_add_case_data = {}    # временные данные по собакам
-user_add_case_substate = {}      # подстатус, например подтверждение пустого поля
-user_add_case_empty_field = {}   # какое поле сейчас подтверждаем как пустое
-user_search_state = {}        # uid -> "dog_name" or None
-user_search_results = {}      # uid -> list of last search results
+# --- Transport ---
+# EPIBOT_MODE=polling (по умолчанию) или webhook. В режиме webhook апдейты и
+# проверка здоровья обслуживаются одним aiohttp-сервером на порту PORT.
+# EPIBOT_API_SERVER позволяет направить бота на локальный Bot API сервер
+# (или фейковый сервер в тестах), например http://127.0.0.1:8081
+
+BOT_MODE = os.getenv("EPIBOT_MODE", "polling")
+API_SERVER = os.getenv("EPIBOT_API_SERVER")
+
+WEB_HOST = os.getenv("EPIBOT_WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("PORT", 10000))
+
+WEBHOOK_HOST = os.getenv("EPIBOT_WEBHOOK_HOST") or os.getenv("RENDER_EXTERNAL_URL")
+WEBHOOK_PATH = os.getenv("EPIBOT_WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("EPIBOT_WEBHOOK_SECRET")
+
+# /readyz: сколько секунд без успешного getUpdates считаем нормой
+# (long polling держит запрос до 20 секунд) и сколько ждём ответа базы
+READY_MAX_FETCH_AGE = int(os.getenv("EPIBOT_READY_MAX_FETCH_AGE", 90))
+READY_DB_TIMEOUT = float(os.getenv("EPIBOT_READY_DB_TIMEOUT", 2))
+
+# Обработка апдейтов: столько воркеров и не больше стольких апдейтов в очереди.
+# Когда очередь полна, polling не запрашивает новые апдейты, а webhook
+# отвечает Telegram с задержкой.
+UPDATE_WORKERS = int(os.getenv("EPIBOT_UPDATE_WORKERS", 16))
+UPDATE_QUEUE_SIZE = int(os.getenv("EPIBOT_UPDATE_QUEUE", 1000))
+POLLING_LIMIT = 100  # апдейтов за один getUpdates (максимум Telegram)
+
+if BOT_MODE not in ("polling", "webhook"):
+    raise RuntimeError(f"Unknown EPIBOT_MODE: {BOT_MODE!r}. Use polling or webhook.")
+
+if BOT_MODE == "webhook" and not WEBHOOK_HOST:
+    raise RuntimeError("EPIBOT_WEBHOOK_HOST is missing. Set the public https URL of the service.")
+
+# --- User sessions (language, add case form, search) ---
+# EPIBOT_SESSION_BACKEND=sqlite сохраняет незаконченные анкеты между перезапусками,
+# memory держит всё в памяти процесса.
+
+SESSION_BACKEND = os.getenv("EPIBOT_SESSION_BACKEND", "sqlite")
+SESSION_TTL = int(os.getenv("EPIBOT_SESSION_TTL", 7 * 24 * 3600))
+SESSION_MAX_SIZE = int(os.getenv("EPIBOT_SESSION_MAX_SIZE", 10_000))
+# брошенная анкета и результаты поиска живут меньше, чем выбранный язык
+SESSION_FORM_TTL = int(os.getenv("EPIBOT_SESSION_FORM_TTL", 24 * 3600))
+SESSION_SEARCH_TTL = int(os.getenv("EPIBOT_SESSION_SEARCH_TTL", 30 * 60))
+SESSION_SWEEP_INTERVAL = int(os.getenv("EPIBOT_SESSION_SWEEP_INTERVAL", 60))
+
+sessions = create_session_store(
+    SESSION_BACKEND,
+    case_repo.engine,
+    ttl=SESSION_TTL,
+    max_size=SESSION_MAX_SIZE,
+    form_ttl=SESSION_FORM_TTL,
+    search_ttl=SESSION_SEARCH_TTL,
+)
 
 
 # --- FSM for add case ---
@@ -64,721 +113,545 @@ ADD_STATE_SEX = "sex"
 ADD_STATE_BIRTH = "birth_date"
 
 ADD_SUBSTATE_EMPTY_CONFIRM = "empty_confirm"
+ADD_SUBSTATE_DUPLICATE_CONFIRM = "duplicate_confirm"
 ADD_STATE_CONFIRM = "confirm"
 
-PEDIGREE_PREFIX = "https://canecorsopedigree.com/"
+# --- Callback data ---
+# Действия inline-кнопок: имя (оно же старый формат callback data), короткий
+# код и типы аргументов. Разбор и выбор хендлера - в callback_router.
+
+callback_router = CallbackRouter()
+
+CB_ADD_BACK = callback_router.action("add_back", "ab")
+CB_ADD_CANCEL = callback_router.action("add_cancel", "ac")
+CB_ADD_NEXT = callback_router.action("add_next", "an")
+
+CB_ADD_CANCEL_YES = callback_router.action("add_cancel_yes", "acy")
+CB_ADD_CANCEL_NO = callback_router.action("add_cancel_no", "acn")
+
+CB_ADD_EMPTY_YES = callback_router.action("add_empty_yes", "aey")
+CB_ADD_EMPTY_NO = callback_router.action("add_empty_no", "aen")
+
+# аргумент - male или female; старые "add_sex_male" разбираются так же
+CB_ADD_SEX = callback_router.action("add_sex", "sx", str)
+
+CB_ADD_CONFIRM_SAVE = callback_router.action("add_confirm_save", "asv")
+# экран «такая собака уже есть»: сохранить всё равно или вернуться к проверке
+CB_ADD_SAVE_ANYWAY = callback_router.action("add_save_anyway", "asa")
+CB_ADD_DUPLICATE_BACK = callback_router.action("add_duplicate_back", "adb")
+
+CB_DOGS_ADD = callback_router.action("dogs_add", "da")
+CB_DOGS_SEARCH = callback_router.action("dogs_search", "ds")
+CB_DOGS_SEARCH_BACK = callback_router.action("dogs_search_back", "dsb")
+CB_DOGS_SEARCH_REPEAT = callback_router.action("dogs_search_repeat", "dsr")
+
+CB_CASE_SHOW = callback_router.action("case_show", "cs", int)
+CB_CASE_REL = callback_router.action("case_rel", "cr", int)
+CB_SEARCH_BACK_TO_RESULTS = callback_router.action("search_back_to_results", "sbr")
+
+SEX_TEXT_KEYS = {"male": "sex.male", "female": "sex.female"}
+
+# --- Localized texts and keyboards ---
+# Тексты лежат в locales/*.json. Раскладки клавиатур одинаковы для всех
+# языков и ссылаются на ключи текстов; при старте из них один раз собираются
+# готовые JSON-клавиатуры для каждого языка.
+
+NAV_ROW = [("nav.back", CB_ADD_BACK.pack()), ("nav.cancel", CB_ADD_CANCEL.pack()), ("nav.next", CB_ADD_NEXT.pack())]
+
+INLINE_KEYBOARDS = {
+    "dogs_menu": [
+        [("dogs_menu.add", CB_DOGS_ADD.pack())],
+        [("dogs_menu.search", CB_DOGS_SEARCH.pack())],
+    ],
+    "add_nav": [NAV_ROW],
+    "add_nav_sex": [
+        NAV_ROW,
+        [("sex.male", CB_ADD_SEX.pack("male")), ("sex.female", CB_ADD_SEX.pack("female"))],
+    ],
+    "add_nav_confirm": [
+        [
+            ("nav.back", CB_ADD_BACK.pack()),
+            ("nav.cancel", CB_ADD_CANCEL.pack()),
+            ("nav.save", CB_ADD_CONFIRM_SAVE.pack()),
+        ],
+    ],
+    "empty_field_confirm": [[("empty_field.yes", CB_ADD_EMPTY_YES.pack()), ("empty_field.no", CB_ADD_EMPTY_NO.pack())]],
+    "cancel_confirm": [[("cancel.yes", CB_ADD_CANCEL_YES.pack()), ("cancel.no", CB_ADD_CANCEL_NO.pack())]],
+    "search_not_found": [
+        [("search.repeat", CB_DOGS_SEARCH_REPEAT.pack())],
+        [("dogs_menu.back", CB_DOGS_SEARCH_BACK.pack())],
+    ],
+    "back_to_dogs_menu": [[("dogs_menu.back", CB_DOGS_SEARCH_BACK.pack())]],
+}
+
+REPLY_KEYBOARDS = {
+    "main_menu": [["menu.help", "menu.add_case"]],
+    "add_case_nav": [["menu.back_to_bot", "menu.continue"]],
+    "add_case_back_only": [["menu.back_to_bot"]],
+}
+
+LOCALES = load_bundles(INLINE_KEYBOARDS, REPLY_KEYBOARDS)
+
+# выбор языка показывается сразу на всех языках
+LANGUAGE_BY_NAME = {bundle.text("language.name"): lang for lang, bundle in LOCALES.items()}
+LANGUAGE_PROMPT = "\n".join(bundle.text("language.prompt") for bundle in LOCALES.values())
+LANGUAGE_KEYBOARD = language_keyboard(LOCALES)
+
+# тексты reply-кнопок на всех языках для фильтров хендлеров
+ADD_CASE_TEXTS = text_variants(LOCALES, "menu.add_case")
+BACK_TO_BOT_TEXTS = text_variants(LOCALES, "menu.back_to_bot")
+CONTINUE_TEXTS = text_variants(LOCALES, "menu.continue")
 
-CB_ADD_BACK = "add_back"
-CB_ADD_CANCEL = "add_cancel"
-CB_ADD_NEXT = "add_next"
 
-CB_ADD_CANCEL_YES = "add_cancel_yes"
-CB_ADD_CANCEL_NO = "add_cancel_no"
-
-CB_ADD_EMPTY_YES = "add_empty_yes"
-CB_ADD_EMPTY_NO = "add_empty_no"
+def get_user_lang(uid: int) -> str:
+    lang = sessions.get(uid).lang
+    return lang if lang in LOCALES else DEFAULT_LANG
 
-CB_ADD_SEX_MALE = "add_sex_male"
-CB_ADD_SEX_FEMALE = "add_sex_female"
 
-CB_ADD_CONFIRM_SAVE = "add_confirm_save"
+def display_value(texts: LocaleBundle, value, missing_key: str) -> str:
+    """Значение поля для показа пользователю или заглушка «не указано»."""
+    if not value or not str(value).strip():
+        return texts.text(missing_key)
+    return str(value).strip()
 
-def dogs_menu_text(lang: str = "ru") -> str:
-    if lang == "en":
-        return (
-            "Dog menu.\n\n"
-            "You can add a new dog or search an existing one."
-        )
-    else:
-        return (
-            "Меню работы с собаками.\n\n"
-            "Вы можете добавить новую собаку или найти уже сохранённую."
-        )
 
-def dogs_menu_keyboard(lang: str = "ru") -> types.InlineKeyboardMarkup:
-    if lang == "en":
-        add_text = "Add dog"
-        search_text = "Find dog"
-    else:
-        add_text = "Добавить собаку"
-        search_text = "Найти собаку"
+def build_confirm_text(lang: str, data: dict) -> str:
+    texts = LOCALES[lang]
+    return texts.text(
+        "confirm.text",
+        dog_name=display_value(texts, data.get("dog_name"), "value.no_name"),
+        dam_name=display_value(texts, data.get("dam_name"), "value.no_name"),
+        sire_name=display_value(texts, data.get("sire_name"), "value.no_name"),
+        sex=display_value(texts, data.get("sex"), "value.no_sex"),
+        birth_date=display_value(texts, data.get("birth_date"), "value.no_date"),
+        dog_url=display_value(texts, data.get("dog_pedigree_url"), "value.no_link"),
+        dam_url=display_value(texts, data.get("dam_pedigree_url"), "value.no_link"),
+        sire_url=display_value(texts, data.get("sire_pedigree_url"), "value.no_link"),
+    )
 
-    kb = types.InlineKeyboardMarkup()
-    kb.add(types.InlineKeyboardButton(add_text, callback_data="dogs_add"))
-    kb.add(types.InlineKeyboardButton(search_text, callback_data="dogs_search"))
-    return kb
 
+# --- Add case form steps ---
+# Порядок шагов, поля и экраны анкеты. Что делать с сообщением или кнопкой
+# «Назад»/«Далее», решает ADD_CASE по этой таблице.
+
+URL_CHECK = (is_valid_pedigree_url, "error.url")
+
+ADD_CASE = Wizard([
+    Step(
+        ADD_STATE_DOG, "step.dog", "add_nav",
+        next=ADD_STATE_DAM,
+        fields=("dog_name", "dog_pedigree_url"),
+        validators={"dog_pedigree_url": URL_CHECK},
+        required={"dog_name": "error.dog_name_required"},
+    ),
+    Step(
+        ADD_STATE_DAM, "step.dam", "add_nav",
+        prev=ADD_STATE_DOG, next=ADD_STATE_SIRE,
+        fields=("dam_name", "dam_pedigree_url"),
+        validators={"dam_pedigree_url": URL_CHECK},
+        confirm_empty=("dam_name", "dam_pedigree_url"),
+    ),
+    Step(
+        ADD_STATE_SIRE, "step.sire", "add_nav",
+        prev=ADD_STATE_DAM, next=ADD_STATE_SEX,
+        fields=("sire_name", "sire_pedigree_url"),
+        validators={"sire_pedigree_url": URL_CHECK},
+        confirm_empty=("sire_name", "sire_pedigree_url"),
+    ),
+    # пол выбирается только кнопками
+    Step(
+        ADD_STATE_SEX, "step.sex", "add_nav_sex",
+        prev=ADD_STATE_SIRE, next=ADD_STATE_BIRTH,
+        confirm_empty=("sex",),
+    ),
+    Step(
+        ADD_STATE_BIRTH, "step.birth", "add_nav",
+        prev=ADD_STATE_SEX, next=ADD_STATE_CONFIRM,
+        fields=("birth_date",),
+        validators={"birth_date": (is_valid_birth_date, "error.date_format")},
+    ),
+    Step(
+        ADD_STATE_CONFIRM, "confirm.text", "add_nav_confirm",
+        prev=ADD_STATE_BIRTH,
+        render=build_confirm_text,
+    ),
+])
+
+# при старте - только быстрая проверка ссылок и ключей локали,
+# обход всех путей по анкете - в tests/test_wizard.py
+ADD_CASE.check_structure(
+    text_keys=LOCALES[DEFAULT_LANG].texts,
+    keyboards=LOCALES[DEFAULT_LANG].keyboards,
+)
 
-def add_case_inline_nav(lang: str = "ru") -> types.InlineKeyboardMarkup:
-    if lang == "en":
-        back_text = "Back"
-        cancel_text = "Cancel"
-        next_text = "Next"
-    else:
-        back_text = "Назад"
-        cancel_text = "Отмена"
-        next_text = "Вперёд"
-
-    kb = types.InlineKeyboardMarkup()
-    kb.add(
-        types.InlineKeyboardButton(back_text, callback_data=CB_ADD_BACK),
-        types.InlineKeyboardButton(cancel_text, callback_data=CB_ADD_CANCEL),
-        types.InlineKeyboardButton(next_text, callback_data=CB_ADD_NEXT),
-    )
-    return kb
 
+def step_screen(uid: int) -> tuple:
+    """Текст и клавиатура текущего шага анкеты."""
+    lang = get_user_lang(uid)
+    texts = LOCALES[lang]
+    session = sessions.get(uid)
+    step = ADD_CASE.step(session.add_state)
 
-def add_case_inline_nav_with_sex(lang: str = "ru") -> types.InlineKeyboardMarkup:
-    if lang == "en":
-        back_text = "Back"
-        cancel_text = "Cancel"
-        next_text = "Next"
-        male_text = "Male"
-        female_text = "Female"
+    if step.render is not None:
+        text = step.render(lang, session.add_data)
     else:
-        back_text = "Назад"
-        cancel_text = "Отмена"
-        next_text = "Вперёд"
-        male_text = "Кобель"
-        female_text = "Сука"
+        text = texts.text(step.text_key)
+    return text, texts.keyboard(step.keyboard)
 
-    
 
-    kb = types.InlineKeyboardMarkup()
-    kb.row(
-        types.InlineKeyboardButton(back_text, callback_data=CB_ADD_BACK),
-        types.InlineKeyboardButton(cancel_text, callback_data=CB_ADD_CANCEL),
-        types.InlineKeyboardButton(next_text, callback_data=CB_ADD_NEXT),
-    )
-    kb.row(
-        types.InlineKeyboardButton(male_text, callback_data=CB_ADD_SEX_MALE),
-        types.InlineKeyboardButton(female_text, callback_data=CB_ADD_SEX_FEMALE),
-    )
-    return kb
+async def send_dogs_menu_from_message(message: types.Message, uid: int):
+    lang = get_user_lang(uid)
 
-def add_case_inline_nav_confirm(lang: str = "ru") -> types.InlineKeyboardMarkup:
-    if lang == "en":
-        back_text = "Back"
-        cancel_text = "Cancel"
-        save_text = "Save"
-    else:
-        back_text = "Назад"
-        cancel_text = "Отмена"
-        save_text = "Сохранить"
+    # reset state
+    sessions.get(uid).reset_dog_flow()
 
-    kb = types.InlineKeyboardMarkup()
-    kb.add(
-        types.InlineKeyboardButton(back_text, callback_data=CB_ADD_BACK),
-        types.InlineKeyboardButton(cancel_text, callback_data=CB_ADD_CANCEL),
-        types.InlineKeyboardButton(save_text, callback_data=CB_ADD_CONFIRM_SAVE),
-    )
-    return kb
+    texts = LOCALES[lang]
+    await message.answer(texts.text("dogs_menu.text"), reply_markup=texts.keyboard("dogs_menu"))
 
 
-def empty_field_confirm_keyboard(lang: str = "ru") -> types.InlineKeyboardMarkup:
-    if lang == "en":
-        yes_text = "Yes, leave empty"
-        no_text = "No, go back"
-    else:
-        yes_text = "Да, оставить пустым"
-        no_text = "Нет, вернуться к вводу"
+async def send_dogs_menu_from_query(query: types.CallbackQuery, uid: int):
+    lang = get_user_lang(uid)
 
-    kb = types.InlineKeyboardMarkup()
-    kb.add(
-        types.InlineKeyboardButton(yes_text, callback_data=CB_ADD_EMPTY_YES),
-        types.InlineKeyboardButton(no_text, callback_data=CB_ADD_EMPTY_NO),
-    )
-    return kb
+    # reset state
+    sessions.get(uid).reset_dog_flow()
 
-def cancel_confirm_keyboard(lang: str = "ru") -> types.InlineKeyboardMarkup:
-    if lang == "en":
-        yes_text = "Yes"
-        no_text = "No"
-    else:
-        yes_text = "Да"
-        no_text = "Нет"
+    texts = LOCALES[lang]
+    await query.message.answer(texts.text("dogs_menu.text"), reply_markup=texts.keyboard("dogs_menu"))
 
-    kb = types.InlineKeyboardMarkup()
-    kb.add(
-        types.InlineKeyboardButton(yes_text, callback_data=CB_ADD_CANCEL_YES),
-        types.InlineKeyboardButton(no_text, callback_data=CB_ADD_CANCEL_NO),
-    )
-    return kb
 
+async def start_dog_search(query: types.CallbackQuery, uid: int):
+    lang = get_user_lang(uid)
 
+    # reset add case state when starting search
+    session = sessions.get(uid)
+    session.reset_add_case()
 
-def get_user_lang(uid: int) -> str:
-    lang = user_lang.get(uid, "ru")
-    return "en" if lang == "en" else "ru"
+    session.search_state = "dog_name"
+    session.search_results = []
 
+    await query.message.answer(LOCALES[lang].text("search.prompt"))
 
-def is_valid_birth_date(s: str) -> bool:
-    if not re.fullmatch(r"\d{4}\.\d{2}\.\d{2}", s):
-        return False
-    year = int(s[0:4])
-    month = int(s[5:7])
-    day = int(s[8:10])
-    try:
-        datetime(year, month, day)
-    except ValueError:
-        return False
-    return True
 
+async def send_search_results_list(message: types.Message, results: list, lang: str):
+    texts = LOCALES[lang]
 
-def is_valid_pedigree_url(url: str) -> bool:
-    return url.startswith(PEDIGREE_PREFIX)
+    lines = [texts.text("search.results_header"), ""]
+    for idx, row in enumerate(results, start=1):
+        lines.append(texts.text(
+            "search.result_line",
+            idx=idx,
+            dog_name=row["dog_name"],
+            dam_name=row["dam_name"] or texts.text("value.no_name"),
+            sire_name=row["sire_name"] or texts.text("value.no_name"),
+        ))
 
+    text = "\n".join(lines)
 
-def is_case_minimal_ok(data: dict) -> bool:
-    dog_name = (data.get("dog_name") or "").strip()
-    if not dog_name:
-        return False
+    kb = types.InlineKeyboardMarkup()
+    for row in results:
+        kb.add(types.InlineKeyboardButton(row["dog_name"], callback_data=CB_CASE_SHOW.pack(row["id"])))
 
-    links = [
-        (data.get("dog_pedigree_url") or "").strip(),
-        (data.get("dam_pedigree_url") or "").strip(),
-        (data.get("sire_pedigree_url") or "").strip(),
-    ]
-    has_link = any(links)
+    kb.add(types.InlineKeyboardButton(texts.text("dogs_menu.back"), callback_data=CB_DOGS_SEARCH_BACK.pack()))
 
-    if has_link:
-        return True
+    await message.answer(text, reply_markup=kb)
 
-    dam_name = (data.get("dam_name") or "").strip()
-    sire_name = (data.get("sire_name") or "").strip()
-    if not dam_name or not sire_name:
-        return False
 
-    return True
+async def show_dog_card(message: types.Message, case_id: int, uid: int, lang: str):
+    texts = LOCALES[lang]
+    case = await case_repo.get_case(case_id)
 
-def dog_step_intro(lang: str) -> str:
-    if lang == "en":
-        return (
-            "Step 1. Dog.\n\n"
-            "Send the dog's name in one message.\n"
-            "If there is a pedigree link, send it as a separate message.\n"
-            "When you finish this block, press “Next”."
-        )
-    else:
-        return (
-            "Шаг 1. Собака.\n\n"
-            "Сначала отправьте кличку собаки одним сообщением.\n"
-            "Если есть ссылка на родословную, отправьте её отдельным сообщением.\n"
-            "Когда закончите с этим блоком (имя и ссылка), нажмите «Вперёд»."
-        )
+    if not case:
+        await message.answer(texts.text("card.not_found"))
+        return
 
+    text_out = texts.text(
+        "card.text",
+        dog_name=display_value(texts, case["dog_name"], "value.no_name"),
+        sex=display_value(texts, case["sex"], "value.no_sex"),
+        birth_date=display_value(texts, case["birth_date"], "value.no_date"),
+        dam_name=display_value(texts, case["dam_name"], "value.no_name"),
+        sire_name=display_value(texts, case["sire_name"], "value.no_name"),
+        dog_url=display_value(texts, case["dog_pedigree_url"], "value.no_link"),
+        dam_url=display_value(texts, case["dam_pedigree_url"], "value.no_link"),
+        sire_url=display_value(texts, case["sire_pedigree_url"], "value.no_link"),
+    )
 
-def dam_step_intro(lang: str) -> str:
-    if lang == "en":
-        return (
-            "Step 2. Dam (mother).\n\n"
-            "Send the dam's name in one message.\n"
-            "If there is a pedigree link, send it as a separate message.\n"
-            "When you finish this block, press “Next”."
-        )
-    else:
-        return (
-            "Шаг 2. Мать.\n\n"
-            "Отправьте кличку мамы одним сообщением.\n"
-            "Если есть ссылка на родословную мамы, отправьте её отдельным сообщением.\n"
-            "Когда закончите с этим блоком, нажмите «Вперёд»."
-        )
+    kb = types.InlineKeyboardMarkup()
+    if case["dog_id"]:
+        kb.add(types.InlineKeyboardButton(texts.text("card.related"), callback_data=CB_CASE_REL.pack(case_id)))
+    results = sessions.get(uid).search_results
+    if results and len(results) > 1:
+        kb.add(types.InlineKeyboardButton(texts.text("card.back_to_results"), callback_data=CB_SEARCH_BACK_TO_RESULTS.pack()))
+    kb.add(types.InlineKeyboardButton(texts.text("dogs_menu.back"), callback_data=CB_DOGS_SEARCH_BACK.pack()))
 
+    await message.answer(text_out, reply_markup=kb)
 
-def sire_step_intro(lang: str) -> str:
-    if lang == "en":
-        return (
-            "Step 3. Sire (father).\n\n"
-            "Send the sire's name in one message.\n"
-            "If there is a pedigree link, send it as a separate message.\n"
-            "When you finish this block, press “Next”."
-        )
-    else:
-        return (
-            "Шаг 3. Отец.\n\n"
-            "Отправьте кличку папы одним сообщением.\n"
-            "Если есть ссылка на родословную папы, отправьте её отдельным сообщением.\n"
-            "Когда закончите с этим блоком, нажмите «Вперёд»."
-        )
 
+async def send_related_cases(message: types.Message, case_id: int, uid: int, lang: str):
+    texts = LOCALES[lang]
+    case = await case_repo.get_case(case_id)
+    related = await case_repo.related_cases(case["dog_id"]) if case and case["dog_id"] else []
 
-def sex_step_intro(lang: str) -> str:
-    if lang == "en":
-        return (
-            "Step 4. Sex.\n\n"
-            "Choose the dog's sex using the buttons.\n"
-            "If you want to skip this field, press “Next”."
-        )
-    else:
-        return (
-            "Шаг 4. Пол.\n\n"
-            "Выберите пол собаки с помощью кнопок ниже.\n"
-            "Если хотите пропустить поле, нажмите «Вперёд»."
-        )
+    if not related:
+        await message.answer(texts.text("related.none"), reply_markup=texts.keyboard("back_to_dogs_menu"))
+        return
 
+    lines = [texts.text("related.header", dog_name=case["dog_name"]), ""]
+    kb = types.InlineKeyboardMarkup()
 
-def birth_step_intro(lang: str) -> str:
-    if lang == "en":
-        return (
-            "Step 5. Date of birth.\n\n"
-            "Enter the date in the format YYYY.MM.DD, for example: 2021.03.27.\n"
-            "If you do not know the exact date, you can leave the field empty and press “Next”."
-        )
-    else:
-        return (
-            "Шаг 5. Дата рождения.\n\n"
-            "Введите дату рождения в формате ГГГГ.ММ.ДД, например: 2021.03.27.\n"
-            "Если точной даты нет, можно оставить поле пустым и нажать «Вперёд»."
-        )
+    for idx, row in enumerate(related, start=1):
+        if row["relation"] == "ancestor":
+            relation = texts.text("related.ancestor")
+        elif row["relation"] == "offspring":
+            relation = texts.text("related.offspring")
+        else:
+            relation = texts.text("related.common_ancestor", via_name=row["via_name"])
+        lines.append(texts.text("related.line", idx=idx, dog_name=row["dog_name"], relation=relation))
+        kb.add(types.InlineKeyboardButton(row["dog_name"], callback_data=CB_CASE_SHOW.pack(row["id"])))
 
+    kb.add(types.InlineKeyboardButton(texts.text("dogs_menu.back"), callback_data=CB_DOGS_SEARCH_BACK.pack()))
 
-def build_confirm_text(lang: str, data: dict) -> str:
-    def val(v, default_ru: str, default_en: str) -> str:
-        if not v or not str(v).strip():
-            return default_ru if lang == "ru" else default_en
-        return str(v).strip()
-
-    dog_name = val(data.get("dog_name"), "не указано", "not specified")
-    dam_name = val(data.get("dam_name"), "не указано", "not specified")
-    sire_name = val(data.get("sire_name"), "не указано", "not specified")
-    sex = val(data.get("sex"), "не указан", "not specified")
-    birth_date = val(data.get("birth_date"), "не указана", "not specified")
-
-    dog_url = val(data.get("dog_pedigree_url"), "нет", "none")
-    dam_url = val(data.get("dam_pedigree_url"), "нет", "none")
-    sire_url = val(data.get("sire_pedigree_url"), "нет", "none")
-
-    if lang == "en":
-        lines = [
-            "Check the data before saving:",
-            "",
-            f"1. Dog: {dog_name}",
-            f"2. Dam: {dam_name}",
-            f"3. Sire: {sire_name}",
-            f"4. Sex: {sex}",
-            f"5. Birth date: {birth_date}",
-            "6. Pedigree links:",
-            f"   • Dog: {dog_url}",
-            f"   • Dam: {dam_url}",
-            f"   • Sire: {sire_url}",
-        ]
-    else:
-        lines = [
-            "Проверим данные перед сохранением:",
-            "",
-            f"1. Собака: {dog_name}",
-            f"2. Мать: {dam_name}",
-            f"3. Отец: {sire_name}",
-            f"4. Пол: {sex}",
-            f"5. Дата рождения: {birth_date}",
-            "6. Ссылки:",
-            f"   • Собака: {dog_url}",
-            f"   • Мать: {dam_url}",
-            f"   • Отец: {sire_url}",
-        ]
-
-    return "\n".join(lines)
-
-
-def empty_field_warning_text(lang: str) -> str:
-    if lang == "en":
-        return (
-            "This field is currently empty. Missing data can reduce the quality of the database.\n"
-            "Do you want to leave the field empty and continue?"
-        )
-    else:
-        return (
-            "Это поле сейчас пустое. Незаполненные данные могут снизить качество базы.\n"
-            "Вы хотите оставить поле пустым и продолжить?"
-        )
+    await message.answer("\n".join(lines), reply_markup=kb)
 
 
-def cancel_confirm_text(lang: str) -> str:
-    if lang == "en":
-        return "Do you really want to cancel and go to the dog menu?"
-    else:
-        return "Вы действительно хотите отменить заполнение и выйти в меню собак?"
 
+# --- Logging ---
 
-def dog_name_required_text(lang: str) -> str:
-    if lang == "en":
-        return "Dog name is required. Please enter the name to continue."
-    else:
-        return "Кличка собаки обязательна. Укажите кличку, чтобы продолжить."
+# Записи уходят в очередь, файл и stderr пишет отдельный поток.
+# EPIBOT_LOG_FALLBACK_SAMPLE=N оставляет каждую N-ю запись о непонятых сообщениях.
+
+LOGFILE = os.getenv("EPIBOT_LOG_FILE", "epibot.log")
+log_handler = setup_logging(
+    LOGFILE,
+    level=os.getenv("EPIBOT_LOG_LEVEL", "INFO"),
+    max_bytes=int(os.getenv("EPIBOT_LOG_MAX_BYTES", 10 * 1024 * 1024)),
+    backup_count=int(os.getenv("EPIBOT_LOG_BACKUPS", 5)),
+    json_format=os.getenv("EPIBOT_LOG_FORMAT", "json") == "json",
+    sample_rate=int(os.getenv("EPIBOT_LOG_FALLBACK_SAMPLE", 10)),
+)
 
+# --- Bot init ---
 
-def date_format_error_text(lang: str) -> str:
-    if lang == "en":
-        return (
-            "Enter the date in the format YYYY.MM.DD,\n"
-            "for example: 2021.03.27"
-        )
-    else:
-        return (
-            "Введите дату рождения в формате ГГГГ.ММ.ДД,\n"
-            "например: 2021.03.27"
-        )
+# Лимиты исходящих сообщений: Telegram допускает около 30 сообщений в
+# секунду на бота и около одного в секунду в один чат (с небольшим запасом).
+outbox = Outbox(
+    global_rate=float(os.getenv("EPIBOT_OUTBOX_GLOBAL_RATE", 25)),
+    global_burst=float(os.getenv("EPIBOT_OUTBOX_GLOBAL_BURST", 30)),
+    chat_rate=float(os.getenv("EPIBOT_OUTBOX_CHAT_RATE", 1)),
+    chat_burst=float(os.getenv("EPIBOT_OUTBOX_CHAT_BURST", 3)),
+)
 
 
-def url_error_text(lang: str) -> str:
-    if lang == "en":
-        return "The link must be from canecorsopedigree.com"
-    else:
-        return "Ссылка должна быть с сайта canecorsopedigree.com"
+class TrackedBot(Bot):
+    """Bot, который замеряет вызовы Bot API и запоминает время последнего
+    успешного getUpdates."""
 
+    last_fetch = None  # time.monotonic()
 
-def insufficient_data_text(lang: str) -> str:
-    if lang == "en":
-        return (
-            "There is not enough data to save this record.\n\n"
-            "To save, you need:\n"
-            "• dog name, and\n"
-            "• either at least one pedigree link (dog or parents),\n"
-            "• or both dam and sire names if there are no links."
-        )
-    else:
-        return (
-            "Сейчас данных недостаточно для сохранения записи.\n\n"
-            "Для сохранения записи нужно:\n"
-            "• указать кличку собаки, и\n"
-            "• либо хотя бы одну ссылку на родословную (собаки или родителей),\n"
-            "• либо кличку матери и кличку отца, если ссылок нет."
-        )
+    async def request(self, method, data=None, files=None, **kwargs):
+        async def send(payload):
+            status = "error"
+            started = time.perf_counter()
+            try:
+                result = await super(TrackedBot, self).request(method, payload, files, **kwargs)
+                status = "ok"
+                return result
+            finally:
+                metrics.API_SECONDS.labels(method).observe(time.perf_counter() - started)
+                metrics.API_REQUESTS.labels(method, status).inc()
 
-async def send_dogs_menu_from_message(message: types.Message, uid: int):
-    lang = get_user_lang(uid)
+        # сообщения и правки проходят через лимиты outbox
+        return await outbox.submit(method, data, send)
 
-    # reset state
-    user_add_case_state.pop(uid, None)
-    user_add_case_data.pop(uid, None)
-    user_add_case_substate.pop(uid, None)
-    user_add_case_empty_field.pop(uid, None)
-    user_search_state.pop(uid, None)
-    user_search_results.pop(uid, None)
-
-    await message.answer(
-        dogs_menu_text(lang),
-        reply_markup=dogs_menu_keyboard(lang),
-    )
+    async def get_updates(self, *args, **kwargs):
+        # backpressure: новую пачку забираем, только когда для неё есть место
+        await update_scheduler.wait_for_room(kwargs.get("limit") or POLLING_LIMIT)
+        updates = await super().get_updates(*args, **kwargs)
+        self.last_fetch = time.monotonic()
+        return updates
 
 
-async def send_dogs_menu_from_query(query: types.CallbackQuery, uid: int):
-    lang = get_user_lang(uid)
+bot = TrackedBot(
+    token=API_TOKEN,
+    server=TelegramAPIServer.from_base(API_SERVER) if API_SERVER else TELEGRAM_PRODUCTION,
+)
 
-    # reset state
-    user_add_case_state.pop(uid, None)
-    user_add_case_data.pop(uid, None)
-    user_add_case_substate.pop(uid, None)
-    user_add_case_empty_field.pop(uid, None)
-    user_search_state.pop(uid, None)
-    user_search_results.pop(uid, None)
-
-    await query.message.reply_text(
-        dogs_menu_text(lang),
-        reply_markup=dogs_menu_keyboard(lang),
-    )
-async def start_dog_search(query: types.CallbackQuery, uid: int):
-    lang = get_user_lang(uid)
 
-    # reset add case state when starting search
-    user_add_case_state.pop(uid, None)
-    user_add_case_data.pop(uid, None)
-    user_add_case_substate.pop(uid, None)
-    user_add_case_empty_field.pop(uid, None)
-
-    user_search_state[uid] = "dog_name"
-    user_search_results.pop(uid, None)
-
-    if lang == "en":
-        text = (
-            "Dog search.\n\n"
-            "Send the dog name or a part of it.\n"
-            "The search is case insensitive. If there are several matches, I will show a list."
-        )
-    else:
-        text = (
-            "Поиск собаки.\n\n"
-            "Отправьте имя собаки или его часть.\n"
-            "Поиск нечувствителен к регистру. Если найдётся несколько вариантов, я покажу список."
-        )
+class ScheduledDispatcher(Dispatcher):
+    """Dispatcher, который при polling отдаёт апдейты в update_scheduler
+    вместо того, чтобы запускать их обработку все сразу."""
 
-    await query.message.reply_text(text)
+    async def _process_polling_updates(self, updates, fast: bool = True):
+        for update in updates:
+            await update_scheduler.submit(update)
 
 
-async def send_search_results_list(message: types.Message, results: list, lang: str):
-    if lang == "en":
-        header = "Several dogs found:\n"
-        dam_label = "dam"
-        sire_label = "sire"
-        back_text = "Back to dog menu"
-    else:
-        header = "Найдено несколько собак:\n"
-        dam_label = "мать"
-        sire_label = "отец"
-        back_text = "Назад в меню собак"
+dp = ScheduledDispatcher(bot)
 
-    lines = [header, ""]
-    for idx, row in enumerate(results, start=1):
-        dam_name = row["dam_name"] or ("не указано" if lang == "ru" else "not specified")
-        sire_name = row["sire_name"] or ("не указано" if lang == "ru" else "not specified")
-        line = f"{idx}. {row['dog_name']} ({dam_label}: {dam_name}, {sire_label}: {sire_name})"
-        lines.append(line)
 
-    text = "\n".join(lines)
+async def process_update(update: types.Update):
+    # воркеры запущены из on_startup, контекст бота ставим явно
+    Bot.set_current(bot)
+    Dispatcher.set_current(dp)
+    await dp.updates_handler.notify(update)
 
-    kb = types.InlineKeyboardMarkup()
-    for row in results:
-        cb = f"case_show_{row['id']}"
-        kb.add(types.InlineKeyboardButton(row["dog_name"], callback_data=cb))
 
-    kb.add(types.InlineKeyboardButton(back_text, callback_data="dogs_search_back"))
+update_scheduler = UpdateScheduler(process_update, workers=UPDATE_WORKERS, max_pending=UPDATE_QUEUE_SIZE)
 
-    await message.answer(text, reply_markup=kb)
 
+class SessionMiddleware(BaseMiddleware):
+    """Загружает сессию пользователя до фильтров и сохраняет после обработки."""
 
-async def show_dog_card(message: types.Message, case_id: int, uid: int, lang: str):
-    with engine.connect() as connection:
-        result = connection.execute(
-            text(
-                """
-                SELECT dog_name, sex, birth_date,
-                       dam_name, sire_name,
-                       dog_pedigree_url, dam_pedigree_url, sire_pedigree_url
-                FROM cases
-                WHERE id = :cid
-                """
-            ),
-            {"cid": case_id},
-        )
-        row = result.fetchone()
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        data["session"] = await sessions.load(message.from_user.id)
 
-    if not row:
-        if lang == "en":
-            await message.answer("Record not found.")
-        else:
-            await message.answer("Запись не найдена.")
-        return
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        if "session" in data:
+            await sessions.save(message.from_user.id, data["session"])
 
-    (
-        dog_name,
-        sex,
-        birth_date,
-        dam_name,
-        sire_name,
-        dog_url,
-        dam_url,
-        sire_url,
-    ) = row
-
-    def v(val, default_ru: str, default_en: str) -> str:
-        if not val or not str(val).strip():
-            return default_ru if lang == "ru" else default_en
-        return str(val).strip()
-
-    dog_name = v(dog_name, "не указано", "not specified")
-    sex = v(sex, "не указан", "not specified")
-    birth_date = v(birth_date, "не указана", "not specified")
-    dam_name = v(dam_name, "не указано", "not specified")
-    sire_name = v(sire_name, "не указано", "not specified")
-    dog_url = v(dog_url, "нет", "none")
-    dam_url = v(dam_url, "нет", "none")
-    sire_url = v(sire_url, "нет", "none")
-
-    if lang == "en":
-        lines = [
-            "Dog card:",
-            "",
-            f"Name: {dog_name}",
-            f"Sex: {sex}",
-            f"Birth date: {birth_date}",
-            "",
-            f"Dam: {dam_name}",
-            f"Sire: {sire_name}",
-            "",
-            "Pedigree links:",
-            f"• Dog: {dog_url}",
-            f"• Dam: {dam_url}",
-            f"• Sire: {sire_url}",
-        ]
-        back_results_text = "Back to results"
-        back_menu_text = "Back to dog menu"
-    else:
-        lines = [
-            "Карточка собаки:",
-            "",
-            f"Имя: {dog_name}",
-            f"Пол: {sex}",
-            f"Дата рождения: {birth_date}",
-            "",
-            f"Мать: {dam_name}",
-            f"Отец: {sire_name}",
-            "",
-            "Ссылки на родословные:",
-            f"• Собака: {dog_url}",
-            f"• Мать: {dam_url}",
-            f"• Отец: {sire_url}",
-        ]
-        back_results_text = "Назад к результатам"
-        back_menu_text = "Назад в меню собак"
-
-    text_out = "\n".join(lines)
+    async def on_pre_process_callback_query(self, query: types.CallbackQuery, data: dict):
+        data["session"] = await sessions.load(query.from_user.id)
 
-    kb = types.InlineKeyboardMarkup()
-    results = user_search_results.get(uid) or []
-    if results and len(results) > 1:
-        kb.add(types.InlineKeyboardButton(back_results_text, callback_data="search_back_to_results"))
-    kb.add(types.InlineKeyboardButton(back_menu_text, callback_data="dogs_search_back"))
+    async def on_post_process_callback_query(self, query: types.CallbackQuery, results, data: dict):
+        if "session" in data:
+            await sessions.save(query.from_user.id, data["session"])
 
-    await message.answer(text_out, reply_markup=kb)
 
+class MetricsMiddleware(BaseMiddleware):
+    """Время обработки апдейта выбранным хендлером; для callback query ещё и
+    по действию из callback data."""
 
+    async def on_process_message(self, message: types.Message, data: dict):
+        data["metrics_handler"] = (current_handler.get().__name__, time.perf_counter())
 
-# --- Database helper functions ---
-
-def save_case(
-    user_id: int,
-    dog_name: str,
-    dog_pedigree_url: str,
-    dam_name: str,
-    dam_pedigree_url: str,
-    sire_name: str,
-    sire_pedigree_url: str,
-    sex: str,
-    birth_date: str,
-):
-    """Сохраняет данные по собаке в SQLite."""
-    with engine.connect() as connection:
-        connection.execute(
-            text(
-                """
-                INSERT INTO cases (
-                    user_id,
-                    dog_name,
-                    dog_pedigree_url,
-                    dam_name,
-                    dam_pedigree_url,
-                    sire_name,
-                    sire_pedigree_url,
-                    sex,
-                    birth_date,
-                    timestamp
-                )
-                VALUES (
-                    :uid,
-                    :dog_name,
-                    :dog_pedigree_url,
-                    :dam_name,
-                    :dam_pedigree_url,
-                    :sire_name,
-                    :sire_pedigree_url,
-                    :sex,
-                    :birth_date,
-                    datetime('now')
-                )
-                """
-            ),
-            {
-                "uid": user_id,
-                "dog_name": dog_name,
-                "dog_pedigree_url": dog_pedigree_url,
-                "dam_name": dam_name,
-                "dam_pedigree_url": dam_pedigree_url,
-                "sire_name": sire_name,
-                "sire_pedigree_url": sire_pedigree_url,
-                "sex": sex,
-                "birth_date": birth_date,
-            },
-        )
-        connection.commit()
-    logging.info(f"Saved case for user={user_id}, dog='{dog_name}'")
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        self._observe("message", data)
 
+    async def on_process_callback_query(self, query: types.CallbackQuery, data: dict):
+        # все callback query обрабатывает route_callback, поэтому в метку
+        # идёт хендлер, выбранный callback_router
+        data["metrics_handler"] = (callback_router.handler_name(query.data), time.perf_counter())
 
+    async def on_post_process_callback_query(self, query: types.CallbackQuery, results, data: dict):
+        elapsed = self._observe("callback_query", data)
+        if elapsed is not None:
+            metrics.CALLBACK_SECONDS.labels(callback_router.name(query.data)).observe(elapsed)
 
-def delete_case_by_dog_name(name: str):
-    """Удаляет записи из SQLite по имени собаки."""
-    with engine.connect() as connection:
-        connection.execute(
-            text("DELETE FROM cases WHERE dog_name = :name"),
-            {"name": name},
-        )
-        connection.commit()
-    logging.info(f"Deleted cases with dog_name='{name}'")
+    @staticmethod
+    def _observe(kind: str, data: dict):
+        if "metrics_handler" not in data:
+            metrics.HANDLER_UPDATES.labels(kind, "unhandled").inc()
+            return None
 
+        handler, started = data["metrics_handler"]
+        elapsed = time.perf_counter() - started
+        metrics.HANDLER_SECONDS.labels(kind, handler).observe(elapsed)
+        metrics.HANDLER_UPDATES.labels(kind, handler).inc()
+        return elapsed
 
-# --- Logging ---
 
-LOGFILE = "epibot.log"
-logging.basicConfig(
-    level=logging.INFO,
-    filename=LOGFILE,
-    format="%(asctime)s %(levelname)s %(message)s",
+THROTTLED_CALLBACKS = metrics.Counter(
+    "epibot_throttled_callbacks_total",
+    "Repeated identical callback queries answered without running a handler",
+)
+USER_LOCK_WAITS = metrics.Counter(
+    "epibot_user_lock_waits_total",
+    "Updates that waited for the previous update of the same user",
 )
-logging.getLogger().addHandler(logging.StreamHandler())
 
-# --- Bot init ---
 
-bot = Bot(token=API_TOKEN)
-dp = Dispatcher(bot)
+class ThrottlingMiddleware(BaseMiddleware):
+    """Обрабатывает апдейты одного пользователя строго по очереди и гасит
+    повторные нажатия одной и той же кнопки.
+
+    Работает на уровне update: блокировка держится от загрузки сессии до её
+    сохранения. Нажатие считается повтором, если у пользователя та же кнопка
+    того же (не изменившегося) сообщения ещё обрабатывается или обработана
+    меньше window секунд назад. На повтор отвечаем пустым answerCallbackQuery,
+    чтобы у кнопки пропали часики.
+
+    Апдейты из update_scheduler и так приходят по одному на пользователя;
+    блокировка нужна при прямых вызовах dp.process_update(s).
+    """
+
+    def __init__(self, window: float = 1.0, max_users: int = 10_000):
+        super().__init__()
+        self.window = window
+        self.max_users = max_users
+        self._locks = {}      # uid -> [asyncio.Lock, сколько апдейтов её ждут или держат]
+        self._callbacks = {}  # uid -> [(data, message_id), время окончания или None]
+
+    def _is_duplicate(self, uid: int, query: types.CallbackQuery) -> bool:
+        # текст входит в ключ: после правки сообщения (следующий шаг анкеты)
+        # та же кнопка "Далее" - уже новое нажатие
+        message = query.message
+        key = (query.data, message.message_id, hash(message.text)) if message else (query.data,)
+        last = self._callbacks.get(uid)
+        if last is not None and last[0] == key:
+            finished = last[1]
+            if finished is None or time.monotonic() - finished < self.window:
+                return True
+
+        if len(self._callbacks) >= self.max_users:
+            cutoff = time.monotonic() - self.window
+            self._callbacks = {
+                user: entry for user, entry in self._callbacks.items()
+                if entry[1] is None or entry[1] >= cutoff
+            }
+        self._callbacks[uid] = [key, None]
+        return False
 
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        uid = update_user_id(update)
+        if uid is None:
+            return
 
-# --- Keyboards & texts ---
+        if update.callback_query and self._is_duplicate(uid, update.callback_query):
+            THROTTLED_CALLBACKS.inc()
+            await update.callback_query.answer()
+            raise CancelHandler()
 
-def language_keyboard() -> types.ReplyKeyboardMarkup:
-    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    kb.add("Русский", "English")
-    return kb
+        entry = self._locks.setdefault(uid, [asyncio.Lock(), 0])
+        entry[1] += 1
+        if entry[0].locked():
+            USER_LOCK_WAITS.inc()
+        try:
+            await entry[0].acquire()
+        except BaseException:
+            self._release(uid, locked=False)
+            raise
+        data["throttle_uid"] = uid
+
+    async def on_post_process_update(self, update: types.Update, results, data: dict):
+        uid = data.get("throttle_uid")
+        if uid is None:
+            return
 
+        if update.callback_query and uid in self._callbacks:
+            self._callbacks[uid][1] = time.monotonic()
+        self._release(uid, locked=True)
 
-def main_menu_markup(lang: str = "ru") -> types.ReplyKeyboardMarkup:
-    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    if lang == "en":
-        kb.row("📄 Help", "📂 Add case")
-    else:
-        kb.row("📄 Помощь", "📂 Добавить историю")
-    return kb
+    def _release(self, uid: int, locked: bool):
+        entry = self._locks[uid]
+        if locked:
+            entry[0].release()
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._locks[uid]
 
-def add_case_nav_keyboard(lang: str = "ru") -> types.ReplyKeyboardMarkup:
-    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    if lang == "en":
-        kb.row("Back to bot menu", "I continue")
-    else:
-        kb.row("Назад в меню бота", "Продолжаю")
-    return kb
 
-def add_case_back_only_keyboard(lang: str = "ru") -> types.ReplyKeyboardMarkup:
-    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
-    if lang == "en":
-        kb.row("Back to bot menu")
-    else:
-        kb.row("Назад в меню бота")
-    return kb
-
-
-# --- Main welcome texts ---
-
-def get_welcome_text(lang: str = "ru") -> str:
-    if lang == "en":
-        return (
-            "Hello. I am a bot that helps you check Cane Corso pedigrees for epilepsy cases found in the bloodline.\n\n"
-            "☯︎ Dear user,\n"
-            "epilepsy in the Cane Corso breed is unfortunately not rare. If you do not find information in our database, "
-            "it does not mean that epilepsy has never occurred in this pedigree. This may simply mean that I am not aware of any such cases.\n\n"
-            "If you do find epilepsy cases in the database, this also does not confirm any genetic origin. "
-            "At this time, there is no genetic test of any kind that can diagnose epilepsy or determine whether it is inherited. "
-            "Epilepsy may have hereditary or acquired causes.\n\n"
-            "Choose an option from the menu below."
-        )
+CALLBACK_DEBOUNCE = float(os.getenv("EPIBOT_CALLBACK_DEBOUNCE", 1.0))
+
+dp.middleware.setup(ThrottlingMiddleware(window=CALLBACK_DEBOUNCE))
+# метрики первыми: их post_process отработает до сохранения сессии
+dp.middleware.setup(MetricsMiddleware())
+dp.middleware.setup(SessionMiddleware())
 
-    return (
-        "Привет! Я бот, который помогает проверять родословные Cane Corso на наличие эпилепсии в линиях.\n\n"
-        "☯︎ Дорогой пользователь,\n"
-        "эпилепсия в породе Cane Corso, к сожалению, встречается нередко. Если ты не нашёл информацию в нашей базе, "
-        "это не означает, что в данной родословной эпилепсии не было. Это может значить, что мне такие случаи не известны.\n\n"
-        "Если ты обнаружишь упоминание об эпилепсии в базе, это также не подтверждает её генетическое происхождение. "
-        "На сегодняшний день не существует никакого генетического теста, который мог бы определить эпилепсию или её наследование. "
-        "Эпилепсия может иметь как наследственные, так и приобретённые причины.\n\n"
-        "Выбери действие в меню ниже."
-    )
+
+@dp.errors_handler(exception=MessageNotModified)
+async def ignore_message_not_modified(update: types.Update, error: MessageNotModified):
+    # правка с тем же текстом и клавиатурой: сообщение уже в нужном виде
+    return True
 
 
 # --- /start and /menu ---
@@ -793,202 +666,145 @@ async def cmd_start(message: types.Message):
     uid = message.from_user.id
     logging.info(f"/start from {uid}")
 
-    await message.answer(
-        "Пожалуйста, выберите язык.\nPlease choose your language.",
-        reply_markup=language_keyboard(),
-    )
+    await message.answer(LANGUAGE_PROMPT, reply_markup=LANGUAGE_KEYBOARD)
 
 
-# --- Russian language selection ---
+# --- Language selection ---
 
-@dp.message_handler(lambda m: m.text == "Русский")
-async def set_ru(message: types.Message):
+@dp.message_handler(lambda m: m.text in LANGUAGE_BY_NAME)
+async def set_language(message: types.Message):
     if message.chat.type != "private":
         return
 
     uid = message.from_user.id
-    user_lang[uid] = "ru"
-    logging.info(f"Language RU set for {uid}")
+    lang = LANGUAGE_BY_NAME[message.text]
+    sessions.get(uid).lang = lang
+    logging.info(f"Language {lang.upper()} set for {uid}")
 
-    await message.answer(
-        get_welcome_text("ru"),
-        reply_markup=main_menu_markup("ru"),
-    )
+    texts = LOCALES[lang]
+    await message.answer(texts.text("welcome"), reply_markup=texts.keyboard("main_menu"))
 
 
-# --- English language selection ---
+# --- /coi: planned mating report ---
+
+COI_MAX_ANCESTORS_SHOWN = 20
 
-@dp.message_handler(lambda m: m.text == "English")
-async def set_en(message: types.Message):
-    if message.chat.type != "private":
-        return
 
+@dp.message_handler(commands=["coi"])
+async def cmd_coi(message: types.Message):
     uid = message.from_user.id
-    user_lang[uid] = "en"
-    logging.info(f"Language EN set for {uid}")
+    texts = LOCALES[get_user_lang(uid)]
 
-    await message.answer(
-        get_welcome_text("en"),
-        reply_markup=main_menu_markup("en"),
-    )
+    parts = (message.get_args() or "").split("|")
+    if len(parts) != 2 or not all(p.strip() for p in parts):
+        await message.answer(texts.text("coi.usage"))
+        return
+
+    dogs = []
+    for part in parts:
+        dog = await case_repo.find_dog(part)
+        if dog is None:
+            await message.answer(texts.text("coi.dog_not_found", name=part.strip()))
+            return
+        dogs.append(dog)
+
+    first, second = dogs
+    try:
+        report = await case_repo.kinship.mating_report(first["id"], second["id"])
+    except KinshipTimeout:
+        logging.info(f"/coi timeout for dogs {first['id']} x {second['id']}")
+        await message.answer(texts.text("coi.timeout"))
+        return
+
+    common = report["common_ancestors"]
+    affected = await case_repo.affected_dog_ids(common)
+    names = await case_repo.graph.names(affected)
+    shown = sorted(affected, key=lambda dog_id: sum(common[dog_id]))[:COI_MAX_ANCESTORS_SHOWN]
+
+    lines = [texts.text(
+        "coi.header",
+        first=first["name"],
+        second=second["name"],
+        coi_percent=report["coi"] * 100,
+        common=len(common),
+    )]
+    for dog_id in shown:
+        gen_a, gen_b = common[dog_id]
+        lines.append(texts.text("coi.ancestor_line", name=names.get(dog_id), gen_a=gen_a, gen_b=gen_b))
+    if not shown:
+        lines.append(texts.text("coi.no_ancestors"))
+
+    await message.answer("\n".join(lines))
 
 
 # --- Add case -> show consent text (RU / EN) ---
 
-@dp.message_handler(lambda m: m.text in ["📂 Добавить историю", "📂 Add case"])
+@dp.message_handler(lambda m: m.text in ADD_CASE_TEXTS)
 async def handle_add_case_with_consent(message: types.Message):
-    uid = message.from_user.id
-    lang = user_lang.get(uid, "ru")
-
-    if lang == "ru":
-        text = (
-            "Соглашение на обработку информации и материалов:\n\n"
-            "Нажимая продолжить и отправляя историю, вы подтверждаете, что:\n"
-            "• отправляете информацию добровольно и по собственной инициативе\n"
-            "• разрешаете её хранение и обработку в рамках проекта по эпилепсии у Cane Corso\n"
-            "• понимаете, что данные могут использоваться в обезличенном виде для анализа и статистики\n"
-            "• не отправляете персональные данные третьих лиц без их согласия\n\n"
-            "Если вы согласны, нажмите «Продолжаю».\n"
-            "Если не согласны, нажмите «Назад в меню бота» или просто не отправляйте данные."
-        )
-    else:
-        text = (
-            "Consent to process information and materials:\n\n"
-            "By continuing and sending a case, you confirm that:\n"
-            "• you provide information voluntarily and on your own initiative\n"
-            "• you allow it to be stored and processed within the Cane Corso epilepsy project\n"
-            "• the data may be used in anonymized form for analysis and statistics\n"
-            "• you will not send personal data of third parties without their consent\n\n"
-            "If you agree, press “I continue”.\n"
-            "If you do not agree, press “Back to bot menu” or simply do not send any data."
-        )
+    await send_consent(message, message.from_user.id)
+
 
-    await message.answer(text, reply_markup=add_case_nav_keyboard(lang))
+async def send_consent(message: types.Message, uid: int):
+    texts = LOCALES[get_user_lang(uid)]
+    await message.answer(texts.text("consent"), reply_markup=texts.keyboard("add_case_nav"))
 
 
 # --- Add case step-by-step input (dog, dam, sire) ---
 
-# user_add_case_state[uid] = "dog_name" | "dam_name" | "sire_name"
+# sessions.get(uid).add_state = ADD_STATE_DOG | ADD_STATE_DAM | ... | ADD_STATE_CONFIRM
 
 
-@dp.message_handler(lambda m: m.text in ["Назад в меню бота", "Back to bot menu"])
+@dp.message_handler(lambda m: m.text in BACK_TO_BOT_TEXTS)
 async def handle_back_to_bot_menu(message: types.Message):
     uid = message.from_user.id
-    lang = user_lang.get(uid, "ru")
+    texts = LOCALES[get_user_lang(uid)]
 
     # reset add case and search state
-    user_add_case_state.pop(uid, None)
-    user_add_case_data.pop(uid, None)
-    user_add_case_substate.pop(uid, None)
-    user_add_case_empty_field.pop(uid, None)
-    user_search_state.pop(uid, None)
-    user_search_results.pop(uid, None)
-
-    if lang == "en":
-        await message.answer(
-            get_welcome_text("en"),
-            reply_markup=main_menu_markup("en"),
-        )
-    else:
-        await message.answer(
-            get_welcome_text("ru"),
-            reply_markup=main_menu_markup("ru"),
-        )
+    sessions.get(uid).reset_dog_flow()
 
+    await message.answer(texts.text("welcome"), reply_markup=texts.keyboard("main_menu"))
 
-@dp.message_handler(lambda m: m.text in ["Продолжаю", "I continue"])
-@dp.message_handler(lambda m: m.text in ["Продолжаю", "I continue"])
+
+@dp.message_handler(lambda m: m.text in CONTINUE_TEXTS)
 async def handle_add_case_start_steps(message: types.Message):
     uid = message.from_user.id
-    lang = get_user_lang(uid)
+    texts = LOCALES[get_user_lang(uid)]
 
     # всегда начинаем анкету заново
-    user_add_case_state[uid] = ADD_STATE_DOG
-    user_add_case_substate[uid] = None
-    user_add_case_empty_field[uid] = None
-    user_add_case_data[uid] = {
-        "dog_name": "",
-        "dog_pedigree_url": "",
-        "dam_name": "",
-        "dam_pedigree_url": "",
-        "sire_name": "",
-        "sire_pedigree_url": "",
-        "sex": "",
-        "birth_date": "",
-    }
+    session = sessions.get(uid)
+    session.add_state = ADD_CASE.first
+    session.add_substate = None
+    session.add_empty_field = None
+    session.add_data = ADD_CASE.blank_data()
+    # повторное сохранение этой анкеты не создаст второй записи
+    session.add_submission_key = uuid.uuid4().hex
 
     # меняем клавиатуру на «Назад в меню бота»
-    await message.answer(
-        " ",
-        reply_markup=add_case_back_only_keyboard(lang),
-    )
+    await message.answer(" ", reply_markup=texts.keyboard("add_case_back_only"))
 
     # отправляем первый шаг с inline навигацией
-    await message.answer(
-        dog_step_intro(lang),
-        reply_markup=add_case_inline_nav(lang),
-    )
+    text, keyboard = step_screen(uid)
+    await message.answer(text, reply_markup=keyboard)
 
 
-@dp.message_handler(lambda m: user_search_state.get(m.from_user.id) == "dog_name")
+@dp.message_handler(lambda m: sessions.get(m.from_user.id).search_state == "dog_name")
 async def handle_search_message(message: types.Message):
     uid = message.from_user.id
     lang = get_user_lang(uid)
+    texts = LOCALES[lang]
 
     q = (message.text or "").strip()
     if not q:
-        if lang == "en":
-            await message.answer("Please enter a search string.")
-        else:
-            await message.answer("Введите строку для поиска.")
+        await message.answer(texts.text("search.empty_query"))
         return
 
-    with engine.connect() as connection:
-        result = connection.execute(
-            text(
-                """
-                SELECT id, dog_name, dam_name, sire_name, sex, birth_date
-                FROM cases
-                WHERE LOWER(dog_name) LIKE '%' || LOWER(:q) || '%'
-                ORDER BY timestamp DESC
-                LIMIT 20
-                """
-            ),
-            {"q": q},
-        )
-        rows = result.fetchall()
-
-    if not rows:
-        if lang == "en":
-            text_out = "No matches found for this query."
-            repeat_text = "Repeat search"
-            back_text = "Back to dog menu"
-        else:
-            text_out = "По этому запросу ничего не найдено."
-            repeat_text = "Повторить поиск"
-            back_text = "Назад в меню собак"
-
-        kb = types.InlineKeyboardMarkup()
-        kb.add(types.InlineKeyboardButton(repeat_text, callback_data="dogs_search_repeat"))
-        kb.add(types.InlineKeyboardButton(back_text, callback_data="dogs_search_back"))
+    results = await case_repo.search_by_dog_name(q)
 
-        await message.answer(text_out, reply_markup=kb)
+    if not results:
+        await message.answer(texts.text("search.not_found"), reply_markup=texts.keyboard("search_not_found"))
         return
 
-    results = []
-    for r in rows:
-        results.append(
-            {
-                "id": r[0],
-                "dog_name": r[1],
-                "dam_name": r[2],
-                "sire_name": r[3],
-                "sex": r[4],
-                "birth_date": r[5],
-            }
-        )
-
-    user_search_results[uid] = results
+    sessions.get(uid).search_results = results
 
     if len(results) == 1:
         await show_dog_card(message, results[0]["id"], uid, lang)
@@ -997,60 +813,22 @@ async def handle_search_message(message: types.Message):
     await send_search_results_list(message, results, lang)
 
 
-@dp.message_handler(lambda m: user_add_case_state.get(m.from_user.id) is not None)
+@dp.message_handler(lambda m: sessions.get(m.from_user.id).add_state is not None)
 async def handle_add_case_message(message: types.Message):
     uid = message.from_user.id
-    lang = get_user_lang(uid)
-    state = user_add_case_state.get(uid)
-    data = user_add_case_data.setdefault(uid, {})
+    session = sessions.get(uid)
 
     text = (message.text or "").strip()
     if not text:
         return
 
-    # Шаг собаки: сначала имя, потом пробуем воспринимать как ссылку
-    if state == ADD_STATE_DOG:
-        if not data.get("dog_name"):
-            data["dog_name"] = text
-        else:
-            if is_valid_pedigree_url(text):
-                data["dog_pedigree_url"] = text
-            else:
-                await message.answer(url_error_text(lang))
-
-    elif state == ADD_STATE_DAM:
-        if not data.get("dam_name"):
-            data["dam_name"] = text
-        else:
-            if is_valid_pedigree_url(text):
-                data["dam_pedigree_url"] = text
-            else:
-                await message.answer(url_error_text(lang))
-
-    elif state == ADD_STATE_SIRE:
-        if not data.get("sire_name"):
-            data["sire_name"] = text
-        else:
-            if is_valid_pedigree_url(text):
-                data["sire_pedigree_url"] = text
-            else:
-                await message.answer(url_error_text(lang))
-
-    elif state == ADD_STATE_SEX:
-        # Пол выбираем только кнопками, текст игнорируем
-        await message.answer(
-            sex_step_intro(lang),
-            reply_markup=add_case_inline_nav_with_sex(lang),
-        )
-
-    elif state == ADD_STATE_BIRTH:
-        if text:
-            if is_valid_birth_date(text):
-                data["birth_date"] = text
-            else:
-                await message.answer(date_format_error_text(lang))
-
-    user_add_case_data[uid] = data
+    result = ADD_CASE.accept_input(session.add_state, session.add_data, text)
+    if result.action == ERROR:
+        await message.answer(LOCALES[get_user_lang(uid)].text(result.target))
+    elif result.action == PROMPT:
+        # шаг не принимает текст (пол выбирается кнопками): повторяем экран
+        screen, keyboard = step_screen(uid)
+        await message.answer(screen, reply_markup=keyboard)
 
 
 @dp.message_handler(commands=["delete"])
@@ -1069,367 +847,447 @@ async def admin_delete_case(message: types.Message):
 
     dog_name = parts[1].strip()
 
-    delete_case_by_dog_name(dog_name)
+    await case_repo.delete_case_by_dog_name(dog_name)
 
     await message.answer(f"✔ Запись с именем '{dog_name}' удалена (если она существовала).")
 
-async def repaint_current_step(query: types.CallbackQuery, uid: int):
-    lang = get_user_lang(uid)
-    state = user_add_case_state.get(uid)
-    data = user_add_case_data.setdefault(uid, {})
 
-    # Common cases: steps 1 4
-    if state == ADD_STATE_DOG:
-        await query.message.edit_text(
-            dog_step_intro(lang),
-            reply_markup=add_case_inline_nav(lang),
-        )
-    elif state == ADD_STATE_DAM:
-        await query.message.edit_text(
-            dam_step_intro(lang),
-            reply_markup=add_case_inline_nav(lang),
-        )
-    elif state == ADD_STATE_SIRE:
-        await query.message.edit_text(
-            sire_step_intro(lang),
-            reply_markup=add_case_inline_nav(lang),
-        )
-    elif state == ADD_STATE_SEX:
-        await query.message.edit_text(
-            sex_step_intro(lang),
-            reply_markup=add_case_inline_nav_with_sex(lang),
-        )
-    elif state == ADD_STATE_BIRTH:
-        await query.message.edit_text(
-            birth_step_intro(lang),
-            reply_markup=add_case_inline_nav(lang),
-        )
-    elif state == ADD_STATE_CONFIRM:
-        # Confirmation step
-        await query.message.edit_text(
-            build_confirm_text(lang, data),
-            reply_markup=add_case_inline_nav_confirm(lang),
-        )
-    else:
-        # Fallback to first step
-        await query.message.edit_text(
-            dog_step_intro(lang),
-            reply_markup=add_case_inline_nav(lang),
+@dp.message_handler(commands=["top_parents"])
+async def admin_top_parents(message: types.Message):
+    uid = message.from_user.id
+
+    if uid not in ADMINS:
+        await message.answer("⛔ У вас нет прав для выполнения этой команды.")
+        return
+
+    rows = await case_repo.top_parents()
+
+    if not rows:
+        await message.answer("Пока нет родителей с зарегистрированными случаями.")
+        return
+
+    lines = ["Родители с наибольшим числом больных потомков:", ""]
+    for idx, row in enumerate(rows, start=1):
+        role = "мать" if row["role"] == "dam" else "отец"
+        lines.append(
+            f"{idx}. {row['name']} ({role}): потомков с эпилепсией {row['affected_offspring']}, "
+            f"помётов {row['litters']}"
         )
 
+    await message.answer("\n".join(lines))
 
 
-async def handle_add_case_back(query: types.CallbackQuery, uid: int):
-    state = user_add_case_state.get(uid)
+# сколько записей каждой группы показывает /duplicates
+DUPLICATE_ROWS_SHOWN = 5
 
-    if state == ADD_STATE_DOG:
-        await send_dogs_menu_from_query(query, uid)
+
+@dp.message_handler(commands=["duplicates"])
+async def admin_duplicates(message: types.Message):
+    uid = message.from_user.id
+
+    if uid not in ADMINS:
+        await message.answer("⛔ У вас нет прав для выполнения этой команды.")
         return
 
-    if state == ADD_STATE_DAM:
-        user_add_case_state[uid] = ADD_STATE_DOG
-    elif state == ADD_STATE_SIRE:
-        user_add_case_state[uid] = ADD_STATE_DAM
-    elif state == ADD_STATE_SEX:
-        user_add_case_state[uid] = ADD_STATE_SIRE
-    elif state == ADD_STATE_BIRTH:
-        user_add_case_state[uid] = ADD_STATE_SEX
+    groups = await case_repo.duplicate_groups()
 
-    await query.answer()
-    await repaint_current_step(query, uid)
+    if not groups:
+        await message.answer("Похожих записей не найдено.")
+        return
 
+    lines = ["Возможные дубли (та же ссылка или кличка с датой рождения):", ""]
+    for idx, group in enumerate(groups, start=1):
+        lines.append(f"{idx}. /merge {' '.join(str(row['id']) for row in group)}")
+        for row in group[:DUPLICATE_ROWS_SHOWN]:
+            lines.append(
+                f"   #{row['id']} {row['dog_name']}, {row['birth_date'] or 'дата не указана'}, "
+                f"{row['dog_pedigree_url'] or 'без ссылки'} (user {row['user_id']}, {row['timestamp']})"
+            )
+        if len(group) > DUPLICATE_ROWS_SHOWN:
+            lines.append(f"   ... и ещё {len(group) - DUPLICATE_ROWS_SHOWN}")
+    lines += ["", "Первая запись в /merge остаётся, остальные сливаются в неё."]
 
-async def handle_add_case_next(query: types.CallbackQuery, uid: int):
-    lang = get_user_lang(uid)
-    state = user_add_case_state.get(uid)
-    data = user_add_case_data.setdefault(uid, {})
+    await message.answer("\n".join(lines))
 
-    # 1. Кличка собаки обязательна
-    if state == ADD_STATE_DOG:
-        if not (data.get("dog_name") or "").strip():
-            await query.answer()
-            await query.message.reply_text(dog_name_required_text(lang))
-            return
 
-    # 2. Если это шаг даты рождения - сразу пробуем сохранить / показать ошибку
-    if state == ADD_STATE_BIRTH:
-        await go_next_step_or_save(query, uid)
+@dp.message_handler(commands=["merge"])
+async def admin_merge_cases(message: types.Message):
+    uid = message.from_user.id
+
+    if uid not in ADMINS:
+        await message.answer("⛔ У вас нет прав для выполнения этой команды.")
         return
 
-    # 3. Для остальных шагов проверяем, пустой ли блок, и при необходимости спрашиваем подтверждение
-    empty_field = None
-
-    if state == ADD_STATE_DAM:
-        if not (data.get("dam_name") or "").strip() and not (data.get("dam_pedigree_url") or "").strip():
-            empty_field = "dam"
-    elif state == ADD_STATE_SIRE:
-        if not (data.get("sire_name") or "").strip() and not (data.get("sire_pedigree_url") or "").strip():
-            empty_field = "sire"
-    elif state == ADD_STATE_SEX:
-        if not (data.get("sex") or "").strip():
-            empty_field = "sex"
-
-    if empty_field:
-        user_add_case_substate[uid] = ADD_SUBSTATE_EMPTY_CONFIRM
-        user_add_case_empty_field[uid] = empty_field
-        await query.answer()
-        await query.message.edit_text(
-            empty_field_warning_text(lang),
-            reply_markup=empty_field_confirm_keyboard(lang),
+    args = (message.get_args() or "").split()
+    if len(args) < 2 or not all(arg.isdigit() for arg in args):
+        await message.answer(
+            "Укажите id записи, которую оставить, и id дублей. Пример:\n/merge 12 40 41\n"
+            "Пустые поля первой записи заполняются из дублей, дубли удаляются. "
+            "Список похожих записей - /duplicates"
         )
         return
 
-    # 4. Просто перейти на следующий шаг, если не дата и не пустой блок
-    if state == ADD_STATE_DOG:
-        user_add_case_state[uid] = ADD_STATE_DAM
-    elif state == ADD_STATE_DAM:
-        user_add_case_state[uid] = ADD_STATE_SIRE
-    elif state == ADD_STATE_SIRE:
-        user_add_case_state[uid] = ADD_STATE_SEX
-    elif state == ADD_STATE_SEX:
-        user_add_case_state[uid] = ADD_STATE_BIRTH
+    keep_id, *duplicate_ids = map(int, args)
+    result = await case_repo.merge_cases(keep_id, duplicate_ids)
 
-    await query.answer()
-    await repaint_current_step(query, uid)
-
-async def go_next_step_or_save(query: types.CallbackQuery, uid: int):
-    lang = get_user_lang(uid)
-    state = user_add_case_state.get(uid)
-    data = user_add_case_data.setdefault(uid, {})
-
-    if state == ADD_STATE_DOG:
-        user_add_case_state[uid] = ADD_STATE_DAM
-    elif state == ADD_STATE_DAM:
-        user_add_case_state[uid] = ADD_STATE_SIRE
-    elif state == ADD_STATE_SIRE:
-        user_add_case_state[uid] = ADD_STATE_SEX
-    elif state == ADD_STATE_SEX:
-        user_add_case_state[uid] = ADD_STATE_BIRTH
-    elif state == ADD_STATE_BIRTH:
-        # go to confirm step instead of saving immediately
-        user_add_case_state[uid] = ADD_STATE_CONFIRM
-    elif state == ADD_STATE_CONFIRM:
-        # nothing more to do here
-        await query.answer()
+    if result is None:
+        await message.answer(f"Запись #{keep_id} не найдена.")
         return
 
-    await query.answer()
-    await repaint_current_step(query, uid)
+    merged = ", ".join(f"#{case_id}" for case_id in result["merged"]) or "нет"
+    filled = ", ".join(result["filled"]) or "нет"
+    await message.answer(f"✔ В запись #{keep_id} слиты: {merged}. Заполнены поля: {filled}.")
 
 
-async def handle_add_case_confirm_save(query: types.CallbackQuery, uid: int):
-    lang = get_user_lang(uid)
-    data = user_add_case_data.setdefault(uid, {})
+# загруженный для /import файл до этого размера держим в памяти
+IMPORT_SPOOL_BYTES = 1024 * 1024
 
-    # final validation
-    if not is_case_minimal_ok(data):
-        await query.answer()
-        await query.message.reply_text(insufficient_data_text(lang))
+
+@dp.message_handler(
+    commands=["import"],
+    commands_ignore_caption=False,
+    content_types=[types.ContentType.TEXT, types.ContentType.DOCUMENT],
+)
+async def admin_import_cases(message: types.Message):
+    uid = message.from_user.id
+
+    if uid not in ADMINS:
+        await message.answer("⛔ У вас нет прав для выполнения этой команды.")
         return
 
-    # save to DB
-    save_case(
-        user_id=uid,
-        dog_name=(data.get("dog_name") or "").strip(),
-        dog_pedigree_url=(data.get("dog_pedigree_url") or "").strip(),
-        dam_name=(data.get("dam_name") or "").strip(),
-        dam_pedigree_url=(data.get("dam_pedigree_url") or "").strip(),
-        sire_name=(data.get("sire_name") or "").strip(),
-        sire_pedigree_url=(data.get("sire_pedigree_url") or "").strip(),
-        sex=(data.get("sex") or "").strip(),
-        birth_date=(data.get("birth_date") or "").strip(),
-    )
+    document = message.document
+    if document is None:
+        await message.answer(
+            "Пришлите файл CSV или JSONL (можно сжатый .gz) с подписью /import.\n"
+            "Колонки: " + ", ".join(CASE_FIELDS)
+        )
+        return
 
-    # clear state
-    user_add_case_state.pop(uid, None)
-    user_add_case_data.pop(uid, None)
-    user_add_case_substate.pop(uid, None)
-    user_add_case_empty_field.pop(uid, None)
+    try:
+        fmt = cases_io.detect_format(document.file_name)
+    except ValueError:
+        await message.answer("Поддерживаются файлы .csv и .jsonl (можно сжатые .gz).")
+        return
 
-    if lang == "en":
-        saved_text = "Form saved. The record has been added to the database."
-    else:
-        saved_text = "Анкета сохранена. Запись добавлена в базу."
+    with tempfile.SpooledTemporaryFile(max_size=IMPORT_SPOOL_BYTES) as binary:
+        await document.download(destination_file=binary)
+        try:
+            with cases_io.open_text(binary) as stream:
+                report = await cases_io.import_stream(case_repo, stream, fmt, user_id=uid)
+        except (ValueError, OSError) as e:
+            # нет колонки dog_name, не UTF-8, битый gzip
+            logging.warning(f"/import from {uid} failed: {e}")
+            await message.answer(f"Не удалось прочитать файл: {e}")
+            return
 
-    await query.answer()
-    await query.message.reply_text(saved_text)
-    await send_dogs_menu_from_query(query, uid)
+    await message.answer(report.summary())
 
 
-@dp.callback_query_handler(lambda c: c.data and c.data.startswith("add_"))
-async def handle_add_case_callback(query: types.CallbackQuery):
-    uid = query.from_user.id
-    lang = get_user_lang(uid)
-    data_str = query.data
-    data = user_add_case_data.setdefault(uid, {})
-
-    # sex selection
-    if data_str in (CB_ADD_SEX_MALE, CB_ADD_SEX_FEMALE):
-        if lang == "en":
-            male_value = "Male"
-            female_value = "Female"
-            chosen_text = "Sex: Male." if data_str == CB_ADD_SEX_MALE else "Sex: Female."
-        else:
-            male_value = "Кобель"
-            female_value = "Сука"
-            chosen_text = "Пол: Кобель." if data_str == CB_ADD_SEX_MALE else "Пол: Сука."
+# выгрузка до этого размера собирается в памяти, больше - во временном файле
+EXPORT_SPOOL_BYTES = 4 * 1024 * 1024
+EXPORT_FORMATS = ("csv", "jsonl")
 
-        data["sex"] = male_value if data_str == CB_ADD_SEX_MALE else female_value
-        user_add_case_data[uid] = data
+# выгрузки идут фоновыми задачами, чтобы не держать очередь апдейтов админа
+export_tasks = set()
 
-        await query.answer()
-        await query.message.edit_text(
-            sex_step_intro(lang) + "\n\n" + chosen_text,
-            reply_markup=add_case_inline_nav_with_sex(lang),
-        )
+
+@dp.message_handler(commands=["export"])
+async def admin_export_cases(message: types.Message):
+    uid = message.from_user.id
+
+    if uid not in ADMINS:
+        await message.answer("⛔ У вас нет прав для выполнения этой команды.")
         return
 
-    # cancel form
-    if data_str == CB_ADD_CANCEL:
-        await query.answer()
-        await query.message.edit_text(
-            cancel_confirm_text(lang),
-            reply_markup=cancel_confirm_keyboard(lang),
+    args = (message.get_args() or "").lower().split()
+    if set(args) - {*EXPORT_FORMATS, "anon"}:
+        await message.answer(
+            "Использование: /export [csv|jsonl] [anon]\n"
+            "anon - без user_id. По умолчанию csv, файл сжат gzip."
         )
         return
 
-    if data_str == CB_ADD_CANCEL_YES:
-        await send_dogs_menu_from_query(query, uid)
-        return
+    fmt = "jsonl" if "jsonl" in args else "csv"
+    anonymize = "anon" in args
 
-    if data_str == CB_ADD_CANCEL_NO:
-        await query.answer()
-        await repaint_current_step(query, uid)
-        return
+    await message.answer("Готовлю выгрузку, пришлю файлом.")
+    task = asyncio.create_task(send_export(message.chat.id, fmt, anonymize))
+    export_tasks.add(task)
+    task.add_done_callback(export_tasks.discard)
 
-    # empty field confirm
-    if data_str == CB_ADD_EMPTY_YES:
-        user_add_case_substate[uid] = None
-        field_name = user_add_case_empty_field.get(uid)
-        user_add_case_empty_field[uid] = None
 
-        # move to next step or to confirm
-        await go_next_step_or_save(query, uid)
-        return
+async def send_export(chat_id: int, fmt: str, anonymize: bool):
+    try:
+        with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES) as binary:
+            count = await cases_io.export_cases(case_repo, binary, fmt, anonymize=anonymize)
+            binary.seek(0)
+            await bot.send_document(
+                chat_id,
+                types.InputFile(binary, filename=cases_io.export_filename(fmt, anonymize)),
+                caption=f"Записей: {count}",
+            )
+    except asyncio.CancelledError:
+        raise
+    except Exception:
+        logging.exception(f"Export to chat {chat_id} failed")
+        await bot.send_message(chat_id, "Не удалось сделать выгрузку, подробности в логе.")
+
+
+async def repaint_current_step(query: types.CallbackQuery, uid: int):
+    text, keyboard = step_screen(uid)
+    await query.message.edit_text(text, reply_markup=keyboard)
 
-    if data_str == CB_ADD_EMPTY_NO:
-        user_add_case_substate[uid] = None
-        user_add_case_empty_field[uid] = None
-        await repaint_current_step(query, uid)
-        return
 
-    # back navigation
-    if data_str == CB_ADD_BACK:
-        await handle_add_case_back(query, uid)
+async def apply_step_transition(query: types.CallbackQuery, uid: int, transition: Transition):
+    texts = LOCALES[get_user_lang(uid)]
+    session = sessions.get(uid)
+    await query.answer()
+
+    if transition.action == EXIT:
+        await send_dogs_menu_from_query(query, uid)
         return
 
-    # next navigation
-    if data_str == CB_ADD_NEXT:
-        await handle_add_case_next(query, uid)
+    if transition.action == ERROR:
+        await query.message.answer(texts.text(transition.target))
         return
 
-    # save on confirm step
-    if data_str == CB_ADD_CONFIRM_SAVE:
-        await handle_add_case_confirm_save(query, uid)
+    if transition.action == ASK_EMPTY:
+        session.add_substate = ADD_SUBSTATE_EMPTY_CONFIRM
+        session.add_empty_field = transition.target
+        await query.message.edit_text(
+            texts.text("empty_field.warning"),
+            reply_markup=texts.keyboard("empty_field_confirm"),
+        )
         return
 
+    if transition.action == MOVE:
+        session.add_state = transition.target
+    await repaint_current_step(query, uid)
+
+
+async def send_duplicate_prompt(query: types.CallbackQuery, duplicates: list, lang: str):
+    texts = LOCALES[lang]
+
+    lines = [texts.text("duplicate.header"), ""]
+    for idx, row in enumerate(duplicates, start=1):
+        lines.append(texts.text(
+            "duplicate.line",
+            idx=idx,
+            dog_name=row["dog_name"],
+            birth_date=display_value(texts, row["birth_date"], "value.no_date"),
+            dam_name=display_value(texts, row["dam_name"], "value.no_name"),
+            sire_name=display_value(texts, row["sire_name"], "value.no_name"),
+        ))
+    lines += ["", texts.text("duplicate.hint")]
+
+    kb = types.InlineKeyboardMarkup()
+    for row in duplicates:
+        kb.add(types.InlineKeyboardButton(row["dog_name"], callback_data=CB_CASE_SHOW.pack(row["id"])))
+    kb.row(
+        types.InlineKeyboardButton(texts.text("nav.back"), callback_data=CB_ADD_DUPLICATE_BACK.pack()),
+        types.InlineKeyboardButton(texts.text("duplicate.save_anyway"), callback_data=CB_ADD_SAVE_ANYWAY.pack()),
+    )
+
+    await query.message.edit_text("\n".join(lines), reply_markup=kb)
+
 
-@dp.callback_query_handler(lambda c: c.data and (c.data.startswith("dogs_") or c.data.startswith("case_show_") or c.data.startswith("search_")))
-async def handle_dogs_and_search_callbacks(query: types.CallbackQuery):
+async def save_add_case(query: types.CallbackQuery, check_duplicates: bool):
     uid = query.from_user.id
     lang = get_user_lang(uid)
-    data_str = query.data
+    texts = LOCALES[lang]
+    session = sessions.get(uid)
+    data = session.add_data
 
-    # dogs_add -> показать согласие и запустить анкету
-    if data_str == "dogs_add":
-        await query.answer()
-        await handle_add_case_with_consent(query.message)
+    # повторное нажатие после сохранения или кнопка из старой анкеты
+    if session.add_state != ADD_STATE_CONFIRM:
+        await query.answer(texts.text("form.inactive"))
         return
 
-    # dogs_search -> запуск сценария поиска
-    if data_str == "dogs_search":
-        await query.answer()
-        await start_dog_search(query, uid)
-        return
-
-    # Назад в меню собак из поиска
-    if data_str == "dogs_search_back":
-        user_search_state.pop(uid, None)
-        user_search_results.pop(uid, None)
+    # final validation
+    if not is_case_minimal_ok(data):
         await query.answer()
-        await send_dogs_menu_from_query(query, uid)
+        await query.message.answer(texts.text("error.insufficient_data"))
         return
 
-    # Повторить поиск
-    if data_str == "dogs_search_repeat":
-        await query.answer()
-        await start_dog_search(query, uid)
-        return
+    case = {field: (data.get(field) or "").strip() for field in CASE_FIELDS}
 
-    # Показ конкретной карточки
-    if data_str.startswith("case_show_"):
-        try:
-            case_id = int(data_str.replace("case_show_", ""))
-        except ValueError:
+    if check_duplicates:
+        duplicates = await case_repo.find_duplicates(case["dog_name"], case["dog_pedigree_url"], case["birth_date"])
+        if duplicates:
+            session.add_substate = ADD_SUBSTATE_DUPLICATE_CONFIRM
             await query.answer()
+            await send_duplicate_prompt(query, duplicates, lang)
             return
 
+    # save to DB
+    await case_repo.save_case(user_id=uid, submission_key=session.add_submission_key, **case)
+
+    # clear state
+    session.reset_add_case()
+
+    await query.answer()
+    await query.message.answer(texts.text("form.saved"))
+    await send_dogs_menu_from_query(query, uid)
+
+
+@callback_router.handler(CB_ADD_CONFIRM_SAVE)
+async def handle_add_case_confirm_save(query: types.CallbackQuery):
+    await save_add_case(query, check_duplicates=True)
+
+
+@callback_router.handler(CB_ADD_SAVE_ANYWAY)
+async def handle_add_case_save_anyway(query: types.CallbackQuery):
+    await save_add_case(query, check_duplicates=False)
+
+
+@callback_router.handler(CB_ADD_SEX)
+async def handle_add_case_sex(query: types.CallbackQuery, sex_code: str):
+    uid = query.from_user.id
+    texts = LOCALES[get_user_lang(uid)]
+
+    text_key = SEX_TEXT_KEYS.get(sex_code)
+    if text_key is None:
         await query.answer()
-        await show_dog_card(query.message, case_id, uid, lang)
         return
 
-    # Назад к списку результатов
-    if data_str == "search_back_to_results":
-        results = user_search_results.get(uid) or []
-        if results:
-            await query.answer()
-            await send_search_results_list(query.message, results, lang)
-        else:
-            await query.answer()
-            await send_dogs_menu_from_query(query, uid)
-        return
+    sex = texts.text(text_key)
+    sessions.get(uid).add_data["sex"] = sex
+
+    await query.answer()
+    await query.message.edit_text(
+        texts.text("step.sex") + "\n\n" + texts.text("sex.chosen", sex=sex),
+        reply_markup=texts.keyboard("add_nav_sex"),
+    )
 
 
+@callback_router.handler(CB_ADD_CANCEL)
+async def handle_add_case_cancel(query: types.CallbackQuery):
+    texts = LOCALES[get_user_lang(query.from_user.id)]
 
-    # Save to DB
-    save_case(
-        user_id=uid,
-        dog_name=(data.get("dog_name") or "").strip(),
-        dog_pedigree_url=(data.get("dog_pedigree_url") or "").strip(),
-        dam_name=(data.get("dam_name") or "").strip(),
-        dam_pedigree_url=(data.get("dam_pedigree_url") or "").strip(),
-        sire_name=(data.get("sire_name") or "").strip(),
-        sire_pedigree_url=(data.get("sire_pedigree_url") or "").strip(),
-        sex=(data.get("sex") or "").strip(),
-        birth_date=(data.get("birth_date") or "").strip(),
+    await query.answer()
+    await query.message.edit_text(
+        texts.text("cancel.confirm"),
+        reply_markup=texts.keyboard("cancel_confirm"),
     )
 
-    # Clear state
-    user_add_case_state.pop(uid, None)
-    user_add_case_data.pop(uid, None)
-    user_add_case_substate.pop(uid, None)
-    user_add_case_empty_field.pop(uid, None)
 
-    if lang == "en":
-        saved_text = "Form saved. The record has been added to the database."
-    else:
-        saved_text = "Анкета сохранена. Запись добавлена в базу."
+@callback_router.handler(CB_ADD_CANCEL_YES)
+async def handle_add_case_cancel_yes(query: types.CallbackQuery):
+    await send_dogs_menu_from_query(query, query.from_user.id)
+
+
+@callback_router.handler(CB_ADD_CANCEL_NO, CB_ADD_EMPTY_NO, CB_ADD_DUPLICATE_BACK)
+async def handle_add_case_resume(query: types.CallbackQuery):
+    uid = query.from_user.id
+    session = sessions.get(uid)
+    session.add_substate = None
+    session.add_empty_field = None
 
     await query.answer()
-    await query.message.reply_text(saved_text)
+    await repaint_current_step(query, uid)
+
+
+@callback_router.handler(CB_ADD_EMPTY_YES)
+async def handle_add_case_empty_yes(query: types.CallbackQuery):
+    uid = query.from_user.id
+    session = sessions.get(uid)
+    session.add_substate = None
+    session.add_empty_field = None
+
+    await apply_step_transition(query, uid, ADD_CASE.next(session.add_state, session.add_data, confirmed=True))
+
+
+@callback_router.handler(CB_ADD_BACK)
+async def handle_add_case_back(query: types.CallbackQuery):
+    uid = query.from_user.id
+    await apply_step_transition(query, uid, ADD_CASE.back(sessions.get(uid).add_state))
+
+
+@callback_router.handler(CB_ADD_NEXT)
+async def handle_add_case_next(query: types.CallbackQuery):
+    uid = query.from_user.id
+    session = sessions.get(uid)
+    await apply_step_transition(query, uid, ADD_CASE.next(session.add_state, session.add_data))
+
+
+# --- Dogs menu and search callbacks ---
+
+@callback_router.handler(CB_DOGS_ADD)
+async def handle_dogs_add(query: types.CallbackQuery):
+    # показать согласие и запустить анкету
+    await query.answer()
+    await send_consent(query.message, query.from_user.id)
+
+
+@callback_router.handler(CB_DOGS_SEARCH, CB_DOGS_SEARCH_REPEAT)
+async def handle_dogs_search(query: types.CallbackQuery):
+    await query.answer()
+    await start_dog_search(query, query.from_user.id)
+
+
+@callback_router.handler(CB_DOGS_SEARCH_BACK)
+async def handle_dogs_search_back(query: types.CallbackQuery):
+    # Назад в меню собак из поиска
+    uid = query.from_user.id
+    sessions.get(uid).reset_search()
+    await query.answer()
     await send_dogs_menu_from_query(query, uid)
 
 
+@callback_router.handler(CB_CASE_SHOW)
+async def handle_case_show(query: types.CallbackQuery, case_id: int):
+    uid = query.from_user.id
+    await query.answer()
+    await show_dog_card(query.message, case_id, uid, get_user_lang(uid))
 
 
+@callback_router.handler(CB_CASE_REL)
+async def handle_case_related(query: types.CallbackQuery, case_id: int):
+    # Родственные случаи по родословной
+    uid = query.from_user.id
+    await query.answer()
+    await send_related_cases(query.message, case_id, uid, get_user_lang(uid))
+
+
+@callback_router.handler(CB_SEARCH_BACK_TO_RESULTS)
+async def handle_search_back_to_results(query: types.CallbackQuery):
+    uid = query.from_user.id
+    results = sessions.get(uid).search_results
+
+    await query.answer()
+    if results:
+        await send_search_results_list(query.message, results, get_user_lang(uid))
+    else:
+        await send_dogs_menu_from_query(query, uid)
+
+
+callback_router.check()
+
+
+@dp.callback_query_handler()
+async def route_callback(query: types.CallbackQuery):
+    await callback_router.dispatch(query)
+
 
 # --- Fallback for unknown input ---
 
+FALLBACK_LOG_TEXT = 64  # сколько символов непонятого сообщения попадает в лог
+
+
 @dp.message_handler()
 async def fallback_log(message: types.Message):
+    # самая частая запись в логе: пишем выборочно и без полного текста
+    text = message.text or ""
     logging.info(
-        f"fallback from {message.from_user.id} ({message.from_user.username}) "
-        f"chat={message.chat.id} type={message.chat.type}: {message.text!r}"
+        "fallback message",
+        extra={
+            "sample": "fallback",
+            "user_id": message.from_user.id,
+            "chat_id": message.chat.id,
+            "chat_type": message.chat.type,
+            "text": text[:FALLBACK_LOG_TEXT],
+            "text_len": len(text),
+        },
     )
 
     if message.from_user.is_bot:
@@ -1439,26 +1297,150 @@ async def fallback_log(message: types.Message):
         return
 
     uid = message.from_user.id
-    lang = user_lang.get(uid, "ru")
+    await message.answer(LOCALES[get_user_lang(uid)].text("fallback"))
+
+
+# --- Web server (webhook, health, readiness, metrics) ---
+
+class SecretWebhookHandler(WebhookRequestHandler):
+    """Принимает апдейты только с секретом, переданным Telegram в setWebhook."""
+
+    async def post(self):
+        if WEBHOOK_SECRET:
+            token = self.request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+            if not hmac.compare_digest(token, WEBHOOK_SECRET):
+                raise web.HTTPForbidden()
+        return await super().post()
+
+    async def process_update(self, update: types.Update):
+        # отвечаем Telegram, как только апдейт встал в очередь; обработчики
+        # бота не возвращают ответ в теле webhook
+        await update_scheduler.submit(update)
+        return None
+
 
-    if lang == "ru":
-        await message.answer("Я не понял. Нажми /start, выбери язык и затем используй меню.")
+STARTED_AT = time.monotonic()
+webhook_ready = False  # setWebhook прошёл успешно
+web_runner = None      # aiohttp-сервер в режиме polling
+
+
+async def healthz(request: web.Request) -> web.Response:
+    """Процесс жив и event loop отвечает."""
+    return web.Response(text="OK")
+
+
+async def check_readiness() -> dict:
+    checks = {}
+
+    if BOT_MODE == "webhook":
+        checks["updates"] = webhook_ready
     else:
-        await message.answer("I didn't understand. Send /start, choose language and use the menu.")
+        checks["updates"] = (
+            bot.last_fetch is not None
+            and time.monotonic() - bot.last_fetch <= READY_MAX_FETCH_AGE
+        )
 
+    try:
+        await asyncio.wait_for(case_repo.ping(), READY_DB_TIMEOUT)
+        checks["database"] = True
+    except Exception as e:
+        logging.warning(f"Readiness DB ping failed: {e!r}")
+        checks["database"] = False
+
+    return checks
+
+
+async def readyz(request: web.Request) -> web.Response:
+    """Бот получает апдейты и база доступна."""
+    checks = await check_readiness()
+    ready = all(checks.values())
+    return web.json_response(
+        {"status": "ok" if ready else "unavailable", "checks": checks},
+        status=200 if ready else 503,
+    )
+
+
+UPTIME = metrics.Gauge("epibot_uptime_seconds", "Seconds since the process started")
+SESSIONS_IN_MEMORY = metrics.Gauge("epibot_sessions_in_memory", "User sessions cached in memory")
+SESSION_EVICTIONS = metrics.Counter(
+    "epibot_session_evictions_total",
+    "Sessions, forms and search results dropped by TTL or size limits",
+    ("reason",),
+)
+LAST_FETCH_AGE = metrics.Gauge(
+    "epibot_last_update_fetch_age_seconds",
+    "Seconds since the last successful getUpdates",
+)
+LOG_DROPPED = metrics.Counter(
+    "epibot_log_records_dropped_total",
+    "Log records dropped because the logging queue was full",
+)
+
+
+def collect_bot_metrics():
+    UPTIME.set(time.monotonic() - STARTED_AT)
+    SESSIONS_IN_MEMORY.set(len(sessions))
+    for reason, value in sessions.stats.items():
+        SESSION_EVICTIONS.labels(reason).set(value)
+    LOG_DROPPED.labels().set(log_handler.dropped)
+    if bot.last_fetch is not None:
+        LAST_FETCH_AGE.set(time.monotonic() - bot.last_fetch)
 
-from threading import Thread
-from flask import Flask
 
-app = Flask(__name__)
+metrics.REGISTRY.add_collector(collect_bot_metrics)
 
-@app.route("/")
-def healthcheck():
-    return "OK", 200
 
-def run_flask():
-    app.run(host="0.0.0.0", port=10000)
-    
+async def metrics_endpoint(request: web.Request) -> web.Response:
+    """Метрики в текстовом формате Prometheus."""
+    return web.Response(text=metrics.REGISTRY.render(), content_type="text/plain", charset="utf-8")
+
+
+def create_web_app() -> web.Application:
+    web_app = web.Application()
+    web_app.router.add_get("/", healthz)  # проверка хостинга (Render)
+    web_app.router.add_get("/healthz", healthz)
+    web_app.router.add_get("/readyz", readyz)
+    web_app.router.add_get("/metrics", metrics_endpoint)
+    return web_app
+
+
+# --- Startup / shutdown ---
+
+async def on_startup(dp: Dispatcher):
+    global web_runner, webhook_ready
+
+    await case_repo.init_schema()
+    sessions.start_sweeper(SESSION_SWEEP_INTERVAL)
+    update_scheduler.start()
+
+    if BOT_MODE == "polling":
+        # в режиме webhook тот же app запускает executor
+        web_runner = web.AppRunner(create_web_app())
+        await web_runner.setup()
+        await web.TCPSite(web_runner, WEB_HOST, WEB_PORT).start()
+        logging.info(f"Health server listening on {WEB_HOST}:{WEB_PORT}")
+
+    if BOT_MODE == "webhook":
+        # drop_pending_updates - то же, что skip_updates при polling
+        await bot.set_webhook(
+            WEBHOOK_HOST.rstrip("/") + WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            drop_pending_updates=True,
+        )
+        webhook_ready = True
+        logging.info(f"Webhook set to {WEBHOOK_HOST.rstrip('/')}{WEBHOOK_PATH}")
+
+
+async def on_shutdown(dp: Dispatcher):
+    # polling уже остановлен: дорабатываем принятые апдейты, пока база открыта
+    await update_scheduler.close()
+    for task in list(export_tasks):
+        task.cancel()
+    if web_runner is not None:
+        await web_runner.cleanup()
+    await sessions.close()
+    await case_repo.close()
+
 
 # --- main ---
 
@@ -1480,8 +1462,25 @@ def main():
     logging.info(f"Bot start PID={os.getpid()} token_suffix={API_TOKEN[-4:]}")
 
     try:
-        Thread(target=run_flask, daemon=True).start()
-        executor.start_polling(dp, skip_updates=True)
+        if BOT_MODE == "webhook":
+            # вебхук не снимаем при остановке: новый экземпляр перевыставит
+            # его в on_startup, а Telegram пока подержит апдейты у себя
+            runner = executor.Executor(dp)
+            runner.on_startup(on_startup)
+            runner.on_shutdown(on_shutdown)
+            runner.set_webhook(
+                webhook_path=WEBHOOK_PATH,
+                request_handler=SecretWebhookHandler,
+                web_app=create_web_app(),
+            )
+            runner.run_app(host=WEB_HOST, port=WEB_PORT)
+        else:
+            executor.start_polling(
+                dp,
+                skip_updates=True,
+                on_startup=on_startup,
+                on_shutdown=on_shutdown,
+            )
     finally:
         try:
             if os.path.exists(LOCKFILE):
@@ -0,0 +1,93 @@
+"""Сравнение пропускной способности SQLite с настройками по умолчанию и с профилем бота.
+
+Запуск из корня репозитория:
+
+    python benchmarks/bench_sqlite.py --inserts 1000 --searches 2000
+"""
+
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import BASELINE_PROFILE, CaseRepository, SQLiteProfile, create_engine_for  # noqa: E402
+
+
+NAMES = ["Bella", "Rocco", "Argo", "Luna", "Zeus", "Nera", "Brutus", "Dea", "Tito", "Bruna"]
+KENNELS = ["del Rione Antico", "di Cesare", "dei Forti", "Casa Corso", "della Valle"]
+
+
+def random_case(rnd: random.Random) -> dict:
+    return {
+        "user_id": rnd.randint(1, 10_000),
+        "dog_name": f"{rnd.choice(NAMES)} {rnd.choice(KENNELS)} {rnd.randint(1, 999)}",
+        "dog_pedigree_url": "",
+        "dam_name": f"{rnd.choice(NAMES)} {rnd.choice(KENNELS)}",
+        "dam_pedigree_url": "",
+        "sire_name": f"{rnd.choice(NAMES)} {rnd.choice(KENNELS)}",
+        "sire_pedigree_url": "",
+        "sex": rnd.choice(["Кобель", "Сука", ""]),
+        "birth_date": f"20{rnd.randint(10, 23)}.0{rnd.randint(1, 9)}.1{rnd.randint(0, 9)}",
+    }
+
+
+async def bench_profile(name: str, profile: SQLiteProfile, inserts: int, searches: int, concurrency: int):
+    rnd = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        repo = CaseRepository(create_engine_for(f"sqlite+aiosqlite:///{tmp}/bench.db", profile))
+        await repo.init_schema()
+
+        # 1. последовательные вставки, каждая в своей транзакции, как save_case в боте
+        started = time.perf_counter()
+        for _ in range(inserts):
+            await repo.save_case(**random_case(rnd))
+        insert_s = time.perf_counter() - started
+
+        # 2. поиск без параллельной записи
+        queries = [rnd.choice(NAMES).lower()[:4] for _ in range(searches)]
+        started = time.perf_counter()
+        for q in queries:
+            await repo.search_by_dog_name(q)
+        search_s = time.perf_counter() - started
+
+        # 3. поиск, пока параллельно идут вставки
+        async def writer():
+            for _ in range(inserts // concurrency or 1):
+                await repo.save_case(**random_case(rnd))
+
+        async def reader(chunk):
+            for q in chunk:
+                await repo.search_by_dog_name(q)
+
+        chunks = [queries[i::concurrency] for i in range(concurrency)]
+        started = time.perf_counter()
+        await asyncio.gather(writer(), *(reader(c) for c in chunks))
+        mixed_s = time.perf_counter() - started
+
+        await repo.close()
+
+    print(
+        f"{name:<10} inserts/s={inserts / insert_s:>9.1f}  "
+        f"searches/s={searches / search_s:>9.1f}  "
+        f"mixed searches/s={searches / mixed_s:>9.1f}"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--inserts", type=int, default=500)
+    parser.add_argument("--searches", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    args = parser.parse_args()
+
+    await bench_profile("baseline", BASELINE_PROFILE, args.inserts, args.searches, args.concurrency)
+    await bench_profile("tuned", SQLiteProfile.from_env(), args.inserts, args.searches, args.concurrency)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,376 @@
+"""Нагрузочный тест диспетчера: синтетические пользователи и заглушка Bot API.
+
+Запуск из корня репозитория:
+
+    python benchmarks/loadtest.py --users 2000 --concurrency 200 --seed-cases 2000
+
+Бот поднимается целиком (EpiBot.on_startup, миграции, сессии, очередь апдейтов, middleware),
+но запросы к Telegram уходят на локальный aiohttp-сервер. Каждый
+пользователь проходит несколько сценариев: анкету целиком, поиск с
+карточками, «шторм» нажатий Назад/Далее и поток непонятных сообщений.
+В конце печатаются пропускная способность и p50/p95/p99 по шагам и по
+хендлерам.
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import itertools
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web  # noqa: E402
+
+from validation import PEDIGREE_PREFIX  # noqa: E402
+
+
+SCENARIOS = {"wizard": 3, "search": 4, "storm": 1.5, "chatter": 1.5}  # веса
+
+
+# --- Stub Bot API ---
+
+class StubBotAPI:
+    """Отвечает на запросы Bot API как Telegram и запоминает последнее
+    сообщение с inline-клавиатурой в каждом чате, чтобы пользователи
+    нажимали настоящие кнопки."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = defaultdict(int)
+        self.inline = {}  # chat_id -> (message_id, текст, [callback_data])
+        self._message_ids = itertools.count(1_000_000)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        data = await request.post()
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getMe":
+            result = {"id": 123456, "is_bot": True, "first_name": "loadtest", "username": "loadtest_bot"}
+        elif method in ("sendMessage", "editMessageText", "sendDocument"):
+            result = self._message(method, data)
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result})
+
+    def _message(self, method: str, data) -> dict:
+        chat_id = int(data["chat_id"])
+        if "message_id" in data:
+            message_id = int(data["message_id"])
+        else:
+            message_id = next(self._message_ids)
+        text = data.get("text") or data.get("caption") or ""
+
+        markup = json.loads(data.get("reply_markup") or "{}")
+        buttons = [button["callback_data"] for row in markup.get("inline_keyboard", ()) for button in row]
+        previous = self.inline.get(chat_id)
+        if buttons:
+            self.inline[chat_id] = (message_id, text, buttons)
+        elif previous and previous[0] == message_id:
+            self.inline[chat_id] = (message_id, text, previous[2])
+
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text,
+        }
+
+
+async def start_stub(stub: StubBotAPI) -> tuple:
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    runner = web.AppRunner(stub.app(), access_log=None)
+    await runner.setup()
+    await web.SockSite(runner, sock).start()
+    return runner, f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+# --- Measurements ---
+
+def percentile(samples: list, q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def print_table(title: str, samples: dict):
+    print(f"\n{title}")
+    print(f"{'':<32}{'count':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name in sorted(samples, key=lambda n: -len(samples[n])):
+        values = samples[name]
+        row = [percentile(values, q) * 1000 for q in (0.5, 0.95, 0.99)] + [max(values) * 1000]
+        print(f"{name:<32}{len(values):>8}" + "".join(f"{v:>9.2f}" for v in row))
+
+
+# --- Synthetic users ---
+
+class LoadTest:
+    def __init__(self, bot_module, stub: StubBotAPI, rnd: random.Random, storm_size: int, random_case):
+        self.bot = bot_module
+        self.random_case = random_case
+        self.stub = stub
+        self.rnd = rnd
+        self.storm_size = storm_size
+        self.texts = bot_module.LOCALES["en"]
+        self.update_ids = itertools.count(1)
+        self.message_ids = itertools.count(1)
+        self.steps = defaultdict(list)     # шаг сценария -> время обработки апдейта
+        self.handlers = defaultdict(list)  # хендлер -> время самого хендлера
+        self.updates = 0
+        self.errors = defaultdict(int)
+
+    async def feed(self, update, step: str):
+        started = time.perf_counter()
+        try:
+            # тот же путь, что у polling и webhook: очередь и пул воркеров
+            await (await self.bot.update_scheduler.submit(update))
+        except Exception as e:
+            # воркер уже записал ошибку в лог; здесь считаем и идём дальше
+            self.errors[f"{step}: {type(e).__name__}: {str(e).splitlines()[0]}"] += 1
+        self.steps[step].append(time.perf_counter() - started)
+        self.updates += 1
+
+    def _user(self, uid: int) -> dict:
+        return {"id": uid, "is_bot": False, "first_name": f"user{uid}"}
+
+    async def text(self, uid: int, text: str, step: str):
+        message = {
+            "message_id": next(self.message_ids),
+            "date": int(time.time()),
+            "text": text,
+            "from": self._user(uid),
+            "chat": {"id": uid, "type": "private"},
+        }
+        if text.startswith("/"):
+            message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+        await self.feed(self.bot.types.Update(update_id=next(self.update_ids), message=message), step)
+
+    def press_update(self, uid: int, data: str):
+        message_id, text, _ = self.stub.inline.get(uid, (next(self.message_ids), "", []))
+        query = {
+            "id": str(next(self.update_ids)),
+            "chat_instance": str(uid),
+            "data": data,
+            "from": self._user(uid),
+            "message": {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "text": text,
+                "chat": {"id": uid, "type": "private"},
+                "from": {"id": 123456, "is_bot": True, "first_name": "loadtest"},
+            },
+        }
+        return self.bot.types.Update(update_id=next(self.update_ids), callback_query=query)
+
+    async def press(self, uid: int, data: str):
+        await self.feed(self.press_update(uid, data), "cb:" + self.bot.callback_router.name(data))
+
+    def buttons(self, uid: int, action) -> list:
+        _, _, buttons = self.stub.inline.get(uid, (None, "", []))
+        parsed = [self.bot.callback_router.parse(data) for data in buttons]
+        return [data for data, p in zip(buttons, parsed) if p and p[0] == action]
+
+    # --- сценарии ---
+
+    async def start(self, uid: int):
+        await self.text(uid, "/start", "text:start")
+        await self.text(uid, self.texts.text("language.name"), "text:language")
+
+    async def wizard(self, uid: int):
+        bot, texts = self.bot, self.texts
+        await self.text(uid, texts.text("menu.add_case"), "text:add_case")
+        await self.text(uid, texts.text("menu.continue"), "text:continue")
+        case = self.random_case(self.rnd)
+        await self.text(uid, case["dog_name"], "text:form_input")
+        await self.text(uid, PEDIGREE_PREFIX + f"dog/{uid}", "text:form_input")
+        await self.press(uid, bot.CB_ADD_NEXT.pack())
+        await self.text(uid, case["dam_name"], "text:form_input")
+        await self.press(uid, bot.CB_ADD_NEXT.pack())
+        await self.press(uid, bot.CB_ADD_NEXT.pack())  # отец пустой: спросит подтверждение
+        await self.press(uid, bot.CB_ADD_EMPTY_YES.pack())
+        await self.press(uid, bot.CB_ADD_SEX.pack(self.rnd.choice(["male", "female"])))
+        await self.press(uid, bot.CB_ADD_NEXT.pack())
+        await self.text(uid, case["birth_date"], "text:form_input")
+        await self.press(uid, bot.CB_ADD_BACK.pack())
+        await self.press(uid, bot.CB_ADD_NEXT.pack())
+        await self.press(uid, bot.CB_ADD_NEXT.pack())
+        await self.press(uid, bot.CB_ADD_CONFIRM_SAVE.pack())
+
+    async def search(self, uid: int):
+        bot = self.bot
+        await self.press(uid, bot.CB_DOGS_SEARCH.pack())
+        query = self.random_case(self.rnd)["dog_name"].split()[0][: self.rnd.randint(3, 5)]
+        await self.text(uid, query, "text:search_query")
+        for _ in range(2):
+            cards = self.buttons(uid, bot.CB_CASE_SHOW)
+            if not cards:
+                break
+            await self.press(uid, self.rnd.choice(cards))
+            if self.buttons(uid, bot.CB_CASE_REL):
+                await self.press(uid, self.buttons(uid, bot.CB_CASE_REL)[0])
+            await self.press(uid, bot.CB_SEARCH_BACK_TO_RESULTS.pack())
+        await self.press(uid, bot.CB_DOGS_SEARCH_BACK.pack())
+
+    async def storm(self, uid: int):
+        # пользователь много раз подряд жмёт «Далее», потом «Назад», не дожидаясь ответа
+        bot, texts = self.bot, self.texts
+        await self.text(uid, texts.text("menu.add_case"), "text:add_case")
+        await self.text(uid, texts.text("menu.continue"), "text:continue")
+        await self.text(uid, self.random_case(self.rnd)["dog_name"], "text:form_input")
+        presses = [
+            self.press_update(uid, (bot.CB_ADD_NEXT if i < self.storm_size // 2 else bot.CB_ADD_BACK).pack())
+            for i in range(self.storm_size)
+        ]
+        await asyncio.gather(*(self.feed(update, "cb:storm") for update in presses))
+        await self.press(uid, bot.CB_ADD_CANCEL.pack())
+        await self.press(uid, bot.CB_ADD_CANCEL_YES.pack())
+
+    async def chatter(self, uid: int):
+        for _ in range(5):
+            await self.text(uid, self.rnd.choice(["hello?", "help", "???", "where is the menu"]), "text:fallback")
+
+    async def run_user(self, uid: int, scenarios: int):
+        await self.start(uid)
+        names, weights = zip(*SCENARIOS.items())
+        for name in self.rnd.choices(names, weights, k=scenarios):
+            await getattr(self, name)(uid)
+
+
+class HandlerTimer:
+    """Middleware: время самого хендлера, без очередей и блокировок."""
+
+    def __init__(self, bot_module, samples: dict):
+        from aiogram.dispatcher.handler import current_handler
+        from aiogram.dispatcher.middlewares import BaseMiddleware
+
+        router = bot_module.callback_router
+
+        class _Timer(BaseMiddleware):
+            async def on_process_message(self, message, data):
+                data["loadtest"] = ("msg:" + current_handler.get().__name__, time.perf_counter())
+
+            async def on_process_callback_query(self, query, data):
+                data["loadtest"] = ("cb:" + router.handler_name(query.data), time.perf_counter())
+
+            async def on_post_process_message(self, message, results, data):
+                self._record(data)
+
+            async def on_post_process_callback_query(self, query, results, data):
+                self._record(data)
+
+            @staticmethod
+            def _record(data):
+                if "loadtest" in data:
+                    name, started = data["loadtest"]
+                    samples[name].append(time.perf_counter() - started)
+
+        self.middleware = _Timer()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=1000, help="number of simulated user ids")
+    parser.add_argument("--concurrency", type=int, default=100, help="users active at the same time")
+    parser.add_argument("--scenarios", type=int, default=3, help="scenarios per user")
+    parser.add_argument("--seed-cases", type=int, default=2000, help="cases in the database before the run")
+    parser.add_argument("--storm-size", type=int, default=10, help="presses per back/next storm")
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="delay of every stub Bot API call")
+    parser.add_argument("--workers", type=int, help="update scheduler workers (default: the bot's)")
+    parser.add_argument("--queue", type=int, help="update scheduler queue size (default: the bot's)")
+    parser.add_argument("--session-backend", choices=["memory", "sqlite"], default="sqlite")
+    parser.add_argument("--telegram-limits", action="store_true", help="keep the real outgoing rate limits")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    stub = StubBotAPI(args.api_latency_ms / 1000)
+    runner, stub_url = await start_stub(stub)
+
+    tmp = tempfile.TemporaryDirectory()
+    os.environ.update({
+        "EPIBOT_TOKEN": "123456:LOADTEST",
+        "EPIBOT_API_SERVER": stub_url,
+        "EPIBOT_DB_URL": f"sqlite+aiosqlite:///{tmp.name}/loadtest.db",
+        "EPIBOT_SESSION_BACKEND": args.session_backend,
+        "EPIBOT_WEB_HOST": "127.0.0.1",
+        "PORT": "0",
+        "EPIBOT_LOG_FILE": os.path.join(tmp.name, "epibot.log"),
+        "EPIBOT_LOG_LEVEL": "WARNING",
+    })
+    if args.workers:
+        os.environ["EPIBOT_UPDATE_WORKERS"] = str(args.workers)
+    if args.queue:
+        os.environ["EPIBOT_UPDATE_QUEUE"] = str(args.queue)
+    if not args.telegram_limits:
+        os.environ.update({
+            "EPIBOT_OUTBOX_GLOBAL_RATE": "1000000",
+            "EPIBOT_OUTBOX_GLOBAL_BURST": "1000000",
+            "EPIBOT_OUTBOX_CHAT_RATE": "1000000",
+            "EPIBOT_OUTBOX_CHAT_BURST": "1000000",
+        })
+
+    # storage читает EPIBOT_DB_URL при импорте, поэтому всё, что его тянет, - после окружения
+    import EpiBot
+    from aiogram import Bot
+    from bench_sqlite import random_case
+    from scheduler import SCHEDULER_BACKPRESSURE
+
+    handler_samples = defaultdict(list)
+    EpiBot.dp.middleware.setup(HandlerTimer(EpiBot, handler_samples).middleware)
+    Bot.set_current(EpiBot.bot)
+    await EpiBot.on_startup(EpiBot.dp)
+
+    rnd = random.Random(args.seed)
+    cases = [random_case(rnd) for _ in range(args.seed_cases)]
+    for i in range(0, len(cases), 500):
+        await EpiBot.case_repo.import_cases(cases[i:i + 500], user_id=0)
+
+    test = LoadTest(EpiBot, stub, rnd, args.storm_size, random_case)
+    test.handlers = handler_samples
+    semaphore = asyncio.Semaphore(args.concurrency)
+
+    async def user(uid: int):
+        async with semaphore:
+            await test.run_user(uid, args.scenarios)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(100_000 + i) for i in range(args.users)))
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"users={args.users} concurrency={args.concurrency} workers={EpiBot.UPDATE_WORKERS} "
+        f"queue={EpiBot.UPDATE_QUEUE_SIZE} session_backend={args.session_backend}"
+    )
+    print(f"updates={test.updates} in {elapsed:.2f}s -> {test.updates / elapsed:.1f} updates/s")
+    print(f"Bot API calls: {dict(sorted(stub.calls.items()))}")
+    print(
+        f"throttled callbacks={EpiBot.THROTTLED_CALLBACKS.labels().value:g} "
+        f"user lock waits={EpiBot.USER_LOCK_WAITS.labels().value:g} "
+        f"scheduler backpressure={SCHEDULER_BACKPRESSURE.labels().value:g}"
+    )
+    for error, count in sorted(test.errors.items(), key=lambda item: -item[1]):
+        print(f"ERROR x{count} {error}")
+    print_table("Update latency by scenario step, ms (submit to done, incl. queue and waits)", test.steps)
+    print_table("Handler time, ms", test.handlers)
+
+    await EpiBot.on_shutdown(EpiBot.dp)
+    await (await EpiBot.bot.get_session()).close()
+    await runner.cleanup()
+    tmp.cleanup()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,127 @@
+import logging
+from typing import NamedTuple, Optional
+
+
+# --- Callback data ---
+# Формат: "<версия>:<код действия>[:<аргумент>...]", например "1:cs:15".
+# Короткие коды укладываются в 64 байта Telegram, а версия позволяет
+# поменять схему, не ломая кнопки в уже отправленных сообщениях. Старые
+# строки вида "add_next" и "case_show_15" (имя действия и число через "_")
+# по-прежнему распознаются.
+
+VERSION = "1"
+SEP = ":"
+MAX_DATA_BYTES = 64
+MAX_INT_DIGITS = 18  # с запасом помещается в INTEGER SQLite
+
+
+class Action(NamedTuple):
+    name: str         # имя для логов и метрик, оно же старый формат
+    code: str         # короткий код в callback data
+    arg_types: tuple  # int или str для каждого аргумента
+
+    def pack(self, *args) -> str:
+        if len(args) != len(self.arg_types):
+            raise ValueError(f"{self.name} expects {len(self.arg_types)} args, got {len(args)}")
+        parts = [VERSION, self.code]
+        for value, arg_type in zip(args, self.arg_types):
+            if not isinstance(value, arg_type):
+                raise ValueError(f"{self.name}: {value!r} is not {arg_type.__name__}")
+            value = str(value)
+            if SEP in value:
+                raise ValueError(f"{self.name}: {value!r} contains {SEP!r}")
+            parts.append(value)
+        data = SEP.join(parts)
+        if len(data.encode()) > MAX_DATA_BYTES:
+            raise ValueError(f"{self.name}: callback data longer than {MAX_DATA_BYTES} bytes")
+        return data
+
+
+def _parse_arg(value: str, arg_type):
+    if arg_type is int:
+        if not (value.isascii() and value.isdigit() and len(value) <= MAX_INT_DIGITS):
+            return None
+        return int(value)
+    return value
+
+
+class CallbackRouter:
+    """Разбор callback data и выбор хендлера поиском в словаре."""
+
+    def __init__(self):
+        self._by_code = {}   # код -> Action
+        self._by_name = {}   # имя -> Action, для старого формата
+        self._handlers = {}  # код -> корутина handler(query, *args)
+
+    def action(self, name: str, code: str, *arg_types) -> Action:
+        if code in self._by_code or name in self._by_name:
+            raise ValueError(f"Callback action {name!r}/{code!r} is already registered")
+        if SEP in code or "_" in code:
+            raise ValueError(f"Bad callback code {code!r}")
+        action = Action(name, code, tuple(arg_types))
+        self._by_code[code] = action
+        self._by_name[name] = action
+        return action
+
+    def handler(self, *actions: Action):
+        """Декоратор: регистрирует хендлер для одного или нескольких действий."""
+        def register(func):
+            for action in actions:
+                self._handlers[action.code] = func
+            return func
+        return register
+
+    def parse(self, data: Optional[str]) -> Optional[tuple]:
+        """(Action, аргументы) или None, если данные не распознаны."""
+        if not data:
+            return None
+
+        version, sep, rest = data.partition(SEP)
+        if sep:
+            if version != VERSION:
+                return None
+            code, *raw_args = rest.split(SEP)
+            action = self._by_code.get(code)
+        else:
+            # старый формат: "add_next" или "case_show_15"
+            action = self._by_name.get(data)
+            raw_args = []
+            if action is None:
+                name, _, raw_arg = data.rpartition("_")
+                action = self._by_name.get(name)
+                raw_args = [raw_arg]
+
+        if action is None or len(raw_args) != len(action.arg_types):
+            return None
+        args = tuple(_parse_arg(value, arg_type) for value, arg_type in zip(raw_args, action.arg_types))
+        if None in args:
+            return None
+        return action, args
+
+    def name(self, data: Optional[str]) -> str:
+        parsed = self.parse(data)
+        return parsed[0].name if parsed else "unknown"
+
+    def handler_name(self, data: Optional[str]) -> str:
+        parsed = self.parse(data)
+        handler = self._handlers.get(parsed[0].code) if parsed else None
+        return handler.__name__ if handler else "unknown"
+
+    async def dispatch(self, query) -> bool:
+        """Вызывает хендлер действия. Нераспознанный callback просто
+        подтверждается, чтобы у пользователя не висели «часики»."""
+        parsed = self.parse(query.data)
+        handler = self._handlers.get(parsed[0].code) if parsed else None
+        if handler is None:
+            logging.info(f"Unknown callback data {query.data!r} from {query.from_user.id}")
+            await query.answer()
+            return False
+
+        await handler(query, *parsed[1])
+        return True
+
+    def check(self):
+        """У каждого действия должен быть хендлер. Ошибка - RuntimeError."""
+        missing = sorted(action.name for code, action in self._by_code.items() if code not in self._handlers)
+        if missing:
+            raise RuntimeError(f"Callback actions without handlers: {missing}")
@@ -0,0 +1,297 @@
+"""Импорт и выгрузка записей cases в CSV/JSONL.
+
+Запуск из корня репозитория:
+
+    python cases_io.py import reports.csv
+    python cases_io.py import reports.jsonl.gz --user-id 5059876030 --batch-size 200
+    python cases_io.py export cases.csv.gz --anonymize
+
+Из бота то же делают команды /import (файл с подписью /import) и /export.
+"""
+
+import io
+import csv
+import gzip
+import json
+import asyncio
+import logging
+import argparse
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from itertools import chain
+
+from storage import DB_URL, EXPORT_CHUNK_SIZE, EXPORT_COLUMNS, CaseRepository, create_engine_for
+from validation import CASE_FIELDS, case_errors
+
+
+IMPORT_BATCH_SIZE = 500
+REPORT_REJECTED_LIMIT = 20  # сколько отклонённых строк показывать в отчёте
+
+GZIP_MAGIC = b"\x1f\x8b"
+GZIP_LEVEL = 6
+CSV_DELIMITERS = ",;\t"
+
+
+# --- Input formats ---
+
+def detect_format(filename: str) -> str:
+    """csv или jsonl по расширению файла (с .gz или без)."""
+    name = (filename or "").lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    raise ValueError(f"Unsupported file type: {filename!r}, expected .csv or .jsonl (optionally .gz)")
+
+
+def open_text(binary) -> io.TextIOBase:
+    """Текстовый поток поверх двоичного файла; gzip распознаётся по сигнатуре."""
+    head = binary.read(2)
+    binary.seek(0)
+    if head == GZIP_MAGIC:
+        binary = gzip.GzipFile(fileobj=binary, mode="rb")
+    # utf-8-sig съедает BOM, который добавляют табличные редакторы
+    return io.TextIOWrapper(binary, encoding="utf-8-sig", newline="")
+
+
+def iter_csv(stream):
+    """(номер строки, словарь). Разделитель - запятая, точка с запятой или табуляция."""
+    header = stream.readline()
+    if not header:
+        return
+    delimiter = max(CSV_DELIMITERS, key=header.count)
+    reader = csv.DictReader(chain([header], stream), delimiter=delimiter)
+    if "dog_name" not in (reader.fieldnames or []):
+        raise ValueError(f"CSV header must contain dog_name, got {reader.fieldnames}")
+    for row in reader:
+        yield reader.line_num, row
+
+
+def iter_jsonl(stream):
+    """(номер строки, словарь) или (номер строки, текст ошибки)."""
+    for line_no, line in enumerate(stream, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError as e:
+            yield line_no, f"invalid JSON: {e}"
+            continue
+        if not isinstance(row, dict):
+            yield line_no, "expected a JSON object"
+            continue
+        yield line_no, row
+
+
+READERS = {"csv": iter_csv, "jsonl": iter_jsonl}
+
+
+def clean_row(row: dict) -> dict:
+    case = {}
+    for name in CASE_FIELDS:
+        value = row.get(name)
+        case[name] = "" if value is None else str(value).strip()
+    return case
+
+
+# --- Import ---
+
+@dataclass
+class ImportReport:
+    accepted: int = 0
+    rejected: list = field(default_factory=list)  # (номер строки, причина)
+
+    def summary(self, limit: int = REPORT_REJECTED_LIMIT) -> str:
+        lines = [f"Импорт завершён: принято {self.accepted}, отклонено {len(self.rejected)}."]
+        for line_no, reason in self.rejected[:limit]:
+            lines.append(f"строка {line_no}: {reason}")
+        if len(self.rejected) > limit:
+            lines.append(f"... и ещё {len(self.rejected) - limit}")
+        return "\n".join(lines)
+
+
+async def import_stream(
+    repo: CaseRepository,
+    stream,
+    fmt: str,
+    user_id: int,
+    batch_size: int = IMPORT_BATCH_SIZE,
+) -> ImportReport:
+    """Читает записи из текстового потока и сохраняет подходящие пачками.
+
+    Каждая пачка - отдельная транзакция: если запись в базу упадёт, уже
+    сохранённые пачки останутся, а в отчёте будет их число.
+    """
+    report = ImportReport()
+    batch = []
+
+    async def flush():
+        await repo.import_cases(batch, user_id)
+        report.accepted += len(batch)
+        batch.clear()
+
+    for line_no, row in READERS[fmt](stream):
+        if isinstance(row, str):
+            report.rejected.append((line_no, row))
+            continue
+
+        case = clean_row(row)
+        if not any(case.values()):
+            continue
+        errors = case_errors(case)
+        if errors:
+            report.rejected.append((line_no, "; ".join(errors)))
+            continue
+
+        batch.append(case)
+        if len(batch) >= batch_size:
+            await flush()
+
+    if batch:
+        await flush()
+
+    logging.info(f"Import finished: accepted={report.accepted} rejected={len(report.rejected)}")
+    return report
+
+
+# --- Export ---
+
+class CsvWriter:
+    def __init__(self, out, columns: list):
+        self.writer = csv.DictWriter(out, fieldnames=columns)
+        self.writer.writeheader()
+
+    def write_rows(self, rows: list):
+        self.writer.writerows(rows)
+
+
+class JsonlWriter:
+    def __init__(self, out, columns: list):
+        self.out = out
+
+    def write_rows(self, rows: list):
+        self.out.writelines(json.dumps(row, ensure_ascii=False) + "\n" for row in rows)
+
+
+WRITERS = {"csv": CsvWriter, "jsonl": JsonlWriter}
+
+
+def export_columns(anonymize: bool) -> list:
+    return [name for name in EXPORT_COLUMNS if not (anonymize and name == "user_id")]
+
+
+def export_filename(fmt: str, anonymize: bool) -> str:
+    suffix = "-anon" if anonymize else ""
+    return f"epibot-cases-{datetime.now(timezone.utc):%Y%m%d-%H%M%S}{suffix}.{fmt}.gz"
+
+
+async def export_cases(
+    repo: CaseRepository,
+    binary,
+    fmt: str,
+    anonymize: bool = False,
+    compress: bool = True,
+    chunk_size: int = EXPORT_CHUNK_SIZE,
+) -> int:
+    """Пишет все записи cases в двоичный файл и возвращает их число.
+
+    Строки читаются из базы пачками; форматирование и gzip каждой пачки
+    выполняются в пуле потоков, чтобы не задерживать event loop.
+    binary после выгрузки остаётся открытым.
+    """
+    columns = export_columns(anonymize)
+    if compress:
+        target = gzip.GzipFile(fileobj=binary, mode="wb", compresslevel=GZIP_LEVEL)
+    else:
+        target = binary
+    out = io.TextIOWrapper(target, encoding="utf-8", newline="")
+    writer = WRITERS[fmt](out, columns)
+
+    loop = asyncio.get_running_loop()
+    count = 0
+    try:
+        async for rows in repo.stream_cases(columns, chunk_size):
+            await loop.run_in_executor(None, writer.write_rows, rows)
+            count += len(rows)
+    finally:
+        # дописываем буфер и конец gzip, сам binary не закрываем
+        await loop.run_in_executor(None, out.flush)
+        out.detach()
+        if compress:
+            await loop.run_in_executor(None, target.close)
+
+    logging.info(f"Exported {count} cases as {fmt}, anonymize={anonymize}")
+    return count
+
+
+# --- CLI ---
+
+async def _import_file(args) -> ImportReport:
+    fmt = args.format or detect_format(args.path)
+    repo = CaseRepository(create_engine_for(args.db_url))
+    try:
+        await repo.init_schema()
+        with open(args.path, "rb") as binary, open_text(binary) as stream:
+            return await import_stream(repo, stream, fmt, args.user_id, args.batch_size)
+    finally:
+        await repo.close()
+
+
+async def _export_file(args) -> int:
+    fmt = args.format or detect_format(args.path)
+    repo = CaseRepository(create_engine_for(args.db_url))
+    try:
+        await repo.init_schema()
+        with open(args.path, "wb") as binary:
+            return await export_cases(
+                repo,
+                binary,
+                fmt,
+                anonymize=args.anonymize,
+                compress=args.path.lower().endswith(".gz"),
+                chunk_size=args.chunk_size,
+            )
+    finally:
+        await repo.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Import and export of epilepsy case records")
+    parser.add_argument("--db-url", default=DB_URL)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    import_parser = commands.add_parser("import", help="load cases from a CSV or JSONL file")
+    import_parser.add_argument("path")
+    import_parser.add_argument("--format", choices=sorted(READERS), help="default: by file extension")
+    import_parser.add_argument("--user-id", type=int, default=0, help="user_id stored with imported rows")
+    import_parser.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+
+    export_parser = commands.add_parser("export", help="write all cases to a CSV or JSONL file (.gz to compress)")
+    export_parser.add_argument("path")
+    export_parser.add_argument("--format", choices=sorted(WRITERS), help="default: by file extension")
+    export_parser.add_argument("--anonymize", action="store_true", help="drop the user_id column")
+    export_parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+    if args.command == "import":
+        try:
+            report = asyncio.run(_import_file(args))
+        except (ValueError, OSError) as e:
+            parser.error(str(e))
+        print(report.summary(limit=len(report.rejected)))
+
+    elif args.command == "export":
+        try:
+            count = asyncio.run(_export_file(args))
+        except (ValueError, OSError) as e:
+            parser.error(str(e))
+        print(f"Exported {count} cases to {args.path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from types import MappingProxyType
+from typing import Mapping
+
+from aiogram import types
+
+
+# --- Localization catalog ---
+# Тексты лежат в locales/<язык>.json: плоский словарь ключ -> строка (или
+# список строк, который склеивается через перевод строки). При старте каждый
+# файл превращается в неизменяемый LocaleBundle с готовыми текстами и уже
+# сериализованными в JSON клавиатурами, поэтому хендлеры ничего не собирают
+# на каждом апдейте. Новый язык - это новый файл с тем же набором ключей.
+
+LOCALES_DIR = Path(__file__).resolve().parent / "locales"
+DEFAULT_LANG = "ru"
+
+
+@dataclass(frozen=True)
+class LocaleBundle:
+    lang: str
+    texts: Mapping[str, str]
+    keyboards: Mapping[str, str]  # имя -> reply_markup в виде JSON-строки
+
+    def text(self, key: str, **values) -> str:
+        template = self.texts[key]
+        return template.format(**values) if values else template
+
+    def keyboard(self, name: str) -> str:
+        return self.keyboards[name]
+
+
+def _serialize(markup) -> str:
+    return json.dumps(markup.to_python(), ensure_ascii=False)
+
+
+def _inline_keyboard(texts: dict, layout: list) -> str:
+    kb = types.InlineKeyboardMarkup()
+    for row in layout:
+        kb.row(*(types.InlineKeyboardButton(texts[key], callback_data=data) for key, data in row))
+    return _serialize(kb)
+
+
+def _reply_keyboard(texts: dict, layout: list) -> str:
+    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    for row in layout:
+        kb.row(*(texts[key] for key in row))
+    return _serialize(kb)
+
+
+def _read_catalog(path: Path) -> dict:
+    with open(path, encoding="utf-8") as f:
+        raw = json.load(f)
+    return {key: "\n".join(value) if isinstance(value, list) else value for key, value in raw.items()}
+
+
+def load_bundles(inline_layouts: dict, reply_layouts: dict, locales_dir: Path = LOCALES_DIR) -> dict:
+    """Читает все locales/*.json и возвращает {язык: LocaleBundle}.
+
+    inline_layouts: имя -> строки кнопок [(ключ текста, callback data), ...]
+    reply_layouts: имя -> строки кнопок [ключ текста, ...]
+    Все языки обязаны содержать те же ключи, что и язык по умолчанию.
+    """
+    # язык по умолчанию первым: в этом порядке языки показываются при выборе
+    paths = sorted(locales_dir.glob("*.json"), key=lambda path: (path.stem != DEFAULT_LANG, path.stem))
+    catalogs = {path.stem: _read_catalog(path) for path in paths}
+    if DEFAULT_LANG not in catalogs:
+        raise RuntimeError(f"Default locale {DEFAULT_LANG!r} not found in {locales_dir}")
+
+    expected = set(catalogs[DEFAULT_LANG])
+    bundles = {}
+    for lang, texts in catalogs.items():
+        missing = expected - set(texts)
+        extra = set(texts) - expected
+        if missing or extra:
+            raise RuntimeError(
+                f"Locale {lang!r} does not match {DEFAULT_LANG!r}: "
+                f"missing={sorted(missing)} extra={sorted(extra)}"
+            )
+
+        keyboards = {name: _inline_keyboard(texts, layout) for name, layout in inline_layouts.items()}
+        keyboards.update({name: _reply_keyboard(texts, layout) for name, layout in reply_layouts.items()})
+        bundles[lang] = LocaleBundle(lang, MappingProxyType(texts), MappingProxyType(keyboards))
+
+    return bundles
+
+
+def language_keyboard(bundles: dict) -> str:
+    """Reply-клавиатура выбора языка: по кнопке на каждый язык."""
+    kb = types.ReplyKeyboardMarkup(resize_keyboard=True)
+    kb.row(*(bundle.text("language.name") for bundle in bundles.values()))
+    return _serialize(kb)
+
+
+def text_variants(bundles: dict, key: str) -> frozenset:
+    """Текст ключа на всех языках, для фильтров по нажатой reply-кнопке."""
+    return frozenset(bundle.text(key) for bundle in bundles.values())
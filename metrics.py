@@ -0,0 +1,231 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+# --- Metrics registry ---
+# Минимальная реализация счётчиков и гистограмм в текстовом формате
+# Prometheus, чтобы не тянуть prometheus_client ради одного /metrics.
+# Все метрики обновляются из event loop, блокировки не нужны.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), registry=None):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        (registry if registry is not None else REGISTRY).register(self)
+
+    def labels(self, *values):
+        if len(values) != len(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def collect(self) -> list:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        for key in sorted(self._children):
+            lines.extend(self._child_lines(key, self._children[key]))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _child_lines(self, key, child):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {child.value:g}"]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum")
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последний - +Inf
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @contextmanager
+    def time(self):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (),
+                 buckets: tuple = DEFAULT_BUCKETS, registry=None):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, documentation, labelnames, registry)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _child_lines(self, key, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            labels = _format_labels(self.labelnames, key, f'le="{le}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{labels} {child.sum:.6f}")
+        lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def register(self, metric: _Metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+
+    def add_collector(self, collector):
+        """collector() вызывается перед каждой выдачей, чтобы обновить gauge
+        или счётчики, которые хранятся в других объектах."""
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for name in sorted(self._metrics):
+            lines.extend(self._metrics[name].collect())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+# --- Bot metrics ---
+
+HANDLER_SECONDS = Histogram(
+    "epibot_handler_seconds",
+    "Time spent in an update handler",
+    ("kind", "handler"),
+)
+HANDLER_UPDATES = Counter(
+    "epibot_handler_updates_total",
+    "Updates processed per handler",
+    ("kind", "handler"),
+)
+CALLBACK_SECONDS = Histogram(
+    "epibot_callback_seconds",
+    "Time spent handling a callback query, by callback action",
+    ("action",),
+)
+SQL_SECONDS = Histogram(
+    "epibot_sql_seconds",
+    "SQL statement execution time, by operation and result",
+    ("operation", "status"),
+)
+API_SECONDS = Histogram(
+    "epibot_api_seconds",
+    "Telegram Bot API request time",
+    ("method",),
+)
+API_REQUESTS = Counter(
+    "epibot_api_requests_total",
+    "Telegram Bot API requests by result",
+    ("method", "status"),
+)
+
+
+def _sql_operation(statement: str) -> str:
+    return statement.lstrip().split(None, 1)[0].upper() if statement and statement.strip() else "OTHER"
+
+
+def instrument_engine(engine: AsyncEngine):
+    """Замеряет время каждого SQL-запроса по типу операции (SELECT, INSERT...)
+    и результату: ok или error."""
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def _before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def _after_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        SQL_SECONDS.labels(_sql_operation(statement), "ok").observe(time.perf_counter() - started)
+
+    @event.listens_for(engine.sync_engine, "handle_error")
+    def _on_error(exception_context):
+        # после ошибки after_cursor_execute не вызывается: без этого стек
+        # query_started рос бы на каждом упавшем запросе
+        conn = exception_context.connection
+        stack = conn.info.get("query_started") if conn is not None else None
+        if not stack:
+            return
+        started = stack.pop()
+        SQL_SECONDS.labels(_sql_operation(exception_context.statement), "error").observe(
+            time.perf_counter() - started
+        )
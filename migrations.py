@@ -0,0 +1,342 @@
+import logging
+
+from sqlalchemy import text
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from name_index import name_key
+from pedigree import NAME_KEY_PREFIX, URL_KEY_PREFIX, dog_key, normalize_dog_name
+
+
+# --- Schema migrations ---
+# Версия схемы хранится в PRAGMA user_version. При старте применяются только
+# миграции с номером больше текущего, каждая в своей транзакции вместе с
+# обновлением user_version, поэтому повторный запуск ничего не переписывает.
+
+
+async def _execute_all(connection: AsyncConnection, statements: list):
+    for statement in statements:
+        await connection.execute(text(statement))
+
+
+async def _m001_cases(connection: AsyncConnection):
+    await connection.execute(text("""
+    CREATE TABLE IF NOT EXISTS cases (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        dog_name TEXT,
+        dog_pedigree_url TEXT,
+        dam_name TEXT,
+        dam_pedigree_url TEXT,
+        sire_name TEXT,
+        sire_pedigree_url TEXT,
+        sex TEXT,
+        birth_date TEXT,
+        timestamp TEXT
+    );
+    """))
+
+
+FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE cases_fts USING fts5(
+        dog_name,
+        content='cases',
+        content_rowid='id',
+        tokenize='trigram'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cases_fts_ai AFTER INSERT ON cases BEGIN
+        INSERT INTO cases_fts(rowid, dog_name) VALUES (new.id, new.dog_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cases_fts_ad AFTER DELETE ON cases BEGIN
+        INSERT INTO cases_fts(cases_fts, rowid, dog_name) VALUES ('delete', old.id, old.dog_name);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS cases_fts_au AFTER UPDATE OF dog_name ON cases BEGIN
+        INSERT INTO cases_fts(cases_fts, rowid, dog_name) VALUES ('delete', old.id, old.dog_name);
+        INSERT INTO cases_fts(rowid, dog_name) VALUES (new.id, new.dog_name);
+    END
+    """,
+    # заполняем индекс уже существующими записями
+    "INSERT INTO cases_fts(cases_fts) VALUES ('rebuild')",
+]
+
+
+async def _m002_cases_fts(connection: AsyncConnection):
+    # индекс мог быть создан ещё до появления миграций
+    if await table_exists(connection, "cases_fts"):
+        return
+
+    try:
+        async with connection.begin_nested():
+            await _execute_all(connection, FTS_SCHEMA)
+    except OperationalError as e:
+        # SQLite собран без FTS5 или без trigram: поиск останется на LIKE
+        logging.warning(f"FTS5 trigram index unavailable, using LIKE search: {e}")
+
+
+async def _m003_cases_indexes(connection: AsyncConnection):
+    await _execute_all(connection, [
+        "CREATE INDEX IF NOT EXISTS idx_cases_dog_name ON cases(dog_name)",
+        "CREATE INDEX IF NOT EXISTS idx_cases_timestamp ON cases(timestamp)",
+        "CREATE INDEX IF NOT EXISTS idx_cases_user_id ON cases(user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_cases_dog_pedigree_url ON cases(dog_pedigree_url)",
+        "CREATE INDEX IF NOT EXISTS idx_cases_dam_pedigree_url ON cases(dam_pedigree_url)",
+        "CREATE INDEX IF NOT EXISTS idx_cases_sire_pedigree_url ON cases(sire_pedigree_url)",
+    ])
+
+
+async def _m004_dogs(connection: AsyncConnection):
+    await _execute_all(connection, [
+        """
+        CREATE TABLE IF NOT EXISTS dogs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dog_key TEXT NOT NULL UNIQUE,
+            name TEXT,
+            pedigree_url TEXT,
+            sex TEXT,
+            birth_date TEXT,
+            dam_id INTEGER REFERENCES dogs(id),
+            sire_id INTEGER REFERENCES dogs(id)
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_dogs_dam_id ON dogs(dam_id)",
+        "CREATE INDEX IF NOT EXISTS idx_dogs_sire_id ON dogs(sire_id)",
+        "ALTER TABLE cases ADD COLUMN dog_id INTEGER REFERENCES dogs(id)",
+        "CREATE INDEX IF NOT EXISTS idx_cases_dog_id ON cases(dog_id)",
+    ])
+
+    # разовый перенос уже сохранённых анкет в граф родословных
+    result = await connection.execute(text("""
+        SELECT id, dog_name, dog_pedigree_url, dam_name, dam_pedigree_url,
+               sire_name, sire_pedigree_url, sex, birth_date
+        FROM cases
+        WHERE dog_id IS NULL
+        ORDER BY id
+    """))
+    rows = result.mappings().fetchall()
+    for row in rows:
+        await _m004_link_case(connection, row)
+
+    if rows:
+        logging.info(f"Backfilled pedigree graph from {len(rows)} cases")
+
+
+# Перенос в m004 не вызывает pedigree.link_case: рабочий код следует за
+# последней схемой, а здесь можно трогать только таблицы и колонки версии 4.
+# Ключи собак считаются общими чистыми функциями, SQL заморожен ниже.
+
+async def _m004_upsert_dog(connection: AsyncConnection, name, url, sex="", birth_date=""):
+    key = dog_key(name, url)
+    if key is None:
+        return None
+
+    name = (name or "").strip()
+    url = (url or "").strip()
+
+    if key.startswith(URL_KEY_PREFIX) and name:
+        await connection.execute(
+            text("""
+            UPDATE dogs
+            SET dog_key = :key, pedigree_url = :url
+            WHERE dog_key = :name_key
+              AND NOT EXISTS (SELECT 1 FROM dogs WHERE dog_key = :key)
+            """),
+            {"key": key, "url": url, "name_key": NAME_KEY_PREFIX + normalize_dog_name(name)},
+        )
+
+    await connection.execute(
+        text("""
+        INSERT INTO dogs (dog_key, name, pedigree_url, sex, birth_date)
+        VALUES (:key, :name, :url, :sex, :birth_date)
+        ON CONFLICT(dog_key) DO UPDATE SET
+            name = COALESCE(NULLIF(dogs.name, ''), excluded.name),
+            pedigree_url = COALESCE(NULLIF(dogs.pedigree_url, ''), excluded.pedigree_url),
+            sex = COALESCE(NULLIF(excluded.sex, ''), dogs.sex),
+            birth_date = COALESCE(NULLIF(excluded.birth_date, ''), dogs.birth_date)
+        """),
+        {"key": key, "name": name, "url": url, "sex": sex or "", "birth_date": birth_date or ""},
+    )
+
+    result = await connection.execute(text("SELECT id FROM dogs WHERE dog_key = :key"), {"key": key})
+    return result.scalar()
+
+
+async def _m004_link_case(connection: AsyncConnection, row):
+    dam_id = await _m004_upsert_dog(connection, row["dam_name"], row["dam_pedigree_url"])
+    sire_id = await _m004_upsert_dog(connection, row["sire_name"], row["sire_pedigree_url"])
+    dog_id = await _m004_upsert_dog(
+        connection, row["dog_name"], row["dog_pedigree_url"], row["sex"], row["birth_date"],
+    )
+    if dog_id is None:
+        return
+
+    # собака не может быть собственным родителем
+    if dam_id == dog_id:
+        dam_id = None
+    if sire_id == dog_id:
+        sire_id = None
+
+    await connection.execute(
+        text("""
+        UPDATE dogs
+        SET dam_id = COALESCE(:dam_id, dam_id),
+            sire_id = COALESCE(:sire_id, sire_id)
+        WHERE id = :dog_id
+        """),
+        {"dam_id": dam_id, "sire_id": sire_id, "dog_id": dog_id},
+    )
+    await connection.execute(
+        text("UPDATE cases SET dog_id = :dog_id WHERE id = :case_id"),
+        {"dog_id": dog_id, "case_id": row["id"]},
+    )
+
+
+async def _m005_parent_stats(connection: AsyncConnection):
+    await _execute_all(connection, [
+        # родители, которым засчитана запись в parent_stats
+        "ALTER TABLE cases ADD COLUMN dam_id INTEGER REFERENCES dogs(id)",
+        "ALTER TABLE cases ADD COLUMN sire_id INTEGER REFERENCES dogs(id)",
+        """
+        CREATE TABLE IF NOT EXISTS parent_stats (
+            parent_id INTEGER PRIMARY KEY REFERENCES dogs(id),
+            role TEXT NOT NULL,
+            affected_offspring INTEGER NOT NULL DEFAULT 0,
+            litters INTEGER NOT NULL DEFAULT 0
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_parent_stats_rank
+        ON parent_stats(affected_offspring DESC, litters DESC)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS parent_litters (
+            parent_id INTEGER NOT NULL REFERENCES dogs(id),
+            birth_date TEXT NOT NULL,
+            cases INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (parent_id, birth_date)
+        ) WITHOUT ROWID
+        """,
+        # разовое заполнение по уже сохранённым записям
+        """
+        UPDATE cases
+        SET dam_id = (SELECT dam_id FROM dogs WHERE dogs.id = cases.dog_id),
+            sire_id = (SELECT sire_id FROM dogs WHERE dogs.id = cases.dog_id)
+        WHERE dog_id IS NOT NULL
+        """,
+        """
+        INSERT INTO parent_litters (parent_id, birth_date, cases)
+        SELECT parent_id, birth_date, COUNT(*)
+        FROM (
+            SELECT dam_id AS parent_id, TRIM(birth_date) AS birth_date FROM cases WHERE dam_id IS NOT NULL
+            UNION ALL
+            SELECT sire_id, TRIM(birth_date) FROM cases WHERE sire_id IS NOT NULL
+        )
+        WHERE birth_date <> ''
+        GROUP BY parent_id, birth_date
+        """,
+        """
+        INSERT INTO parent_stats (parent_id, role, affected_offspring, litters)
+        SELECT parent_id, MIN(role), COUNT(*),
+               (SELECT COUNT(*) FROM parent_litters pl WHERE pl.parent_id = p.parent_id)
+        FROM (
+            SELECT dam_id AS parent_id, 'dam' AS role FROM cases WHERE dam_id IS NOT NULL
+            UNION ALL
+            SELECT sire_id, 'sire' FROM cases WHERE sire_id IS NOT NULL
+        ) p
+        GROUP BY parent_id
+        """,
+    ])
+
+
+async def _m006_sessions(connection: AsyncConnection):
+    await _execute_all(connection, [
+        """
+        CREATE TABLE IF NOT EXISTS sessions (
+            user_id INTEGER PRIMARY KEY,
+            data TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_sessions_updated_at ON sessions(updated_at)",
+    ])
+
+
+async def _m007_cases_name_key(connection: AsyncConnection):
+    await _execute_all(connection, [
+        "ALTER TABLE cases ADD COLUMN name_key TEXT",
+        "CREATE INDEX IF NOT EXISTS idx_cases_name_key ON cases(name_key)",
+    ])
+
+    # ключи считаются в Python (name_key), поэтому заполняем их здесь
+    result = await connection.execute(text("SELECT id, dog_name FROM cases"))
+    rows = [{"id": row.id, "name_key": name_key(row.dog_name)} for row in result]
+    if rows:
+        await connection.execute(text("UPDATE cases SET name_key = :name_key WHERE id = :id"), rows)
+        logging.info(f"Backfilled name_key for {len(rows)} cases")
+
+
+async def _m008_cases_dedup(connection: AsyncConnection):
+    await _execute_all(connection, [
+        # ключ анкеты: повторное «Сохранить» той же анкеты не создаёт вторую запись.
+        # NULL в UNIQUE не конфликтуют, поэтому старые и импортированные записи без ключа
+        "ALTER TABLE cases ADD COLUMN submission_key TEXT",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_cases_submission_key ON cases(submission_key)",
+        # проверка дублей по кличке и дате рождения; покрывает и поиск по одному name_key
+        "CREATE INDEX IF NOT EXISTS idx_cases_name_key_birth_date ON cases(name_key, birth_date)",
+        "DROP INDEX IF EXISTS idx_cases_name_key",
+    ])
+
+
+# (версия, функция). Номера только растут, старые миграции не редактируются.
+MIGRATIONS = [
+    (1, _m001_cases),
+    (2, _m002_cases_fts),
+    (3, _m003_cases_indexes),
+    (4, _m004_dogs),
+    (5, _m005_parent_stats),
+    (6, _m006_sessions),
+    (7, _m007_cases_name_key),
+    (8, _m008_cases_dedup),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+async def table_exists(connection: AsyncConnection, name: str) -> bool:
+    result = await connection.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+        {"name": name},
+    )
+    return result.first() is not None
+
+
+async def get_schema_version(connection: AsyncConnection) -> int:
+    result = await connection.execute(text("PRAGMA user_version"))
+    return result.scalar() or 0
+
+
+async def run_migrations(engine: AsyncEngine) -> int:
+    """Применяет недостающие миграции и возвращает итоговую версию схемы."""
+    async with engine.connect() as connection:
+        current = await get_schema_version(connection)
+
+    writer = engine.execution_options(sqlite_begin="IMMEDIATE")
+    for version, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+
+        async with writer.begin() as connection:
+            await migrate(connection)
+            # PRAGMA не принимает параметры, version всегда int из MIGRATIONS
+            await connection.execute(text(f"PRAGMA user_version = {int(version)}"))
+
+        logging.info(f"Applied schema migration {version}: {migrate.__name__}")
+        current = version
+
+    return current
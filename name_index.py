@@ -0,0 +1,197 @@
+import re
+import math
+import heapq
+import bisect
+import unicodedata
+from collections import defaultdict
+
+
+# --- Dog name matching ---
+# Клички приходят латиницей и кириллицей, с приставками питомника,
+# апострофами и диакритикой. name_key() сводит их к одному виду:
+# NFKC, casefold, без диакритики, кириллица в латиницу, упрощение похожих
+# написаний (y/j -> i, c -> k/ch, двойные буквы) и без служебных слов питомника
+# и титулов. Ключ хранится в cases.name_key; если правила поменяются,
+# ключи пересчитывает новая миграция.
+# NameIndex ищет по этим ключам нечётко, по общим триграммам, в памяти.
+
+TRANSLIT = {
+    "а": "a", "б": "b", "в": "v", "г": "g", "ґ": "g", "д": "d", "е": "e",
+    "є": "e", "ж": "zh", "з": "z", "и": "i", "і": "i", "ї": "i", "й": "i",
+    "к": "k", "л": "l", "м": "m", "н": "n", "о": "o", "п": "p", "р": "r",
+    "с": "s", "т": "t", "у": "u", "ф": "f", "х": "h", "ц": "ts", "ч": "ch",
+    "ш": "sh", "щ": "sch", "ъ": "", "ы": "i", "ь": "", "э": "e", "ю": "yu",
+    "я": "ya",
+}
+TRANSLIT_TABLE = str.maketrans(TRANSLIT)
+
+# (шаблон, замена) до транслитерации, по итальянскому чтению: gn - «нь»,
+# gli - «ли», ch и c перед a/o/u - «к», ce/ci - «че/чи», как их и пишут
+# кириллицей
+LATIN_FOLDS = [
+    (re.compile(r"gn"), "ni"),
+    (re.compile(r"gli"), "li"),
+    (re.compile(r"ch"), "k"),
+    (re.compile(r"c+(?=[ei])"), "ч"),
+    (re.compile(r"c"), "k"),
+]
+
+# (шаблон, замена) после транслитерации, по порядку
+SPELLING_FOLDS = [
+    (re.compile(r"ph"), "f"),
+    (re.compile(r"q"), "k"),
+    (re.compile(r"x"), "ks"),
+    (re.compile(r"w"), "v"),
+    (re.compile(r"[yj]"), "i"),
+    (re.compile(r"([a-z])\1+"), r"\1"),
+]
+
+# служебные слова в названиях питомников и титулы (уже после транслитерации)
+KENNEL_AFFIXES = frozenset({
+    "del", "dela", "delo", "dei", "deli", "dele", "dal", "dala", "di", "da",
+    "de", "du", "des", "la", "le", "il", "lo", "el", "of", "the", "von", "vom",
+    "van", "z", "ze", "iz", "s",
+    # Ch, JCh, GrCh, IntCh, JunCh, Champion после всех замен (и Int.Ch. через точку)
+    "k", "ik", "grk", "intk", "iunk", "kampion", "int", "gr", "iun",
+})
+
+NON_WORD = re.compile(r"[^0-9a-z]+")
+
+MIN_SCORE = 0.6  # доля триграмм запроса, которая должна найтись в кличке
+WORD_MIN_SCORE = 0.5  # то же для одного слова запроса и слова клички
+
+
+def name_key(name: str) -> str:
+    """Нормализованная кличка для сравнения и поиска; "" если сравнивать нечего."""
+    name = unicodedata.normalize("NFKC", name or "").casefold()
+    name = "".join(ch for ch in unicodedata.normalize("NFKD", name) if not unicodedata.combining(ch))
+    for pattern, replacement in LATIN_FOLDS:
+        name = pattern.sub(replacement, name)
+    name = name.translate(TRANSLIT_TABLE)
+    # апострофы и прочие знаки - граница слова: D'Artagnan -> d artagnan
+    name = NON_WORD.sub(" ", name)
+    for pattern, replacement in SPELLING_FOLDS:
+        name = pattern.sub(replacement, name)
+
+    words = name.split()
+    meaningful = [word for word in words if word not in KENNEL_AFFIXES]
+    # кличка из одних служебных слов остаётся как есть
+    return " ".join(meaningful or words)
+
+
+def word_trigrams(word: str) -> frozenset:
+    padded = f"  {word} "
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def trigrams(key: str) -> frozenset:
+    return frozenset().union(*map(word_trigrams, key.split()))
+
+
+class NameIndex:
+    """Триграммный индекс name_key -> записи cases.
+
+    Индексируются слова: у тысяч записей одни и те же клички и питомники,
+    поэтому похожие на запрос слова ищутся по небольшому словарю, а записи
+    берутся по готовым спискам слово -> записи. Похожие слова дают только
+    самые редкие триграммы запроса: слово, в котором нет ни одной из них, не
+    может набрать WORD_MIN_SCORE. Списки записей отсортированы так, как их
+    ранжирует поиск по одному слову, поэтому для него хватает первых limit
+    записей каждого похожего слова. Поля для списка результатов тоже лежат
+    здесь, поэтому поиск не ходит в базу.
+    """
+
+    def __init__(self, min_score: float = MIN_SCORE, word_min_score: float = WORD_MIN_SCORE):
+        self.min_score = min_score
+        self.word_min_score = word_min_score
+        self.loaded = False
+        self._rows = {}                    # case_id -> строка результата
+        self._case_words = {}              # case_id -> слова ключа
+        self._sizes = {}                   # case_id -> число триграмм ключа
+        self._word_cases = {}              # слово -> [(число триграмм, -case_id)] по возрастанию
+        self._word_grams = {}              # слово -> его триграммы
+        self._postings = defaultdict(set)  # триграмма -> слова
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def add(self, case_id: int, key: str, row: dict):
+        self.remove(case_id)
+        words = tuple(set(key.split()))
+        size = len(trigrams(key))
+        self._rows[case_id] = row
+        self._case_words[case_id] = words
+        self._sizes[case_id] = size
+        for word in words:
+            cases = self._word_cases.get(word)
+            if cases is None:
+                cases = self._word_cases[word] = []
+                grams = self._word_grams[word] = word_trigrams(word)
+                for gram in grams:
+                    self._postings[gram].add(word)
+            # короче кличка - выше в выдаче, при равной длине новые первыми
+            bisect.insort(cases, (size, -case_id))
+
+    def remove(self, case_id: int):
+        if self._rows.pop(case_id, None) is None:
+            return
+        entry = (self._sizes.pop(case_id), -case_id)
+        for word in self._case_words.pop(case_id):
+            cases = self._word_cases[word]
+            del cases[bisect.bisect_left(cases, entry)]
+            if cases:
+                continue
+            del self._word_cases[word]
+            for gram in self._word_grams.pop(word):
+                words = self._postings[gram]
+                words.discard(word)
+                if not words:
+                    del self._postings[gram]
+
+    def _similar_words(self, grams: frozenset) -> dict:
+        """Слова словаря -> сколько триграмм grams в них есть (не меньше WORD_MIN_SCORE)."""
+        need = max(1, math.ceil(self.word_min_score * len(grams)))
+        rare_first = sorted(grams, key=lambda gram: len(self._postings.get(gram, ())))
+        candidates = set()
+        for gram in rare_first[:len(grams) - need + 1]:
+            candidates |= self._postings.get(gram, set())
+
+        similar = {}
+        for word in candidates:
+            shared = len(grams & self._word_grams[word])
+            if shared >= need:
+                similar[word] = shared
+        return similar
+
+    def search(self, query: str, limit: int) -> list:
+        """Записи по убыванию сходства, при равном - новые первыми."""
+        query_words = set(name_key(query).split())
+        if not query_words:
+            return []
+
+        # запрос из одного слова: у записей одного слова одинаковая полнота,
+        # и лучшие из них - первые в списке
+        per_word = limit if len(query_words) == 1 else None
+
+        # для каждой записи - сколько триграмм запроса нашлось в её словах
+        found = defaultdict(int)
+        total = 0
+        for query_word in query_words:
+            grams = word_trigrams(query_word)
+            total += len(grams)
+            best = {}
+            for word, shared in self._similar_words(grams).items():
+                for _, neg_id in self._word_cases[word][:per_word]:
+                    if shared > best.get(-neg_id, 0):
+                        best[-neg_id] = shared
+            for case_id, shared in best.items():
+                found[case_id] += shared
+
+        need = self.min_score * total
+        scored = [
+            # сначала полнота совпадения запроса, затем близость длины
+            (shared / total, 2 * shared / (total + self._sizes[case_id]), case_id)
+            for case_id, shared in found.items()
+            if shared >= need
+        ]
+        return [dict(self._rows[case_id]) for _, _, case_id in heapq.nlargest(limit, scored)]
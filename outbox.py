@@ -0,0 +1,181 @@
+import time
+import asyncio
+import logging
+
+from aiogram.utils.exceptions import RetryAfter
+
+import metrics
+
+
+# --- Outbound rate limiting ---
+# Все вызовы Bot API, которые пишут в чат, проходят через Outbox: общий
+# token bucket на бота и отдельный на каждый чат, ожидание по RetryAfter и
+# склейка подряд идущих правок одного сообщения.
+
+# методы, на которые действуют лимиты Telegram на сообщения
+LIMITED_PREFIXES = ("send", "edit", "copy", "forward", "delete")
+
+OUTBOX_WAIT_SECONDS = metrics.Histogram(
+    "epibot_outbox_wait_seconds",
+    "Time an outgoing request waited for rate limit tokens",
+    ("method",),
+)
+OUTBOX_RETRY_AFTER = metrics.Counter(
+    "epibot_outbox_retry_after_total",
+    "RetryAfter (429) responses received from Telegram",
+    ("method",),
+)
+OUTBOX_COALESCED = metrics.Counter(
+    "epibot_outbox_coalesced_total",
+    "Edits replaced by a newer edit of the same message before being sent",
+    ("method",),
+)
+
+
+class TokenBucket:
+    """Token bucket с резервированием: reserve() сразу списывает токен
+    (баланс может уйти в минус) и возвращает, сколько ждать. Так ожидающие
+    обслуживаются в порядке обращения."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        self._refill(now)
+        self.tokens -= 1
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def block(self, now: float, seconds: float):
+        self.blocked_until = max(self.blocked_until, now + seconds)
+
+    def idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst and self.blocked_until <= now
+
+
+class _PendingEdit:
+    __slots__ = ("data", "future")
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.future = None  # создаётся, только если правку кто-то догнал
+
+
+class Outbox:
+    def __init__(
+        self,
+        global_rate: float = 25,
+        global_burst: float = 30,
+        chat_rate: float = 1,
+        chat_burst: float = 3,
+        max_retries: int = 3,
+        max_chats: int = 10_000,
+    ):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chats = {}          # chat_id -> TokenBucket
+        self._pending_edits = {}  # (method, chat_id, message_id) -> _PendingEdit
+
+    def _chat_bucket(self, chat_id, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.max_chats:
+                # забываем чаты, которым сейчас ничего не отправляется
+                self._chats = {key: b for key, b in self._chats.items() if not b.idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    async def _acquire(self, method: str, chat_id):
+        now = time.monotonic()
+        wait = self.global_bucket.reserve(now)
+        if chat_id is not None:
+            wait = max(wait, self._chat_bucket(chat_id, now).reserve(now))
+        OUTBOX_WAIT_SECONDS.labels(method).observe(wait)
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def _block(self, chat_id, seconds: float):
+        now = time.monotonic()
+        if chat_id is None:
+            self.global_bucket.block(now, seconds)
+        else:
+            self._chat_bucket(chat_id, now).block(now, seconds)
+
+    async def submit(self, method: str, data: dict, send):
+        """Отправляет запрос через send(data) с учётом лимитов.
+
+        send - корутина-функция, выполняющая сам HTTP-вызов.
+        """
+        if not method.startswith(LIMITED_PREFIXES):
+            return await send(data)
+
+        data = data or {}
+        chat_id = data.get("chat_id")
+        if chat_id is not None:
+            chat_id = str(chat_id)
+
+        if method.startswith("edit") and data.get("message_id") is not None:
+            return await self._submit_edit(method, chat_id, data, send)
+
+        await self._acquire(method, chat_id)
+        return await self._send_with_retry(method, chat_id, data, send)
+
+    async def _submit_edit(self, method: str, chat_id, data: dict, send):
+        key = (method, chat_id, str(data["message_id"]))
+        pending = self._pending_edits.get(key)
+        if pending is not None:
+            # предыдущая правка ещё ждёт токен: отправится сразу новая версия
+            pending.data = data
+            if pending.future is None:
+                pending.future = asyncio.get_event_loop().create_future()
+            OUTBOX_COALESCED.labels(method).inc()
+            return await asyncio.shield(pending.future)
+
+        pending = self._pending_edits[key] = _PendingEdit(data)
+        try:
+            await self._acquire(method, chat_id)
+        except BaseException:
+            # отмена во время ожидания: догнавшие правки не должны зависнуть
+            if pending.future is not None:
+                pending.future.cancel()
+            raise
+        finally:
+            del self._pending_edits[key]
+
+        try:
+            result = await self._send_with_retry(method, chat_id, pending.data, send)
+        except Exception as e:
+            if pending.future is not None:
+                pending.future.set_exception(e)
+                # исключение получат ожидающие; здесь помечаем его как прочитанное
+                pending.future.exception()
+            raise
+        if pending.future is not None:
+            pending.future.set_result(result)
+        return result
+
+    async def _send_with_retry(self, method: str, chat_id, data: dict, send):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await send(data)
+            except RetryAfter as e:
+                OUTBOX_RETRY_AFTER.labels(method).inc()
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"RetryAfter {e.timeout}s for {method} chat={chat_id}, attempt {attempt + 1}")
+                self._block(chat_id, e.timeout)
+                await self._acquire(method, chat_id)
@@ -0,0 +1,550 @@
+import asyncio
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlsplit, urlunsplit
+
+from sqlalchemy import bindparam, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+
+# --- Dog identity ---
+# Собака в таблице dogs определяется ключом dog_key: канонической ссылкой на
+# родословную, а если ссылки нет, нормализованной кличкой с префиксом "name:".
+
+URL_KEY_PREFIX = "url:"
+NAME_KEY_PREFIX = "name:"
+
+
+def canonical_pedigree_url(url: str) -> str:
+    """Приводит ссылку к одному виду: https, хост в нижнем регистре, без www,
+    без якоря и завершающего слэша."""
+    url = (url or "").strip()
+    if not url:
+        return ""
+
+    parts = urlsplit(url)
+    host = parts.netloc.lower()
+    if host.startswith("www."):
+        host = host[4:]
+    path = parts.path.rstrip("/")
+    return urlunsplit(("https", host, path, parts.query, ""))
+
+
+def normalize_dog_name(name: str) -> str:
+    name = unicodedata.normalize("NFKC", name or "")
+    return " ".join(name.casefold().split())
+
+
+def dog_key(name: str, url: str = "") -> Optional[str]:
+    canonical = canonical_pedigree_url(url)
+    if canonical:
+        return URL_KEY_PREFIX + canonical
+
+    normalized = normalize_dog_name(name)
+    if normalized:
+        return NAME_KEY_PREFIX + normalized
+
+    return None
+
+
+# --- Graph writes ---
+
+async def upsert_dog(
+    connection: AsyncConnection,
+    name: str,
+    url: str = "",
+    sex: str = "",
+    birth_date: str = "",
+) -> Optional[int]:
+    """Находит или создаёт собаку в dogs и возвращает её id."""
+    key = dog_key(name, url)
+    if key is None:
+        return None
+
+    name = (name or "").strip()
+    url = (url or "").strip()
+
+    if key.startswith(URL_KEY_PREFIX) and name:
+        # раньше собака могла попасть в граф только по кличке:
+        # если такой узел есть, переводим его на ключ по ссылке
+        await connection.execute(
+            text(
+                """
+                UPDATE dogs
+                SET dog_key = :key, pedigree_url = :url
+                WHERE dog_key = :name_key
+                  AND NOT EXISTS (SELECT 1 FROM dogs WHERE dog_key = :key)
+                """
+            ),
+            {"key": key, "url": url, "name_key": NAME_KEY_PREFIX + normalize_dog_name(name)},
+        )
+
+    await connection.execute(
+        text(
+            """
+            INSERT INTO dogs (dog_key, name, pedigree_url, sex, birth_date)
+            VALUES (:key, :name, :url, :sex, :birth_date)
+            ON CONFLICT(dog_key) DO UPDATE SET
+                name = COALESCE(NULLIF(dogs.name, ''), excluded.name),
+                pedigree_url = COALESCE(NULLIF(dogs.pedigree_url, ''), excluded.pedigree_url),
+                sex = COALESCE(NULLIF(excluded.sex, ''), dogs.sex),
+                birth_date = COALESCE(NULLIF(excluded.birth_date, ''), dogs.birth_date)
+            """
+        ),
+        {"key": key, "name": name, "url": url, "sex": sex or "", "birth_date": birth_date or ""},
+    )
+
+    result = await connection.execute(
+        text("SELECT id FROM dogs WHERE dog_key = :key"),
+        {"key": key},
+    )
+    return result.scalar()
+
+
+async def link_case(connection: AsyncConnection, case_id: int, case: dict) -> set:
+    """Заносит собаку из анкеты и её родителей в граф и привязывает к ним запись cases.
+
+    Возвращает id собак, у которых могли измениться связи (для сброса кэша).
+    """
+    dam_id = await upsert_dog(connection, case.get("dam_name"), case.get("dam_pedigree_url"))
+    sire_id = await upsert_dog(connection, case.get("sire_name"), case.get("sire_pedigree_url"))
+    dog_id = await upsert_dog(
+        connection,
+        case.get("dog_name"),
+        case.get("dog_pedigree_url"),
+        sex=case.get("sex"),
+        birth_date=case.get("birth_date"),
+    )
+    if dog_id is None:
+        return set()
+
+    # собака не может быть собственным родителем, такие ссылки не сохраняем
+    if dam_id == dog_id:
+        dam_id = None
+    if sire_id == dog_id:
+        sire_id = None
+
+    result = await connection.execute(
+        text("SELECT dam_id, sire_id FROM dogs WHERE id = :dog_id"),
+        {"dog_id": dog_id},
+    )
+    old_dam_id, old_sire_id = result.one()
+
+    await connection.execute(
+        text(
+            """
+            UPDATE dogs
+            SET dam_id = COALESCE(:dam_id, dam_id),
+                sire_id = COALESCE(:sire_id, sire_id)
+            WHERE id = :dog_id
+            """
+        ),
+        {"dam_id": dam_id, "sire_id": sire_id, "dog_id": dog_id},
+    )
+    await connection.execute(
+        text("UPDATE cases SET dog_id = :dog_id WHERE id = :case_id"),
+        {"dog_id": dog_id, "case_id": case_id},
+    )
+
+    touched = {dog_id, dam_id, sire_id, old_dam_id, old_sire_id}
+    touched.discard(None)
+    return touched
+
+
+# --- Parent stats ---
+# parent_stats хранит для каждого родителя число больных потомков и число
+# помётов (разных дат рождения). Счётчики меняются на каждой записи и удалении,
+# parent_litters помнит, сколько записей приходится на каждую дату.
+
+async def _bump_parent(connection: AsyncConnection, parent_id: int, role: str, birth_date: str, delta: int):
+    await connection.execute(
+        text(
+            """
+            INSERT INTO parent_stats (parent_id, role, affected_offspring, litters)
+            VALUES (:parent_id, :role, 0, 0)
+            ON CONFLICT(parent_id) DO NOTHING
+            """
+        ),
+        {"parent_id": parent_id, "role": role},
+    )
+
+    litters_delta = 0
+    if birth_date:
+        await connection.execute(
+            text(
+                """
+                INSERT INTO parent_litters (parent_id, birth_date, cases)
+                VALUES (:parent_id, :birth_date, 0)
+                ON CONFLICT(parent_id, birth_date) DO NOTHING
+                """
+            ),
+            {"parent_id": parent_id, "birth_date": birth_date},
+        )
+        await connection.execute(
+            text(
+                """
+                UPDATE parent_litters SET cases = cases + :delta
+                WHERE parent_id = :parent_id AND birth_date = :birth_date
+                """
+            ),
+            {"parent_id": parent_id, "birth_date": birth_date, "delta": delta},
+        )
+        result = await connection.execute(
+            text("SELECT cases FROM parent_litters WHERE parent_id = :parent_id AND birth_date = :birth_date"),
+            {"parent_id": parent_id, "birth_date": birth_date},
+        )
+        cases = result.scalar()
+        if delta > 0 and cases == delta:
+            litters_delta = 1
+        elif delta < 0 and cases <= 0:
+            litters_delta = -1
+            await connection.execute(
+                text("DELETE FROM parent_litters WHERE parent_id = :parent_id AND birth_date = :birth_date"),
+                {"parent_id": parent_id, "birth_date": birth_date},
+            )
+
+    await connection.execute(
+        text(
+            """
+            UPDATE parent_stats
+            SET affected_offspring = affected_offspring + :delta,
+                litters = litters + :litters_delta
+            WHERE parent_id = :parent_id
+            """
+        ),
+        {"parent_id": parent_id, "delta": delta, "litters_delta": litters_delta},
+    )
+
+
+async def count_case_parents(connection: AsyncConnection, case_id: int, delta: int):
+    """Учитывает запись (delta=1) или снимает её учёт (delta=-1) в parent_stats.
+
+    При учёте в cases.dam_id/sire_id запоминаются родители, которым засчитана
+    запись, чтобы при удалении снять счётчики ровно с них.
+    """
+    if delta > 0:
+        await connection.execute(
+            text(
+                """
+                UPDATE cases
+                SET dam_id = (SELECT dam_id FROM dogs WHERE dogs.id = cases.dog_id),
+                    sire_id = (SELECT sire_id FROM dogs WHERE dogs.id = cases.dog_id)
+                WHERE id = :case_id
+                """
+            ),
+            {"case_id": case_id},
+        )
+
+    result = await connection.execute(
+        text("SELECT dam_id, sire_id, birth_date FROM cases WHERE id = :case_id"),
+        {"case_id": case_id},
+    )
+    row = result.one_or_none()
+    if row is None:
+        return
+
+    birth_date = (row.birth_date or "").strip()
+    if row.dam_id is not None:
+        await _bump_parent(connection, row.dam_id, "dam", birth_date, delta)
+    if row.sire_id is not None:
+        await _bump_parent(connection, row.sire_id, "sire", birth_date, delta)
+
+
+# --- Graph traversal ---
+
+class LRUCache:
+    """Словарь с ограниченным размером: при переполнении вытесняется
+    самый давно использованный ключ."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+
+    def __contains__(self, key) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key, default=None):
+        try:
+            self._data.move_to_end(key)
+        except KeyError:
+            return default
+        return self._data[key]
+
+    def put(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+
+class PedigreeGraph:
+    """Обход родословной вверх (предки) и вниз (потомки).
+
+    Рёбра берутся рекурсивным CTE по dam_id/sire_id и складываются в
+    LRU-кэш смежности, поэтому повторные обходы от популярных производителей
+    не обращаются к SQLite. save_case сбрасывает записи изменённых собак.
+    """
+
+    def __init__(self, engine: AsyncEngine, cache_size: int = 4096):
+        self.engine = engine
+        self._parents = LRUCache(cache_size)   # dog_id -> (dam_id, sire_id)
+        self._children = LRUCache(cache_size)  # dog_id -> tuple(child ids)
+
+    def invalidate(self, dog_ids):
+        for dog_id in dog_ids:
+            self._parents.pop(dog_id)
+            self._children.pop(dog_id)
+
+    def clear(self):
+        self._parents.clear()
+        self._children.clear()
+
+    def cached_parents(self, dog_id: int) -> tuple:
+        return self._parents.get(dog_id, (None, None))
+
+    async def parents(self, dog_id: int) -> tuple:
+        if dog_id not in self._parents:
+            await self._load_ancestors(dog_id, 1)
+        return self._parents.get(dog_id, (None, None))
+
+    async def children(self, dog_id: int) -> tuple:
+        if dog_id not in self._children:
+            await self._load_descendants(dog_id, 1)
+        return self._children.get(dog_id, ())
+
+    async def ancestors(self, dog_id: int, depth: int) -> dict:
+        """Предки до depth поколений: {dog_id: поколение}, родители = 1."""
+        if self._walk_cached(dog_id, depth, self._parents) is None:
+            await self._load_ancestors(dog_id, depth)
+        return self._walk_cached(dog_id, depth, self._parents) or {}
+
+    async def descendants(self, dog_id: int, depth: int) -> dict:
+        """Потомки до depth поколений: {dog_id: поколение}, дети = 1."""
+        if self._walk_cached(dog_id, depth, self._children) is None:
+            await self._load_descendants(dog_id, depth)
+        return self._walk_cached(dog_id, depth, self._children) or {}
+
+    @staticmethod
+    def _walk_cached(dog_id: int, depth: int, edges: LRUCache) -> Optional[dict]:
+        # обход в ширину только по кэшу; None, если какого-то узла в кэше нет
+        found = {}
+        frontier = [dog_id]
+        for generation in range(1, depth + 1):
+            next_frontier = []
+            for node in frontier:
+                if node not in edges:
+                    return None
+                for neighbour in edges.get(node):
+                    if neighbour is None or neighbour == dog_id or neighbour in found:
+                        continue
+                    found[neighbour] = generation
+                    next_frontier.append(neighbour)
+            frontier = next_frontier
+        return found
+
+    async def _load_ancestors(self, dog_id: int, depth: int):
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                text(
+                    """
+                    WITH RECURSIVE anc(id, dam_id, sire_id, depth) AS (
+                        SELECT id, dam_id, sire_id, 0 FROM dogs WHERE id = :dog_id
+                        UNION
+                        SELECT d.id, d.dam_id, d.sire_id, anc.depth + 1
+                        FROM anc
+                        JOIN dogs d ON d.id IN (anc.dam_id, anc.sire_id)
+                        WHERE anc.depth < :depth
+                    )
+                    SELECT DISTINCT id, dam_id, sire_id FROM anc
+                    """
+                ),
+                {"dog_id": dog_id, "depth": depth},
+            )
+            for row in result:
+                self._parents.put(row.id, (row.dam_id, row.sire_id))
+
+    async def _load_descendants(self, dog_id: int, depth: int):
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                text(
+                    """
+                    WITH RECURSIVE des(id, parent_id, depth) AS (
+                        SELECT :dog_id, NULL, 0
+                        UNION
+                        SELECT d.id, des.id, des.depth + 1
+                        FROM des JOIN dogs d ON d.dam_id = des.id
+                        WHERE des.depth < :depth
+                        UNION
+                        SELECT d.id, des.id, des.depth + 1
+                        FROM des JOIN dogs d ON d.sire_id = des.id
+                        WHERE des.depth < :depth
+                    )
+                    SELECT id, parent_id, depth FROM des
+                    """
+                ),
+                {"dog_id": dog_id, "depth": depth},
+            )
+            rows = result.fetchall()
+
+        # список детей полон только у узлов, раскрытых CTE (глубина < depth)
+        expanded = {row.id for row in rows if row.depth < depth}
+        children = {node: set() for node in expanded}
+        for row in rows:
+            if row.parent_id in children:
+                children[row.parent_id].add(row.id)
+        for node, kids in children.items():
+            self._children.put(node, tuple(sorted(kids)))
+
+    async def names(self, dog_ids) -> dict:
+        dog_ids = list(dog_ids)
+        if not dog_ids:
+            return {}
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                text("SELECT id, name FROM dogs WHERE id IN :ids").bindparams(
+                    bindparam("ids", expanding=True)
+                ),
+                {"ids": dog_ids},
+            )
+            return {row.id: row.name for row in result}
+
+
+# --- Kinship / COI ---
+
+KINSHIP_MAX_DEPTH = 30
+KINSHIP_TIMEOUT = 1.0
+
+
+class KinshipTimeout(Exception):
+    """Расчёт родства не уложился в отведённое время."""
+
+
+class KinshipCalculator:
+    """Коэффициент родства и инбридинга по табличному методу.
+
+    phi(a, a) = (1 + phi(dam_a, sire_a)) / 2
+    phi(a, b) = (phi(dam_a, b) + phi(sire_a, b)) / 2, где a не предок b
+
+    Раскрывается всегда "младшая" собака пары (больший порядок в графе),
+    поэтому рекурсия конечна. Значения пар запоминаются в ограниченном LRU,
+    так что каждая пара считается один раз вместо перебора всех путей,
+    число которых растёт экспоненциально с глубиной родословной.
+    LRU живёт только в пределах одного mating_report: phi зависит от предков,
+    обрезанных по глубине для этой пары, и от порядка, в котором для неё
+    разорваны циклы, поэтому значения из другого расчёта брать нельзя.
+
+    Сам расчёт синхронный и занимает CPU до KINSHIP_TIMEOUT, поэтому идёт в
+    пуле потоков по снимку родителей, а event loop продолжает обрабатывать
+    апдейты других пользователей.
+    """
+
+    def __init__(self, graph: PedigreeGraph, cache_size: int = 200_000):
+        self.graph = graph
+        self.cache_size = cache_size
+
+    async def mating_report(self, dam_id: int, sire_id: int, timeout: float = KINSHIP_TIMEOUT) -> dict:
+        """COI потомка от планируемой вязки и общие предки родителей.
+
+        common_ancestors: {dog_id: (поколение со стороны матери, со стороны отца)}.
+        """
+        deadline = time.monotonic() + timeout
+
+        dam_ancestors = await self.graph.ancestors(dam_id, KINSHIP_MAX_DEPTH)
+        sire_ancestors = await self.graph.ancestors(sire_id, KINSHIP_MAX_DEPTH)
+
+        dam_line = {**dam_ancestors, dam_id: 0}
+        sire_line = {**sire_ancestors, sire_id: 0}
+
+        # снимок родителей из кэша графа: поток не трогает общий LRU
+        known = set(dam_line) | set(sire_line)
+        parents = {}
+        for dog_id in known:
+            dam, sire = self.graph.cached_parents(dog_id)
+            parents[dog_id] = (dam if dam in known else None, sire if sire in known else None)
+
+        loop = asyncio.get_running_loop()
+        coi = await loop.run_in_executor(None, self._coi, dam_id, sire_id, parents, deadline)
+
+        common = {
+            dog_id: (dam_line[dog_id], sire_line[dog_id])
+            for dog_id in set(dam_line) & set(sire_line)
+        }
+        return {"coi": coi, "common_ancestors": common}
+
+    def _coi(self, dam_id: int, sire_id: int, parents: dict, deadline: float) -> float:
+        order = self._order(parents)
+        # рёбра, разорванные при поиске циклов, в расчёт не берём
+        for dog_id, (dam, sire) in parents.items():
+            parents[dog_id] = tuple(
+                p if p is not None and order[p] < order[dog_id] else None
+                for p in (dam, sire)
+            )
+
+        memo = LRUCache(self.cache_size)  # (min_id, max_id) -> phi
+        return self._phi(dam_id, sire_id, parents, order, memo, deadline)
+
+    @staticmethod
+    def _order(parents: dict) -> dict:
+        # порядок собаки: 0 у основателей, иначе 1 + максимум по родителям.
+        # Предок всегда меньше потомка. Циклы в данных разрываются.
+        order = {}
+        for start in parents:
+            if start in order:
+                continue
+            stack = [(start, False)]
+            on_path = set()
+            while stack:
+                node, expanded = stack.pop()
+                if expanded:
+                    on_path.discard(node)
+                    order[node] = 1 + max(
+                        (order.get(p, -1) for p in parents[node] if p is not None),
+                        default=-1,
+                    )
+                    continue
+                if node in order or node in on_path:
+                    continue
+                on_path.add(node)
+                stack.append((node, True))
+                for p in parents[node]:
+                    if p is not None and p not in order and p not in on_path:
+                        stack.append((p, False))
+        return order
+
+    def _phi(self, a, b, parents: dict, order: dict, memo: LRUCache, deadline: float) -> float:
+        if a is None or b is None:
+            return 0.0
+
+        key = (a, b) if a <= b else (b, a)
+        cached = memo.get(key)
+        if cached is not None:
+            return cached
+
+        if time.monotonic() > deadline:
+            raise KinshipTimeout()
+
+        if a == b:
+            dam, sire = parents.get(a, (None, None))
+            value = 0.5 * (1.0 + self._phi(dam, sire, parents, order, memo, deadline))
+        else:
+            if order.get(a, 0) < order.get(b, 0):
+                a, b = b, a
+            dam, sire = parents.get(a, (None, None))
+            value = 0.5 * (
+                self._phi(dam, b, parents, order, memo, deadline)
+                + self._phi(sire, b, parents, order, memo, deadline)
+            )
+
+        memo.put(key, value)
+        return value
@@ -0,0 +1,183 @@
+import time
+import asyncio
+import logging
+from collections import deque
+
+import metrics
+
+
+# --- Update scheduling ---
+# Входящие апдейты обрабатывает фиксированный пул воркеров. У каждого
+# пользователя своя очередь: его апдейты идут строго по одному и по порядку,
+# а разные пользователи обрабатываются параллельно. Пользователь, у которого
+# первым в очереди стоит нажатие кнопки, попадает в приоритетную полосу и
+# обгоняет чужие сообщения, но не свои более ранние апдейты. Всего в очередях
+# не больше max_pending апдейтов: submit() ждёт места (backpressure).
+
+PRIORITY = "priority"
+NORMAL = "normal"
+
+SCHEDULER_WAIT_SECONDS = metrics.Histogram(
+    "epibot_scheduler_wait_seconds",
+    "Time an update waited in the scheduler queue before a worker took it",
+    ("lane",),
+)
+SCHEDULER_PENDING = metrics.Gauge(
+    "epibot_scheduler_pending_updates",
+    "Updates queued or being processed by the scheduler",
+)
+SCHEDULER_BACKPRESSURE = metrics.Counter(
+    "epibot_scheduler_backpressure_total",
+    "Times a producer waited because the scheduler queue was full",
+)
+
+
+def update_user_id(update):
+    """Пользователь, от которого пришёл апдейт, или None."""
+    event = update.message or update.callback_query or update.edited_message
+    return event.from_user.id if event and event.from_user else None
+
+
+def is_callback(update) -> bool:
+    return update.callback_query is not None
+
+
+class UpdateScheduler:
+    def __init__(
+        self,
+        process,
+        workers: int = 16,
+        max_pending: int = 1000,
+        priority_burst: int = 4,
+        key=update_user_id,
+        priority=is_callback,
+    ):
+        """process - корутина-функция, обрабатывающая один апдейт.
+
+        priority_burst: сколько приоритетных апдейтов подряд можно взять,
+        пока в обычной полосе кто-то ждёт, - чтобы поток нажатий не
+        остановил сообщения совсем.
+        """
+        self.process = process
+        self.workers = workers
+        self.max_pending = max_pending
+        self.priority_burst = priority_burst
+        self.key = key
+        self.priority = priority
+
+        self._mailboxes = {}  # ключ -> deque[(апдейт, время постановки, future)]
+        self._lanes = {PRIORITY: deque(), NORMAL: deque()}  # ключи, готовые к обработке
+        self._ready = asyncio.Semaphore(0)  # сколько ключей стоит в полосах
+        self._space = asyncio.Condition()
+        self._pending = 0
+        self._priority_streak = 0
+        self._tasks = []
+
+    def __len__(self) -> int:
+        return self._pending
+
+    def start(self):
+        if not self._tasks:
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def wait_for_room(self, count: int = 1):
+        """Ждёт, пока в очередях освободится место под count апдейтов."""
+        count = min(count, self.max_pending)
+        async with self._space:
+            if self._pending + count > self.max_pending:
+                SCHEDULER_BACKPRESSURE.inc()
+                await self._space.wait_for(lambda: self._pending + count <= self.max_pending)
+
+    async def submit(self, update) -> asyncio.Future:
+        """Ставит апдейт в очередь его пользователя.
+
+        Возвращает future, который завершится после обработки (с исключением
+        обработчика, если оно было). Ждать его не обязательно.
+        """
+        await self.wait_for_room()
+        self._pending += 1
+        SCHEDULER_PENDING.set(self._pending)
+
+        key = self.key(update)
+        if key is None:
+            # апдейт без пользователя ни с чем не упорядочиваем
+            key = ("update", id(update))
+        done = asyncio.get_running_loop().create_future()
+        box = self._mailboxes.get(key)
+        if box is None:
+            box = self._mailboxes[key] = deque()
+            box.append((update, time.monotonic(), done))
+            self._make_ready(key, box)
+        else:
+            # пользователь уже в полосе или его апдейт обрабатывается:
+            # воркер поставит его снова, когда закончит
+            box.append((update, time.monotonic(), done))
+        return done
+
+    def _make_ready(self, key, box: deque):
+        lane = PRIORITY if self.priority(box[0][0]) else NORMAL
+        self._lanes[lane].append(key)
+        self._ready.release()
+
+    def _next_lane(self) -> str:
+        if self._lanes[PRIORITY] and (
+            not self._lanes[NORMAL] or self._priority_streak < self.priority_burst
+        ):
+            self._priority_streak += 1
+            return PRIORITY
+        self._priority_streak = 0
+        return NORMAL
+
+    async def _worker(self):
+        while True:
+            await self._ready.acquire()
+            lane = self._next_lane()
+            key = self._lanes[lane].popleft()
+            box = self._mailboxes[key]
+            update, queued_at, done = box[0]
+            SCHEDULER_WAIT_SECONDS.labels(lane).observe(time.monotonic() - queued_at)
+
+            try:
+                await self.process(update)
+            except Exception as e:
+                logging.exception(f"Update {getattr(update, 'update_id', None)} failed: {e!r}")
+                if not done.done():
+                    done.set_exception(e)
+                    # исключение уже в логе; помечаем его как прочитанное
+                    done.exception()
+            except asyncio.CancelledError:
+                if not done.done():
+                    done.cancel()
+                raise
+            else:
+                if not done.done():
+                    done.set_result(None)
+            finally:
+                box.popleft()
+                if box:
+                    self._make_ready(key, box)
+                else:
+                    del self._mailboxes[key]
+                await self._release()
+
+    async def _release(self):
+        async with self._space:
+            self._pending -= 1
+            SCHEDULER_PENDING.set(self._pending)
+            self._space.notify_all()
+
+    async def close(self, timeout: float = 10.0):
+        """Даёт воркерам доделать очередь (не дольше timeout) и останавливает их."""
+        if self._pending:
+            try:
+                async with self._space:
+                    await asyncio.wait_for(self._space.wait_for(lambda: self._pending == 0), timeout)
+            except asyncio.TimeoutError:
+                logging.warning(f"Scheduler stopped with {self._pending} updates left in the queue")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        for box in self._mailboxes.values():
+            for _, _, done in box:
+                done.cancel()
@@ -0,0 +1,344 @@
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+
+# --- Per-user session ---
+
+class UserSession:
+    """Состояние диалога одного пользователя: язык, анкета и поиск."""
+
+    __slots__ = (
+        "lang",
+        "add_state",
+        "add_data",
+        "add_substate",
+        "add_empty_field",
+        "add_submission_key",
+        "search_state",
+        "search_results",
+    )
+
+    def __init__(self):
+        self.lang = None              # язык пользователя
+        self.add_state = None         # шаг анкеты по собаке (ADD_STATE_*)
+        self.add_data = {}            # временные данные анкеты
+        self.add_substate = None      # подстатус, например подтверждение пустого поля
+        self.add_empty_field = None   # какое поле сейчас подтверждаем как пустое
+        self.add_submission_key = None  # ключ анкеты для идемпотентного сохранения
+        self.search_state = None      # "dog_name" или None
+        self.search_results = []      # последние результаты поиска
+
+    def reset_add_case(self):
+        self.add_state = None
+        self.add_data = {}
+        self.add_substate = None
+        self.add_empty_field = None
+        self.add_submission_key = None
+
+    def reset_search(self):
+        self.search_state = None
+        self.search_results = []
+
+    def reset_dog_flow(self):
+        self.reset_add_case()
+        self.reset_search()
+
+    def has_form(self) -> bool:
+        return self.add_state is not None or bool(self.add_data)
+
+    def has_search(self) -> bool:
+        return self.search_state is not None or bool(self.search_results)
+
+    def to_dict(self) -> dict:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UserSession":
+        session = cls()
+        for name in cls.__slots__:
+            if name in data:
+                setattr(session, name, data[name])
+        return session
+
+    def dumps(self) -> str:
+        return json.dumps(self.to_dict(), ensure_ascii=False, sort_keys=True)
+
+
+# --- Stores ---
+
+DEFAULT_SESSION_TTL = 7 * 24 * 3600
+DEFAULT_FORM_TTL = 24 * 3600
+DEFAULT_SEARCH_TTL = 30 * 60
+
+
+class MemorySessionStore:
+    """Сессии в памяти процесса.
+
+    Ограничения по времени простоя (от меньшего к большему):
+    search_ttl - сбрасываются результаты поиска, form_ttl - брошенная анкета,
+    ttl - сессия удаляется целиком. При превышении max_size вытесняется
+    самая давно использованная сессия. Счётчики вытеснений лежат в stats.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_SESSION_TTL,
+        max_size: int = 10_000,
+        form_ttl: float = DEFAULT_FORM_TTL,
+        search_ttl: float = DEFAULT_SEARCH_TTL,
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.form_ttl = min(form_ttl, ttl)
+        self.search_ttl = min(search_ttl, self.form_ttl)
+        self._sessions = OrderedDict()  # uid -> (UserSession, last access)
+        self._sweeper = None
+        self.stats = {
+            "sessions_expired": 0,     # удалены по ttl
+            "sessions_overflow": 0,    # вытеснены по max_size
+            "forms_expired": 0,        # сброшены брошенные анкеты
+            "searches_expired": 0,     # сброшены результаты поиска
+        }
+
+    def get(self, uid: int) -> UserSession:
+        """Сессия из кэша; новая пустая, если её нет."""
+        now = time.monotonic()
+        entry = self._sessions.get(uid)
+        if entry is not None and now - entry[1] <= self.ttl:
+            session = entry[0]
+            self._expire_parts(session, now - entry[1])
+        else:
+            if entry is not None:
+                self.stats["sessions_expired"] += 1
+            session = UserSession()
+        self._put(uid, session, now)
+        return session
+
+    def _put(self, uid: int, session: UserSession, now: float):
+        self._sessions[uid] = (session, now)
+        self._sessions.move_to_end(uid)
+        self._evict(now)
+
+    def _evict(self, now: float):
+        # записи упорядочены по последнему обращению: просроченные в начале
+        while self._sessions:
+            uid, (_, touched) = next(iter(self._sessions.items()))
+            if now - touched > self.ttl:
+                self.stats["sessions_expired"] += 1
+            elif len(self._sessions) > self.max_size:
+                self.stats["sessions_overflow"] += 1
+            else:
+                break
+            self._sessions.popitem(last=False)
+            self._forget(uid)
+
+    def _forget(self, uid: int):
+        pass
+
+    def _expire_parts(self, session: UserSession, idle: float):
+        if idle > self.search_ttl and session.has_search():
+            session.reset_search()
+            self.stats["searches_expired"] += 1
+        if idle > self.form_ttl and session.has_form():
+            session.reset_add_case()
+            self.stats["forms_expired"] += 1
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    async def sweep(self):
+        """Проходит по давно неактивным сессиям и освобождает память."""
+        now = time.monotonic()
+        self._evict(now)
+        for session, touched in list(self._sessions.values()):
+            idle = now - touched
+            if idle <= self.search_ttl:
+                break
+            self._expire_parts(session, idle)
+
+    def start_sweeper(self, interval: float):
+        """Запускает фоновую очистку на текущем event loop."""
+        if self._sweeper is None:
+            self._sweeper = asyncio.get_event_loop().create_task(self._sweep_forever(interval))
+
+    async def _sweep_forever(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            before = dict(self.stats)
+            try:
+                await self.sweep()
+            except Exception:
+                logging.exception("Session sweep failed")
+                continue
+            evicted = {k: v - before[k] for k, v in self.stats.items() if v != before[k]}
+            if evicted:
+                logging.info(f"Session sweep: {evicted}, sessions in memory={len(self)}")
+
+    async def load(self, uid: int) -> UserSession:
+        return self.get(uid)
+
+    async def save(self, uid: int, session: UserSession):
+        pass
+
+    async def close(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            self._sweeper = None
+        self._sessions.clear()
+
+
+# updated_at в sessions - время последнего обращения. Если сессия не
+# менялась, метка обновляется не на каждом апдейте, а когда отстанет больше
+# чем на эту долю search_ttl: одна лишняя запись в несколько минут вместо
+# записи на каждый апдейт.
+ACCESS_REFRESH_FRACTION = 0.1
+
+
+class SQLiteSessionStore(MemorySessionStore):
+    """Сессии в таблице sessions.
+
+    Перед каждым апдейтом сессия читается из базы (поиск по первичному
+    ключу), после него записывается, если изменилась или если пора обновить
+    время обращения. Сроки жизни, как и в памяти, считаются от последнего
+    обращения. Незаконченные анкеты переживают перезапуск и видны всем
+    процессам с той же базой.
+    """
+
+    def __init__(self, engine: AsyncEngine, **limits):
+        super().__init__(**limits)
+        self.engine = engine
+        self.write_engine = engine.execution_options(sqlite_begin="IMMEDIATE")
+        self._saved = {}    # uid -> последнее записанное состояние (JSON)
+        self._stamped = {}  # uid -> updated_at строки в базе (None, если строки нет)
+        self.stats["rows_deleted"] = 0  # удалены из таблицы sessions по ttl
+
+    def _forget(self, uid: int):
+        self._saved.pop(uid, None)
+        self._stamped.pop(uid, None)
+
+    async def load(self, uid: int) -> UserSession:
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                text("SELECT data, updated_at FROM sessions WHERE user_id = :uid AND updated_at >= :since"),
+                {"uid": uid, "since": time.time() - self.ttl},
+            )
+            row = result.first()
+        raw, updated_at = row if row else (None, None)
+
+        if raw is None:
+            session = UserSession()
+            self._saved[uid] = session.dumps()
+            self._stamped[uid] = None
+        else:
+            try:
+                session = UserSession.from_dict(json.loads(raw))
+            except ValueError:
+                logging.warning(f"Broken session data for user={uid}, starting a new one")
+                session = UserSession()
+            self._saved[uid] = raw
+            self._stamped[uid] = updated_at
+            self._expire_parts(session, time.time() - updated_at)
+
+        self._put(uid, session, time.monotonic())
+        return session
+
+    async def save(self, uid: int, session: UserSession):
+        raw = session.dumps()
+        now = time.time()
+        if self._saved.get(uid) == raw:
+            stamped = self._stamped.get(uid)
+            if stamped is None or now - stamped < self.search_ttl * ACCESS_REFRESH_FRACTION:
+                return
+            # сессия не менялась, но пользователь активен: сдвигаем время обращения
+            async with self.write_engine.begin() as connection:
+                await connection.execute(
+                    text("UPDATE sessions SET updated_at = :now WHERE user_id = :uid"),
+                    {"uid": uid, "now": now},
+                )
+            self._stamped[uid] = now
+            return
+
+        async with self.write_engine.begin() as connection:
+            await connection.execute(
+                text(
+                    """
+                    INSERT INTO sessions (user_id, data, updated_at)
+                    VALUES (:uid, :data, :now)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        data = excluded.data,
+                        updated_at = excluded.updated_at
+                    """
+                ),
+                {"uid": uid, "data": raw, "now": now},
+            )
+        self._saved[uid] = raw
+        self._stamped[uid] = now
+
+    async def sweep(self):
+        """Чистит таблицу sessions: удаляет сессии, к которым не обращались
+        дольше ttl, и сбрасывает брошенные анкеты и результаты поиска.
+        В памяти только вытесняет кэш: сессия всё равно перечитывается из
+        базы на каждом апдейте."""
+        self._evict(time.monotonic())
+
+        now = time.time()
+        async with self.write_engine.begin() as connection:
+            result = await connection.execute(
+                text("DELETE FROM sessions WHERE updated_at < :cutoff"),
+                {"cutoff": now - self.ttl},
+            )
+            self.stats["rows_deleted"] += max(result.rowcount, 0)
+
+            result = await connection.execute(
+                text(
+                    """
+                    UPDATE sessions
+                    SET data = json_set(data,
+                                        '$.add_state', NULL,
+                                        '$.add_data', json('{}'),
+                                        '$.add_substate', NULL,
+                                        '$.add_empty_field', NULL,
+                                        '$.add_submission_key', NULL)
+                    WHERE updated_at < :cutoff
+                      AND (json_extract(data, '$.add_state') IS NOT NULL
+                           OR json_extract(data, '$.add_data') <> '{}')
+                    """
+                ),
+                {"cutoff": now - self.form_ttl},
+            )
+            self.stats["forms_expired"] += max(result.rowcount, 0)
+
+            result = await connection.execute(
+                text(
+                    """
+                    UPDATE sessions
+                    SET data = json_set(data,
+                                        '$.search_state', NULL,
+                                        '$.search_results', json('[]'))
+                    WHERE updated_at < :cutoff
+                      AND (json_extract(data, '$.search_state') IS NOT NULL
+                           OR json_array_length(data, '$.search_results') > 0)
+                    """
+                ),
+                {"cutoff": now - self.search_ttl},
+            )
+            self.stats["searches_expired"] += max(result.rowcount, 0)
+
+    async def close(self):
+        await super().close()
+        self._saved.clear()
+        self._stamped.clear()
+
+
+def create_session_store(backend: str, engine: AsyncEngine, **limits) -> MemorySessionStore:
+    if backend == "memory":
+        return MemorySessionStore(**limits)
+    if backend == "sqlite":
+        return SQLiteSessionStore(engine, **limits)
+    raise ValueError(f"Unknown session backend: {backend!r}")
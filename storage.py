@@ -0,0 +1,681 @@
+import os
+import logging
+from dataclasses import dataclass
+from typing import Optional
+
+from sqlalchemy import bindparam, event, text
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+
+from migrations import run_migrations, table_exists
+from name_index import NameIndex, name_key
+from pedigree import URL_KEY_PREFIX, KinshipCalculator, PedigreeGraph, count_case_parents, dog_key, link_case
+from validation import CASE_FIELDS
+
+
+# --- Database URL ---
+
+DB_URL = os.getenv("EPIBOT_DB_URL", "sqlite+aiosqlite:///epibot.db")
+
+SEARCH_LIMIT = 20
+TOP_PARENTS_LIMIT = 20
+
+# насколько далеко вверх ищем общих предков для "родственных случаев"
+RELATED_DEPTH = 2
+
+# trigram-токенизатор FTS5 не умеет искать строки короче трёх символов
+FTS_MIN_QUERY = 3
+
+# столбцы cases, которые можно выгрузить; user_id - последним, его можно убрать
+EXPORT_COLUMNS = ("id", *CASE_FIELDS, "timestamp", "user_id")
+EXPORT_CHUNK_SIZE = 500
+
+# поля строки результата поиска; NameIndex держит их в памяти
+SEARCH_COLUMNS = ("id", "dog_name", "dam_name", "sire_name", "sex", "birth_date")
+
+# сколько похожих записей показываем перед сохранением и групп в /duplicates
+DUPLICATES_LIMIT = 5
+DUPLICATE_GROUPS_LIMIT = 20
+
+INSERT_CASE = text(
+    """
+    INSERT INTO cases (
+        user_id,
+        dog_name,
+        dog_pedigree_url,
+        dam_name,
+        dam_pedigree_url,
+        sire_name,
+        sire_pedigree_url,
+        sex,
+        birth_date,
+        name_key,
+        submission_key,
+        timestamp
+    )
+    VALUES (
+        :uid,
+        :dog_name,
+        :dog_pedigree_url,
+        :dam_name,
+        :dam_pedigree_url,
+        :sire_name,
+        :sire_pedigree_url,
+        :sex,
+        :birth_date,
+        :name_key,
+        :submission_key,
+        datetime('now')
+    )
+    ON CONFLICT(submission_key) DO NOTHING
+    """
+)
+
+
+# --- SQLite profile ---
+
+@dataclass(frozen=True)
+class SQLiteProfile:
+    """PRAGMA и параметры пула, которые применяются к каждому соединению."""
+
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    busy_timeout_ms: int = 5000
+    mmap_size: int = 64 * 1024 * 1024
+    cache_size_kb: int = 16 * 1024
+    pool_size: int = 5
+    max_overflow: int = 5
+
+    @classmethod
+    def from_env(cls) -> "SQLiteProfile":
+        default = cls()
+        return cls(
+            journal_mode=os.getenv("EPIBOT_SQLITE_JOURNAL_MODE", default.journal_mode),
+            synchronous=os.getenv("EPIBOT_SQLITE_SYNCHRONOUS", default.synchronous),
+            busy_timeout_ms=int(os.getenv("EPIBOT_SQLITE_BUSY_TIMEOUT_MS", default.busy_timeout_ms)),
+            mmap_size=int(os.getenv("EPIBOT_SQLITE_MMAP_SIZE", default.mmap_size)),
+            cache_size_kb=int(os.getenv("EPIBOT_SQLITE_CACHE_SIZE_KB", default.cache_size_kb)),
+            pool_size=int(os.getenv("EPIBOT_SQLITE_POOL_SIZE", default.pool_size)),
+            max_overflow=int(os.getenv("EPIBOT_SQLITE_MAX_OVERFLOW", default.max_overflow)),
+        )
+
+    def pragmas(self) -> list:
+        return [
+            f"PRAGMA journal_mode = {self.journal_mode}",
+            f"PRAGMA synchronous = {self.synchronous}",
+            f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}",
+            f"PRAGMA mmap_size = {int(self.mmap_size)}",
+            # отрицательное значение cache_size задаётся в килобайтах
+            f"PRAGMA cache_size = {-int(self.cache_size_kb)}",
+            "PRAGMA foreign_keys = ON",
+        ]
+
+
+# Настройки SQLite по умолчанию: rollback journal и fsync на каждый коммит
+# (busy_timeout как у модуля sqlite3). Нужны для сравнения в benchmarks/bench_sqlite.py.
+BASELINE_PROFILE = SQLiteProfile(
+    journal_mode="DELETE",
+    synchronous="FULL",
+    busy_timeout_ms=5000,
+    mmap_size=0,
+    cache_size_kb=2000,
+)
+
+
+def create_engine_for(url: str = DB_URL, profile: Optional[SQLiteProfile] = None) -> AsyncEngine:
+    profile = profile or SQLiteProfile.from_env()
+
+    kwargs = {}
+    if ":memory:" not in url:
+        kwargs.update(pool_size=profile.pool_size, max_overflow=profile.max_overflow)
+
+    engine = create_async_engine(url, echo=False, **kwargs)
+
+    # pysqlite сам решает, когда открыть транзакцию, и пропускает DDL.
+    # Отключаем это и открываем BEGIN явно, чтобы миграция и PRAGMA user_version
+    # фиксировались атомарно.
+    @event.listens_for(engine.sync_engine, "connect")
+    def _configure_connection(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        for pragma in profile.pragmas():
+            cursor.execute(pragma)
+        cursor.close()
+
+    @event.listens_for(engine.sync_engine, "begin")
+    def _emit_begin(conn):
+        # пишущие транзакции берут блокировку сразу (BEGIN IMMEDIATE), иначе
+        # в WAL отложенная транзакция может получить SQLITE_BUSY при переходе
+        # от чтения к записи, не дождавшись busy_timeout
+        mode = conn.get_execution_options().get("sqlite_begin", "DEFERRED")
+        conn.exec_driver_sql(f"BEGIN {mode}")
+
+    return engine
+
+
+class CaseRepository:
+    """Асинхронный доступ к таблице cases.
+
+    Все запросы идут через aiosqlite, поэтому ожидание диска не блокирует
+    event loop диспетчера.
+    """
+
+    def __init__(self, engine: AsyncEngine):
+        self.engine = engine
+        self.write_engine = engine.execution_options(sqlite_begin="IMMEDIATE")
+        self.graph = PedigreeGraph(engine)
+        self.kinship = KinshipCalculator(self.graph)
+        self.name_index = NameIndex()
+        self.fts_enabled = False
+
+    async def init_schema(self):
+        """Доводит схему до актуальной версии через миграции."""
+        await run_migrations(self.engine)
+
+        async with self.engine.connect() as connection:
+            self.fts_enabled = await table_exists(connection, "cases_fts")
+            await self._load_name_index(connection)
+
+    async def _load_name_index(self, connection):
+        result = await connection.execute(
+            text(f"SELECT {', '.join(SEARCH_COLUMNS)}, name_key FROM cases")
+        )
+        for row in result.mappings():
+            row = dict(row)
+            self.name_index.add(row["id"], row.pop("name_key") or "", row)
+        self.name_index.loaded = True
+        logging.info(f"Name index loaded: {len(self.name_index)} cases")
+
+    def _index_case(self, case_id: int, case: dict):
+        row = {name: case.get(name) for name in SEARCH_COLUMNS}
+        row["id"] = case_id
+        self.name_index.add(case_id, case["name_key"], row)
+
+    async def save_case(
+        self,
+        user_id: int,
+        dog_name: str,
+        dog_pedigree_url: str,
+        dam_name: str,
+        dam_pedigree_url: str,
+        sire_name: str,
+        sire_pedigree_url: str,
+        sex: str,
+        birth_date: str,
+        submission_key: Optional[str] = None,
+    ) -> int:
+        """Сохраняет данные по собаке в SQLite и возвращает id записи.
+
+        В той же транзакции собака и её родители заносятся в граф dogs.
+        submission_key - ключ анкеты: если запись с таким ключом уже есть
+        (повторное нажатие «Сохранить», повтор апдейта), новая не создаётся
+        и возвращается id существующей.
+        """
+        case = {
+            "uid": user_id,
+            "dog_name": dog_name,
+            "dog_pedigree_url": dog_pedigree_url,
+            "dam_name": dam_name,
+            "dam_pedigree_url": dam_pedigree_url,
+            "sire_name": sire_name,
+            "sire_pedigree_url": sire_pedigree_url,
+            "sex": sex,
+            "birth_date": birth_date,
+            "name_key": name_key(dog_name),
+            "submission_key": submission_key,
+        }
+        async with self.write_engine.begin() as connection:
+            result = await connection.execute(INSERT_CASE, case)
+            if result.rowcount == 0:
+                result = await connection.execute(
+                    text("SELECT id FROM cases WHERE submission_key = :key"),
+                    {"key": submission_key},
+                )
+                case_id = result.scalar()
+                logging.info(f"Case {case_id} already saved for submission {submission_key}, user={user_id}")
+                return case_id
+
+            case_id = result.lastrowid
+            touched = await link_case(connection, case_id, case)
+            await count_case_parents(connection, case_id, 1)
+        self.graph.invalidate(touched)
+        self._index_case(case_id, case)
+        logging.info(f"Saved case for user={user_id}, dog='{dog_name}'")
+        return case_id
+
+    async def import_cases(self, cases: list, user_id: int) -> list:
+        """Сохраняет пачку уже проверенных записей одной транзакцией.
+
+        Записи вставляются одним executemany, затем каждая, как в save_case,
+        заносится в граф dogs и в parent_stats. Возвращает id новых записей.
+        """
+        if not cases:
+            return []
+
+        rows = [{"uid": user_id, **{field: case.get(field) or "" for field in CASE_FIELDS}} for case in cases]
+        for row in rows:
+            row["name_key"] = name_key(row["dog_name"])
+            row["submission_key"] = None
+        touched = set()
+        async with self.write_engine.begin() as connection:
+            # транзакция пишущая (BEGIN IMMEDIATE), поэтому все id больше
+            # текущего максимума - это наши строки в порядке вставки
+            result = await connection.execute(text("SELECT COALESCE(MAX(id), 0) FROM cases"))
+            last_id = result.scalar()
+
+            await connection.execute(INSERT_CASE, rows)
+
+            result = await connection.execute(
+                text("SELECT id FROM cases WHERE id > :last_id ORDER BY id"),
+                {"last_id": last_id},
+            )
+            case_ids = result.scalars().all()
+            if len(case_ids) != len(rows):
+                raise RuntimeError(f"Imported {len(rows)} cases but found {len(case_ids)} new rows")
+
+            for case_id, case in zip(case_ids, rows):
+                touched |= await link_case(connection, case_id, case)
+                await count_case_parents(connection, case_id, 1)
+        self.graph.invalidate(touched)
+        for case_id, case in zip(case_ids, rows):
+            self._index_case(case_id, case)
+        logging.info(f"Imported {len(case_ids)} cases for user={user_id}")
+        return case_ids
+
+    @staticmethod
+    async def _delete_cases(connection, case_ids: list):
+        # сначала снимаем учёт в parent_stats: он читает dam_id/sire_id удаляемых строк
+        for case_id in case_ids:
+            await count_case_parents(connection, case_id, -1)
+        if case_ids:
+            await connection.execute(
+                text("DELETE FROM cases WHERE id IN :case_ids").bindparams(
+                    bindparam("case_ids", expanding=True)
+                ),
+                {"case_ids": list(case_ids)},
+            )
+
+    async def delete_case_by_dog_name(self, name: str) -> int:
+        """Удаляет записи из SQLite по имени собаки."""
+        async with self.write_engine.begin() as connection:
+            result = await connection.execute(
+                text("SELECT id FROM cases WHERE dog_name = :name"),
+                {"name": name},
+            )
+            case_ids = result.scalars().all()
+            await self._delete_cases(connection, case_ids)
+        for case_id in case_ids:
+            self.name_index.remove(case_id)
+        logging.info(f"Deleted cases with dog_name='{name}'")
+        return len(case_ids)
+
+    async def find_duplicates(
+        self,
+        dog_name: str,
+        dog_pedigree_url: str,
+        birth_date: str,
+        limit: int = DUPLICATES_LIMIT,
+    ) -> list:
+        """Уже сохранённые записи, похожие на эту же собаку.
+
+        Совпадение - та же ссылка на родословную (после канонизации, через
+        уникальный dogs.dog_key и индекс cases.dog_id) или тот же name_key и
+        дата рождения (составной индекс). Кличка без даты дублем не
+        считается: одинаковых кличек слишком много. Новые записи первыми.
+        """
+        url_key = dog_key("", dog_pedigree_url) if (dog_pedigree_url or "").strip() else None
+        key = name_key(dog_name)
+        birth_date = (birth_date or "").strip()
+        if not (key and birth_date):
+            key = None
+        if url_key is None and key is None:
+            return []
+
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                text(
+                    """
+                    SELECT id, dog_name, dam_name, sire_name, sex, birth_date
+                    FROM cases
+                    WHERE dog_id = (SELECT id FROM dogs WHERE dog_key = :url_key)
+                    UNION
+                    SELECT id, dog_name, dam_name, sire_name, sex, birth_date
+                    FROM cases
+                    WHERE name_key = :name_key AND birth_date = :birth_date
+                    ORDER BY id DESC
+                    LIMIT :limit
+                    """
+                ),
+                {"url_key": url_key, "name_key": key, "birth_date": birth_date, "limit": limit},
+            )
+            return [dict(r) for r in result.mappings()]
+
+    async def duplicate_groups(self, limit: int = DUPLICATE_GROUPS_LIMIT) -> list:
+        """Группы записей, похожих на одну собаку, для ручного слияния.
+
+        Признаки те же, что в find_duplicates: общая собака в dogs по
+        ссылке на родословную или одинаковые name_key и дата рождения;
+        пересекающиеся группы объединяются. Возвращает списки строк cases
+        по возрастанию id, группы - по id первой записи.
+        """
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                text(
+                    """
+                    SELECT GROUP_CONCAT(id) FROM cases
+                    WHERE dog_id IN (SELECT id FROM dogs WHERE dog_key LIKE :url_prefix)
+                    GROUP BY dog_id HAVING COUNT(*) > 1
+                    UNION ALL
+                    SELECT GROUP_CONCAT(id) FROM cases
+                    WHERE name_key <> '' AND birth_date <> ''
+                    GROUP BY name_key, birth_date HAVING COUNT(*) > 1
+                    """
+                ),
+                {"url_prefix": URL_KEY_PREFIX + "%"},
+            )
+            # объединение пересекающихся групп: id -> представитель группы
+            parent = {}
+
+            def find(case_id):
+                while parent.setdefault(case_id, case_id) != case_id:
+                    parent[case_id] = parent[parent[case_id]]
+                    case_id = parent[case_id]
+                return case_id
+
+            for (ids,) in result:
+                first, *rest = (int(case_id) for case_id in ids.split(","))
+                for case_id in rest:
+                    parent[find(case_id)] = find(first)
+
+            groups = {}
+            for case_id in parent:
+                groups.setdefault(find(case_id), []).append(case_id)
+            shown = sorted((sorted(ids) for ids in groups.values()), key=lambda ids: ids[0])[:limit]
+            if not shown:
+                return []
+
+            result = await connection.execute(
+                text(
+                    """
+                    SELECT id, user_id, dog_name, dog_pedigree_url, birth_date, timestamp
+                    FROM cases
+                    WHERE id IN :case_ids
+                    """
+                ).bindparams(bindparam("case_ids", expanding=True)),
+                {"case_ids": [case_id for ids in shown for case_id in ids]},
+            )
+            rows = {r["id"]: dict(r) for r in result.mappings()}
+        return [[rows[case_id] for case_id in ids] for ids in shown]
+
+    async def merge_cases(self, keep_id: int, duplicate_ids: list) -> Optional[dict]:
+        """Сливает записи duplicate_ids в keep_id одной транзакцией.
+
+        Пустые поля keep_id заполняются из дублей (по возрастанию id), дубли
+        удаляются вместе с их учётом в parent_stats. Если запись изменилась,
+        она заново привязывается к графу dogs. Возвращает {"id", "merged",
+        "filled"} или None, если keep_id нет.
+        """
+        duplicate_ids = sorted(set(duplicate_ids) - {keep_id})
+        columns = ("id", *CASE_FIELDS)
+        touched = set()
+        async with self.write_engine.begin() as connection:
+            result = await connection.execute(
+                text(f"SELECT {', '.join(columns)} FROM cases WHERE id IN :case_ids ORDER BY id").bindparams(
+                    bindparam("case_ids", expanding=True)
+                ),
+                {"case_ids": [keep_id, *duplicate_ids]},
+            )
+            rows = {r["id"]: dict(r) for r in result.mappings()}
+            merged = rows.pop(keep_id, None)
+            if merged is None:
+                return None
+
+            filled = []
+            for duplicate in rows.values():
+                for field in CASE_FIELDS:
+                    if not (merged[field] or "").strip() and (duplicate[field] or "").strip():
+                        merged[field] = duplicate[field]
+                        filled.append(field)
+
+            await self._delete_cases(connection, list(rows))
+
+            if filled:
+                merged["name_key"] = name_key(merged["dog_name"])
+                await count_case_parents(connection, keep_id, -1)
+                await connection.execute(
+                    text(
+                        f"""
+                        UPDATE cases
+                        SET {', '.join(f"{field} = :{field}" for field in (*CASE_FIELDS, "name_key"))}
+                        WHERE id = :id
+                        """
+                    ),
+                    merged,
+                )
+                touched = await link_case(connection, keep_id, merged)
+                await count_case_parents(connection, keep_id, 1)
+
+        self.graph.invalidate(touched)
+        for case_id in rows:
+            self.name_index.remove(case_id)
+        if filled:
+            self._index_case(keep_id, merged)
+        logging.info(f"Merged cases {sorted(rows)} into {keep_id}, filled {filled}")
+        return {"id": keep_id, "merged": sorted(rows), "filled": filled}
+
+    async def get_case(self, case_id: int) -> Optional[dict]:
+        """Возвращает запись по id или None."""
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                text(
+                    """
+                    SELECT dog_name, sex, birth_date,
+                           dam_name, sire_name,
+                           dog_pedigree_url, dam_pedigree_url, sire_pedigree_url,
+                           dog_id
+                    FROM cases
+                    WHERE id = :cid
+                    """
+                ),
+                {"cid": case_id},
+            )
+            row = result.mappings().fetchone()
+        return dict(row) if row else None
+
+    async def search_by_dog_name(self, q: str, limit: int = SEARCH_LIMIT) -> list:
+        """Ищет собак по кличке.
+
+        Объединяет два поиска: подстроку через cases_fts (ранжирование по
+        bm25, при равном ранге свежие записи первыми) или LIKE и нечёткий
+        поиск по name_key в памяти, который находит кличку в другой
+        раскладке, без приставки питомника и с опечаткой. Первыми идут
+        точные совпадения, затем клички, содержащие запрос, затем остальные
+        нечёткие.
+        """
+        rows = {}
+        for row in await self._search_substring(q, limit):
+            rows.setdefault(row["id"], row)
+        if self.name_index.loaded:
+            for row in self.name_index.search(q, limit):
+                rows.setdefault(row["id"], row)
+
+        needle = q.strip().casefold()
+
+        def rank(row) -> int:
+            name = (row["dog_name"] or "").strip().casefold()
+            if name == needle:
+                return 0
+            return 1 if needle in name else 2
+
+        # сортировка устойчива: внутри группы сохраняется порядок источников
+        return sorted(rows.values(), key=rank)[:limit]
+
+    async def _search_substring(self, q: str, limit: int) -> list:
+        if not self.fts_enabled or len(q) < FTS_MIN_QUERY:
+            return await self._search_like(q, limit)
+
+        # фраза в кавычках: trigram ищет её как подстроку без разбора синтаксиса MATCH
+        match = '"' + q.replace('"', '""') + '"'
+
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                text(
+                    """
+                    SELECT c.id, c.dog_name, c.dam_name, c.sire_name, c.sex, c.birth_date
+                    FROM cases_fts
+                    JOIN cases c ON c.id = cases_fts.rowid
+                    WHERE cases_fts MATCH :match
+                    ORDER BY cases_fts.rank, c.timestamp DESC
+                    LIMIT :limit
+                    """
+                ),
+                {"match": match, "limit": limit},
+            )
+            rows = result.mappings().fetchall()
+        return [dict(r) for r in rows]
+
+    async def _search_like(self, q: str, limit: int) -> list:
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                text(
+                    """
+                    SELECT id, dog_name, dam_name, sire_name, sex, birth_date
+                    FROM cases
+                    WHERE LOWER(dog_name) LIKE '%' || LOWER(:q) || '%'
+                    ORDER BY timestamp DESC
+                    LIMIT :limit
+                    """
+                ),
+                {"q": q, "limit": limit},
+            )
+            rows = result.mappings().fetchall()
+        return [dict(r) for r in rows]
+
+    async def related_cases(self, dog_id: int, depth: int = RELATED_DEPTH, limit: int = SEARCH_LIMIT) -> list:
+        """Другие случаи среди родственников до depth поколений: предки,
+        потомки и собаки с общим родителем или дедом.
+
+        Каждый элемент - запись cases плюс relation ("ancestor", "offspring"
+        или "relative") и via_id/via_name - ближайший общий предок.
+        """
+        relatives = {}  # dog_id -> (поколение, relation, id общего предка)
+
+        ancestors = await self.graph.ancestors(dog_id, depth)
+        for ancestor, generation in ancestors.items():
+            relatives[ancestor] = (generation, "ancestor", None)
+
+        for descendant, generation in (await self.graph.descendants(dog_id, depth)).items():
+            relatives.setdefault(descendant, (generation, "offspring", None))
+
+        for ancestor, generation in sorted(ancestors.items(), key=lambda item: item[1]):
+            for relative in await self.graph.descendants(ancestor, generation):
+                if relative != dog_id and relative not in relatives:
+                    relatives[relative] = (generation, "relative", ancestor)
+
+        if not relatives:
+            return []
+
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                text(
+                    """
+                    SELECT id, dog_name, dam_name, sire_name, sex, birth_date, dog_id
+                    FROM cases
+                    WHERE dog_id IN :dog_ids
+                    ORDER BY timestamp DESC
+                    """
+                ).bindparams(bindparam("dog_ids", expanding=True)),
+                {"dog_ids": list(relatives)},
+            )
+            rows = [dict(r) for r in result.mappings()]
+
+        rows.sort(key=lambda r: relatives[r["dog_id"]][0])
+        rows = rows[:limit]
+
+        names = await self.graph.names({relatives[r["dog_id"]][2] for r in rows} - {None})
+        for row in rows:
+            _, relation, via_id = relatives[row["dog_id"]]
+            row["relation"] = relation
+            row["via_id"] = via_id
+            row["via_name"] = names.get(via_id)
+        return rows
+
+    async def top_parents(self, limit: int = TOP_PARENTS_LIMIT) -> list:
+        """Родители с наибольшим числом больных потомков (по parent_stats)."""
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                text(
+                    """
+                    SELECT ps.parent_id, d.name, ps.role, ps.affected_offspring, ps.litters
+                    FROM parent_stats ps
+                    JOIN dogs d ON d.id = ps.parent_id
+                    WHERE ps.affected_offspring > 0
+                    ORDER BY ps.affected_offspring DESC, ps.litters DESC
+                    LIMIT :limit
+                    """
+                ),
+                {"limit": limit},
+            )
+            return [dict(r) for r in result.mappings()]
+
+    async def find_dog(self, query: str) -> Optional[dict]:
+        """Ищет собаку в графе по ссылке на родословную или по кличке."""
+        query = (query or "").strip()
+        if query.lower().startswith(("http://", "https://")):
+            key = dog_key("", query)
+        else:
+            key = dog_key(query)
+        if key is None:
+            return None
+
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                text("SELECT id, name FROM dogs WHERE dog_key = :key"),
+                {"key": key},
+            )
+            row = result.mappings().first()
+            if row is None:
+                # собака могла попасть в граф по ссылке, а ищут её по кличке
+                result = await connection.execute(
+                    text("SELECT id, name FROM dogs WHERE name = :name COLLATE NOCASE ORDER BY id LIMIT 1"),
+                    {"name": query},
+                )
+                row = result.mappings().first()
+        return dict(row) if row else None
+
+    async def affected_dog_ids(self, dog_ids) -> set:
+        """Из переданных собак возвращает тех, по кому есть записи в cases."""
+        dog_ids = list(dog_ids)
+        if not dog_ids:
+            return set()
+        async with self.engine.connect() as connection:
+            result = await connection.execute(
+                text("SELECT DISTINCT dog_id FROM cases WHERE dog_id IN :dog_ids").bindparams(
+                    bindparam("dog_ids", expanding=True)
+                ),
+                {"dog_ids": dog_ids},
+            )
+            return {row[0] for row in result}
+
+    async def stream_cases(self, columns=EXPORT_COLUMNS, chunk_size: int = EXPORT_CHUNK_SIZE):
+        """Асинхронный генератор: все записи cases пачками по chunk_size.
+
+        Строки читаются серверным курсором (yield_per), вся таблица в памяти
+        не собирается. В WAL долгое чтение не мешает записи.
+        """
+        unknown = set(columns) - set(EXPORT_COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown cases columns: {sorted(unknown)}")
+
+        statement = text(f"SELECT {', '.join(columns)} FROM cases ORDER BY id")
+        async with self.engine.connect() as connection:
+            result = await connection.stream(statement.execution_options(yield_per=chunk_size))
+            async for partition in result.mappings().partitions():
+                yield [dict(row) for row in partition]
+
+    async def ping(self):
+        """Проверка доступности базы для /readyz."""
+        async with self.engine.connect() as connection:
+            await connection.execute(text("SELECT 1"))
+
+    async def close(self):
+        await self.engine.dispose()
@@ -0,0 +1,12 @@
+import os
+import sys
+import tempfile
+
+# EpiBot настраивается через окружение при импорте: тестам нужен токен,
+# база и сессии в памяти и лог во временном каталоге, а не в репозитории
+os.environ.setdefault("EPIBOT_TOKEN", "123456:TEST-token")
+os.environ.setdefault("EPIBOT_DB_URL", "sqlite+aiosqlite:///:memory:")
+os.environ.setdefault("EPIBOT_SESSION_BACKEND", "memory")
+os.environ.setdefault("EPIBOT_LOG_FILE", os.path.join(tempfile.mkdtemp(), "epibot.log"))
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,88 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from migrations import run_migrations
+from pedigree import KinshipCalculator, KinshipTimeout, PedigreeGraph
+
+
+# id: (dam_id, sire_id). 1, 2, 6, 7, 8 - основатели;
+# 3 и 4 - полнородные (1 x 2), 3 и 5 - полусибсы по матери 1
+DOGS = {
+    1: (None, None),
+    2: (None, None),
+    6: (None, None),
+    7: (None, None),
+    8: (None, None),
+    3: (1, 2),
+    4: (1, 2),
+    5: (1, 6),
+}
+
+
+async def _mating_coi(db_path, dam_id: int, sire_id: int, **kwargs) -> float:
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    try:
+        await run_migrations(engine)
+        async with engine.begin() as connection:
+            for dog_id in sorted(DOGS):
+                dam, sire = DOGS[dog_id]
+                await connection.execute(
+                    text("INSERT INTO dogs (id, dog_key, name, dam_id, sire_id) VALUES (:id, :key, :key, :dam, :sire)"),
+                    {"id": dog_id, "key": f"name:dog{dog_id}", "dam": dam, "sire": sire},
+                )
+        kinship = KinshipCalculator(PedigreeGraph(engine))
+        report = await kinship.mating_report(dam_id, sire_id, **kwargs)
+        return report["coi"]
+    finally:
+        await engine.dispose()
+
+
+@pytest.mark.parametrize("dam_id, sire_id, expected", [
+    (3, 4, 0.25),   # полнородные брат и сестра
+    (3, 5, 0.125),  # полусибсы
+    (7, 8, 0.0),    # неродственные
+])
+def test_mating_coi(tmp_path, dam_id, sire_id, expected):
+    coi = asyncio.run(_mating_coi(tmp_path / "kinship.db", dam_id, sire_id))
+    assert coi == pytest.approx(expected)
+
+
+def test_mating_report_raises_on_deadline(tmp_path):
+    with pytest.raises(KinshipTimeout):
+        asyncio.run(_mating_coi(tmp_path / "kinship.db", 3, 4, timeout=-1))
+
+
+class FakeMessage:
+    def __init__(self, uid: int, args: str):
+        self.from_user = SimpleNamespace(id=uid)
+        self._args = args
+        self.answers = []
+
+    def get_args(self) -> str:
+        return self._args
+
+    async def answer(self, text: str, **kwargs):
+        self.answers.append(text)
+
+
+def test_coi_command_answers_timeout(monkeypatch):
+    import EpiBot
+
+    async def find_dog(query):
+        return {"id": len(query), "name": query.strip()}
+
+    async def mating_report(dam_id, sire_id):
+        raise KinshipTimeout()
+
+    monkeypatch.setattr(EpiBot.case_repo, "find_dog", find_dog)
+    monkeypatch.setattr(EpiBot.case_repo.kinship, "mating_report", mating_report)
+
+    message = FakeMessage(uid=1, args="Bella | Zorro")
+    asyncio.run(EpiBot.cmd_coi(message))
+
+    texts = EpiBot.LOCALES[EpiBot.get_user_lang(1)]
+    assert message.answers == [texts.text("coi.timeout")]
@@ -0,0 +1,63 @@
+import pytest
+
+from name_index import MIN_SCORE, NameIndex, name_key, trigrams
+
+
+@pytest.mark.parametrize("name", ["Bella", "BELLA", "Белла", "Бэлла", "Bellla"])
+def test_name_key_folds_script_case_and_doubled_letters(name):
+    assert name_key(name) == "bela"
+
+
+def test_name_key_transliterates_cyrillic_to_latin_spelling():
+    assert name_key("Аполлон") == name_key("Apollon") == "apolon"
+
+
+@pytest.mark.parametrize("name", ["Ch. Bella", "JCh Bella", "Int.Ch. Bella", "Bella del", "Bella of the"])
+def test_name_key_drops_titles_and_kennel_affixes(name):
+    assert name_key(name) == "bela"
+
+
+def test_name_key_keeps_affix_only_name():
+    assert name_key("del") == "del"
+    assert name_key("") == ""
+
+
+def _index(*names) -> NameIndex:
+    index = NameIndex()
+    for case_id, name in enumerate(names, start=1):
+        index.add(case_id, name_key(name), {"id": case_id, "dog_name": name})
+    return index
+
+
+def _ids(rows) -> list:
+    return [row["id"] for row in rows]
+
+
+def test_search_finds_typo_and_other_script():
+    index = _index("Bella del Sole", "Zorro")
+    assert _ids(index.search("Belal", 10)) == [1]
+    assert _ids(index.search("Белла", 10)) == [1]
+    assert _ids(index.search("Zoro", 10)) == [2]
+
+
+def test_search_skips_matches_below_min_score():
+    index = _index("Zorro")
+    shared = trigrams(name_key("Borro")) & trigrams(name_key("Zorro"))
+    assert len(shared) < MIN_SCORE * len(trigrams(name_key("Borro")))
+    assert index.search("Borro", 10) == []
+
+
+def test_add_replaces_and_remove_forgets():
+    index = _index("Bella", "Zorro")
+    assert len(index) == 2
+
+    index.add(1, name_key("Nora"), {"id": 1, "dog_name": "Nora"})
+    assert len(index) == 2
+    assert index.search("Bella", 10) == []
+    assert _ids(index.search("Nora", 10)) == [1]
+
+    index.remove(1)
+    index.remove(1)  # повторное удаление ничего не ломает
+    assert len(index) == 1
+    assert index.search("Nora", 10) == []
+    assert _ids(index.search("Zorro", 10)) == [2]
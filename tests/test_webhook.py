@@ -0,0 +1,105 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+from aiogram.dispatcher.webhook import BOT_DISPATCHER_KEY
+
+from scheduler import UpdateScheduler
+
+SECRET = "test-secret"
+UPDATE = {
+    "update_id": 1001,
+    "message": {
+        "message_id": 1,
+        "date": 0,
+        "chat": {"id": 42, "type": "private"},
+        "from": {"id": 42, "is_bot": False, "first_name": "Test"},
+        "text": "/start",
+    },
+}
+
+
+def _webhook_app(bot_module):
+    # то же, что делает executor.set_webhook в режиме webhook
+    web_app = bot_module.create_web_app()
+    web_app.router.add_route("*", bot_module.WEBHOOK_PATH, bot_module.SecretWebhookHandler)
+    web_app[BOT_DISPATCHER_KEY] = bot_module.dp
+    return web_app
+
+
+def _run_with_client(monkeypatch, scenario):
+    import EpiBot
+
+    monkeypatch.setattr(EpiBot, "BOT_MODE", "webhook")
+    monkeypatch.setattr(EpiBot, "WEBHOOK_SECRET", SECRET)
+
+    async def run():
+        received = asyncio.Queue()
+
+        async def process(update):
+            await received.put(update)
+
+        scheduler = UpdateScheduler(process, workers=1, max_pending=10)
+        monkeypatch.setattr(EpiBot, "update_scheduler", scheduler)
+        scheduler.start()
+        try:
+            async with TestClient(TestServer(_webhook_app(EpiBot))) as client:
+                await scenario(EpiBot, client, received)
+        finally:
+            await scheduler.close()
+
+    asyncio.run(run())
+
+
+def test_webhook_rejects_wrong_secret(monkeypatch):
+    async def scenario(bot_module, client, received):
+        response = await client.post(
+            bot_module.WEBHOOK_PATH,
+            json=UPDATE,
+            headers={"X-Telegram-Bot-Api-Secret-Token": "wrong"},
+        )
+        assert response.status == 403
+
+        response = await client.post(bot_module.WEBHOOK_PATH, json=UPDATE)
+        assert response.status == 403
+        assert received.empty()
+
+    _run_with_client(monkeypatch, scenario)
+
+
+def test_webhook_dispatches_update_with_secret(monkeypatch):
+    async def scenario(bot_module, client, received):
+        response = await client.post(
+            bot_module.WEBHOOK_PATH,
+            json=UPDATE,
+            headers={"X-Telegram-Bot-Api-Secret-Token": SECRET},
+        )
+        assert response.status == 200
+        assert await response.text() == "ok"
+
+        update = await asyncio.wait_for(received.get(), 5)
+        assert update.update_id == UPDATE["update_id"]
+        assert update.message.text == "/start"
+
+    _run_with_client(monkeypatch, scenario)
+
+
+def test_health_and_readiness(monkeypatch):
+    async def scenario(bot_module, client, received):
+        response = await client.get("/healthz")
+        assert response.status == 200
+        assert await response.text() == "OK"
+
+        # setWebhook ещё не прошёл: бот жив, но не готов
+        monkeypatch.setattr(bot_module, "webhook_ready", False)
+        response = await client.get("/readyz")
+        assert response.status == 503
+        body = await response.json()
+        assert body["status"] == "unavailable"
+        assert body["checks"] == {"updates": False, "database": True}
+
+        monkeypatch.setattr(bot_module, "webhook_ready", True)
+        response = await client.get("/readyz")
+        assert response.status == 200
+        assert (await response.json())["status"] == "ok"
+
+    _run_with_client(monkeypatch, scenario)
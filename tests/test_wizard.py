@@ -0,0 +1,32 @@
+import pytest
+
+from validation import PEDIGREE_PREFIX
+from wizard import Step, Wizard
+
+
+SAMPLES = {
+    "dog_pedigree_url": PEDIGREE_PREFIX + "dog/1",
+    "dam_pedigree_url": PEDIGREE_PREFIX + "dog/2",
+    "sire_pedigree_url": PEDIGREE_PREFIX + "dog/3",
+    "birth_date": "2020.01.01",
+}
+
+
+def test_add_case_walks_every_path():
+    import EpiBot
+    from i18n import DEFAULT_LANG
+
+    bundle = EpiBot.LOCALES[DEFAULT_LANG]
+    EpiBot.ADD_CASE.check(samples=SAMPLES, text_keys=bundle.texts, keyboards=bundle.keyboards)
+
+
+def test_structure_rejects_dangling_step():
+    wizard = Wizard([Step("a", "t", "k", next="missing")])
+    with pytest.raises(RuntimeError, match="unknown step"):
+        wizard.check_structure()
+
+
+def test_structure_rejects_unknown_locale_text():
+    wizard = Wizard([Step("a", "step.missing", "k")])
+    with pytest.raises(RuntimeError, match="unknown text"):
+        wizard.check_structure(text_keys={"step.present"})
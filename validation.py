@@ -0,0 +1,81 @@
+import re
+from datetime import datetime
+
+
+# --- Case validation ---
+# Проверки анкеты. Ими пользуются и пошаговый ввод в боте, и импорт из файла.
+
+PEDIGREE_PREFIX = "https://canecorsopedigree.com/"
+
+# поля записи cases, которые заполняет анкета
+CASE_FIELDS = (
+    "dog_name",
+    "dog_pedigree_url",
+    "dam_name",
+    "dam_pedigree_url",
+    "sire_name",
+    "sire_pedigree_url",
+    "sex",
+    "birth_date",
+)
+URL_FIELDS = ("dog_pedigree_url", "dam_pedigree_url", "sire_pedigree_url")
+
+
+def is_valid_birth_date(s: str) -> bool:
+    if not re.fullmatch(r"\d{4}\.\d{2}\.\d{2}", s):
+        return False
+    year = int(s[0:4])
+    month = int(s[5:7])
+    day = int(s[8:10])
+    try:
+        datetime(year, month, day)
+    except ValueError:
+        return False
+    return True
+
+
+def is_valid_pedigree_url(url: str) -> bool:
+    return url.startswith(PEDIGREE_PREFIX)
+
+
+def is_case_minimal_ok(data: dict) -> bool:
+    dog_name = (data.get("dog_name") or "").strip()
+    if not dog_name:
+        return False
+
+    links = [
+        (data.get("dog_pedigree_url") or "").strip(),
+        (data.get("dam_pedigree_url") or "").strip(),
+        (data.get("sire_pedigree_url") or "").strip(),
+    ]
+    has_link = any(links)
+
+    if has_link:
+        return True
+
+    dam_name = (data.get("dam_name") or "").strip()
+    sire_name = (data.get("sire_name") or "").strip()
+    if not dam_name or not sire_name:
+        return False
+
+    return True
+
+
+def case_errors(case: dict) -> list:
+    """Все причины, по которым запись нельзя сохранить; пустой список - можно.
+
+    Проверки те же, что при пошаговом вводе: ссылки, дата, минимальный набор.
+    """
+    errors = []
+    for field in URL_FIELDS:
+        url = (case.get(field) or "").strip()
+        if url and not is_valid_pedigree_url(url):
+            errors.append(f"{field}: link must start with {PEDIGREE_PREFIX}")
+
+    birth_date = (case.get("birth_date") or "").strip()
+    if birth_date and not is_valid_birth_date(birth_date):
+        errors.append("birth_date: expected YYYY.MM.DD")
+
+    if not is_case_minimal_ok(case):
+        errors.append("dog_name and a pedigree link or both parents are required")
+    return errors
@@ -0,0 +1,193 @@
+from dataclasses import dataclass, field
+from itertools import product
+from typing import Callable, NamedTuple, Optional
+
+
+# --- Step-by-step form engine ---
+# Анкета описывается таблицей шагов: какие поля шаг заполняет, чем они
+# проверяются, куда ведут «Назад» и «Далее», какой текст и клавиатура у
+# экрана. Wizard по этой таблице решает, что делать с сообщением или
+# нажатием кнопки; отрисовкой и отправкой занимается бот.
+
+
+@dataclass(frozen=True)
+class Step:
+    state: str
+    text_key: str                 # текст экрана из локали
+    keyboard: str                 # имя клавиатуры из локали
+    prev: Optional[str] = None    # None - «Назад» выходит из анкеты
+    next: Optional[str] = None    # None - последний шаг
+    # поля заполняются сообщениями по очереди: первое пустое, а когда все
+    # заполнены - последнее перезаписывается
+    fields: tuple = ()
+    # поле -> (проверка, ключ текста ошибки)
+    validators: dict = field(default_factory=dict)
+    # поле -> ключ текста ошибки, если без него нельзя идти дальше
+    required: dict = field(default_factory=dict)
+    # если все эти поля пустые, перед переходом спрашиваем подтверждение
+    confirm_empty: tuple = ()
+    # render(lang, data) -> текст, если экран зависит от данных анкеты
+    render: Optional[Callable] = None
+
+
+# что делать после ввода или нажатия кнопки
+STAY = "stay"            # остаться на шаге и перерисовать экран
+MOVE = "move"            # перейти на шаг target
+EXIT = "exit"            # выйти из анкеты
+ERROR = "error"          # показать ошибку target, шаг не меняется
+ASK_EMPTY = "ask_empty"  # спросить, оставить ли шаг пустым
+PROMPT = "prompt"        # шаг не принимает текст: повторить подсказку
+
+
+class Transition(NamedTuple):
+    action: str
+    target: Optional[str] = None
+
+
+def _fail(message: str):
+    raise RuntimeError(f"Wizard table: {message}")
+
+
+class Wizard:
+    def __init__(self, steps: list):
+        self.steps = {step.state: step for step in steps}
+        self.first = steps[0].state
+
+    def step(self, state) -> Step:
+        # неизвестный или потерянный шаг - начинаем с первого
+        return self.steps.get(state) or self.steps[self.first]
+
+    def blank_data(self) -> dict:
+        data = {}
+        for step in self.steps.values():
+            for name in (*step.fields, *step.required, *step.confirm_empty):
+                data.setdefault(name, "")
+        return data
+
+    def accept_input(self, state, data: dict, text: str) -> Transition:
+        """Кладёт текст сообщения в поле текущего шага."""
+        step = self.step(state)
+        if not step.fields:
+            return Transition(PROMPT)
+
+        name = next((f for f in step.fields if not (data.get(f) or "").strip()), step.fields[-1])
+        check = step.validators.get(name)
+        if check is not None and not check[0](text):
+            return Transition(ERROR, check[1])
+
+        data[name] = text
+        return Transition(STAY)
+
+    def next(self, state, data: dict, confirmed: bool = False) -> Transition:
+        """«Далее». confirmed - пользователь согласился оставить шаг пустым."""
+        step = self.step(state)
+        for name, error_key in step.required.items():
+            if not (data.get(name) or "").strip():
+                return Transition(ERROR, error_key)
+
+        if step.next is None:
+            return Transition(STAY)
+
+        if (
+            not confirmed
+            and step.confirm_empty
+            and not any((data.get(name) or "").strip() for name in step.confirm_empty)
+        ):
+            return Transition(ASK_EMPTY, step.state)
+
+        return Transition(MOVE, step.next)
+
+    def back(self, state) -> Transition:
+        step = self.step(state)
+        if step.prev is None:
+            return Transition(EXIT)
+        return Transition(MOVE, step.prev)
+
+    def check_structure(self, text_keys=None, keyboards=None) -> str:
+        """Быстрая проверка таблицы, безопасная для старта бота.
+
+        text_keys, keyboards: если заданы, экраны и тексты ошибок шагов
+        должны в них быть. Проверяет, что «Назад» и «Далее» ведут в
+        существующие шаги и друг другу соответствуют, а все шаги достижимы
+        от первого без циклов. Возвращает последний шаг; ошибка -
+        RuntimeError.
+        """
+        for step in self.steps.values():
+            if text_keys is not None and step.text_key not in text_keys:
+                _fail(f"step {step.state!r} uses unknown text {step.text_key!r}")
+            if keyboards is not None and step.keyboard not in keyboards:
+                _fail(f"step {step.state!r} uses unknown keyboard {step.keyboard!r}")
+            errors = [error for _, error in step.validators.values()] + list(step.required.values())
+            if text_keys is not None and not set(errors) <= set(text_keys):
+                _fail(f"step {step.state!r} uses unknown error texts {sorted(set(errors) - set(text_keys))}")
+            for target in (step.prev, step.next):
+                if target is not None and target not in self.steps:
+                    _fail(f"step {step.state!r} refers to unknown step {target!r}")
+            if step.next is not None and self.steps[step.next].prev != step.state:
+                _fail(f"step {step.next!r} must go back to {step.state!r}")
+            unknown = set(step.validators) - set(step.fields)
+            if unknown:
+                _fail(f"step {step.state!r} validates fields it does not accept: {sorted(unknown)}")
+
+        reachable, state = [], self.first
+        while state is not None:
+            if state in reachable:
+                _fail(f"cycle through {state!r}")
+            reachable.append(state)
+            state = self.steps[state].next
+        unreachable = set(self.steps) - set(reachable)
+        if unreachable:
+            _fail(f"steps not reachable from {self.first!r}: {sorted(unreachable)}")
+        return reachable[-1]
+
+    def check(self, samples: dict = None, text_keys=None, keyboards=None):
+        """Полная проверка таблицы для тестов: check_structure и обход всех путей.
+
+        samples: поле -> пример допустимого значения (по умолчанию "x").
+        Для каждого шага и каждого набора заполненных/пустых полей (2^N
+        вариантов) проверяет, что «Назад» после «Далее» возвращает на
+        исходный шаг, обязательные поля не пропускаются и из любого шага
+        можно дойти до последнего. Ошибка - RuntimeError.
+        """
+        samples = samples or {}
+        last = self.check_structure(text_keys, keyboards)
+
+        names = list(self.blank_data())
+        for filled in product((False, True), repeat=len(names)):
+            data = {
+                name: samples.get(name, "x") if is_filled else ""
+                for name, is_filled in zip(names, filled)
+            }
+            for state in self.steps:
+                self._check_paths(state, data, samples, last)
+
+    def _check_paths(self, state: str, data: dict, samples: dict, last: str):
+        step = self.steps[state]
+
+        moved = self.next(state, data)
+        if moved.action == ASK_EMPTY:
+            moved = self.next(state, data, confirmed=True)
+        if moved.action == MOVE:
+            for name in step.required:
+                if not data[name]:
+                    _fail(f"step {state!r} lets through an empty required field {name!r}")
+            if self.back(moved.target) != Transition(MOVE, state):
+                _fail(f"back from {moved.target!r} does not return to {state!r}")
+        elif moved.action == STAY:
+            if state != last:
+                _fail(f"next on {state!r} goes nowhere")
+        elif moved.action != ERROR:
+            _fail(f"unexpected next {moved} on {state!r}")
+
+        if self.back(state).action == EXIT and state != self.first:
+            _fail(f"back on {state!r} leaves the form")
+
+        # сообщение меняет не больше одного поля, и только поле текущего шага
+        for text in {samples.get(name, "x") for name in step.fields} or {"x"}:
+            after = dict(data)
+            result = self.accept_input(state, after, text)
+            changed = {name for name in after if after[name] != data[name]}
+            if result.action not in (STAY, ERROR, PROMPT):
+                _fail(f"unexpected input result {result} on {state!r}")
+            if len(changed) > 1 or changed - set(step.fields):
+                _fail(f"input on {state!r} changed {sorted(changed)}")